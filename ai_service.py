@@ -1,46 +1,261 @@
+import asyncio
 import openai
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, Optional
 from config import Config
+from generation_cache import GenerationCache, make_cache_key
+from bot_classifier import BotTypeClassifier
+from template_library import TemplateLibrary, DEFAULT_CUSTOM_HANDLERS
+from code_validator import CodeValidator
+from openai_client import ResilientChatClient
+from singleflight import SingleFlight
+from response_parser import DEFAULT_REQUIREMENTS, ResponseParser, parse_response
 import json
-import re
+
+# Файлы, которые в режиме fan-out генерируются отдельными запросами:
+# имя -> (язык блока, дешевая модель, что должно быть в файле)
+FANOUT_FILES = {
+    'main.py': ('python', False, "Полный код бота на python-telegram-bot 20+: все команды и обработчики из плана, "
+                                 "обработка ошибок, логирование. Настройки импортируй из config.py (from config import Config)."),
+    'config.py': ('python', True, "Класс Config с настройками из переменных окружения (python-dotenv) - ровно те поля, что в плане."),
+    'requirements.txt': ('txt', True, "Зависимости с закрепленными версиями, по одной на строку."),
+    'README.md': ('markdown', True, "Описание бота, список команд, установка, переменные окружения и запуск."),
+}
 
 class AIService:
     def __init__(self):
         openai.api_key = Config.OPENAI_API_KEY
-        self.client = openai.OpenAI(api_key=Config.OPENAI_API_KEY)
+        self.client = openai.OpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL)
+        # Асинхронный клиент для обработчиков бота: не блокирует event loop
+        # Повторы выполняет ResilientChatClient, встроенные повторы SDK отключены
+        self.async_client = openai.AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL, max_retries=0
+        )
+        self.chat = ResilientChatClient(self.async_client)
+        # Кэш результатов: одинаковые описания не тратят квоту OpenAI
+        self.cache = GenerationCache()
+        # Генерации, которые сейчас выполняются (ключ - как у кэша)
+        self.inflight = SingleFlight()
+        self.classifier = BotTypeClassifier()
+        self.templates = TemplateLibrary()
+        self.validator = CodeValidator()
     
     def generate_bot_code(self, user_prompt: str, bot_type: str = "general") -> Dict[str, Any]:
         """
         Генерирует код бота на основе пользовательского запроса
         """
         try:
-            system_prompt = self._get_system_prompt(bot_type)
+            cached = self.cache.get(user_prompt, bot_type)
+            if cached is not None:
+                return cached
             
             response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=4000
+                **self._completion_params(user_prompt, bot_type)
             )
             
-            generated_content = response.choices[0].message.content
+            bundle = parse_response(response.choices[0].message.content)
+            
+            result = self._build_result(bundle, user_prompt, bot_type)
+            self.cache.set(user_prompt, bot_type, result)
+            return result
             
-            # Извлекаем код из ответа
-            code = self._extract_code_from_response(generated_content)
+        except Exception as e:
+            return {
+                "error": str(e),
+                "status": "error"
+            }
+    
+    async def agenerate_bot_code(self, user_prompt: str, bot_type: str = "general",
+                                 on_chunk: Optional[Callable[[str, list], Awaitable[None]]] = None,
+                                 base_code: Optional[str] = None, hedge: bool = False) -> Dict[str, Any]:
+        """
+        Асинхронная версия generate_bot_code для вызова из обработчиков бота.
+        Если передан on_chunk, ответ запрашивается потоком: в колбэк передаются
+        очередной кусок текста и файлы, которые модель успела дописать.
+        base_code - код похожего бота, который нужно доработать, а не писать с нуля.
+        hedge - дублировать медленный запрос (для Premium).
+        Результат из кэша помечен "cached": True - модель для него не вызывалась.
+        """
+        try:
+            # Результат доработки зависит от исходного кода, его не кэшируем
+            if base_code is None:
+                cached = await self.cache.aget(user_prompt, bot_type)
+                if cached is not None:
+                    return {**cached, "cached": True}
+                
+                # Одинаковые описания, пришедшие одновременно, ждут один запрос к модели.
+                # Общий запрос идет потоком и публикует куски; каждый вызывающий получает
+                # их в свой on_chunk, пока ждет, и перестает получать после отмены
+                return await self.inflight.stream(
+                    ('code', make_cache_key(user_prompt, bot_type)),
+                    lambda publish: self._agenerate_bot_code(user_prompt, bot_type, publish, None, hedge),
+                    on_chunk
+                )
             
-            # Генерируем дополнительные файлы
-            additional_files = self._generate_additional_files(user_prompt, bot_type)
+            return await self._agenerate_bot_code(user_prompt, bot_type, on_chunk, base_code, hedge)
             
+        except Exception as e:
             return {
-                "main_code": code,
-                "additional_files": additional_files,
-                "description": self._extract_description(generated_content),
-                "requirements": self._extract_requirements(generated_content),
-                "status": "success"
+                "error": str(e),
+                "status": "error"
             }
+    
+    async def _agenerate_bot_code(self, user_prompt: str, bot_type: str,
+                                  on_chunk: Optional[Callable[[str, list], Awaitable[None]]],
+                                  base_code: Optional[str], hedge: bool) -> Dict[str, Any]:
+        """Запрос к модели, разбор, проверка кода и запись в кэш"""
+        if Config.GENERATION_FANOUT and base_code is None:
+            bundle = await self._agenerate_fanout(user_prompt, bot_type, on_chunk, hedge)
+        elif on_chunk:
+            # Ответ разбирается на лету тем же парсером, второго прохода нет
+            parser = ResponseParser()
+            async for delta in self.astream_completion(user_prompt, bot_type, base_code, hedge):
+                await on_chunk(delta, parser.feed(delta))
+            await on_chunk('', parser.close())
+            bundle = parser.bundle()
+        else:
+            response = await self.chat.create(
+                hedge=hedge,
+                **self._completion_params(user_prompt, bot_type, base_code)
+            )
+            bundle = parse_response(response.choices[0].message.content)
+        
+        result = self._build_result(bundle, user_prompt, bot_type)
+        result = await self._validate_and_repair(result, user_prompt, bot_type)
+        if base_code is None:
+            await self.cache.aset(user_prompt, bot_type, result)
+        return result
+    
+    async def _agenerate_fanout(self, user_prompt: str, bot_type: str,
+                                on_chunk: Optional[Callable[[str, list], Awaitable[None]]],
+                                hedge: bool) -> Dict[str, Any]:
+        """
+        Короткий план бота, затем каждый файл отдельным запросом - все параллельно.
+        Время ответа - примерно время самого длинного файла, а небольшие лимиты
+        токенов на файл не обрезают конец ответа. Результат в формате parse_response
+        """
+        plan_response = await self.chat.create(hedge=hedge, **self._fanout_plan_params(user_prompt, bot_type))
+        plan = plan_response.choices[0].message.content.strip()
+        
+        async def generate_file(filename: str):
+            language = FANOUT_FILES[filename][0]
+            response = await self.chat.create(
+                hedge=hedge, **self._fanout_file_params(filename, plan, user_prompt, bot_type)
+            )
+            bundle = parse_response(response.choices[0].message.content)
+            content = bundle['files'].get(filename) or bundle['main_code']
+            if on_chunk:
+                # Готовый файл сразу уходит пользователю, как при потоковой генерации
+                await on_chunk(content, [{"language": language, "filename": filename, "content": content}])
+            return filename, content
+        
+        tasks = [asyncio.create_task(generate_file(filename)) for filename in FANOUT_FILES]
+        try:
+            files = dict(await asyncio.gather(*tasks))
+        finally:
+            # Ошибка одного файла проваливает генерацию: остальные запросы отменяются,
+            # чтобы не тратить токены и не отправлять файлы проваленной задачи.
+            # TaskGroup недоступен - образ собирается на Python 3.10
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        requirements = [line.strip() for line in files['requirements.txt'].split('\n') if line.strip()]
+        return {
+            "main_code": files['main.py'],
+            "config": files['config.py'],
+            "requirements": requirements or list(DEFAULT_REQUIREMENTS),
+            "readme": files['README.md'],
+            # Первая строка плана - описание бота одним предложением
+            "description": plan.split('\n', 1)[0].strip(),
+            "files": files
+        }
+    
+    async def astream_completion(self, user_prompt: str, bot_type: str = "general",
+                                 base_code: Optional[str] = None, hedge: bool = False) -> AsyncIterator[str]:
+        """Запрашивает генерацию с stream=True и отдает куски текста"""
+        async for delta in self.chat.stream(hedge=hedge, **self._completion_params(user_prompt, bot_type, base_code)):
+            yield delta
+    
+    async def _validate_and_repair(self, result: Dict[str, Any], user_prompt: str, bot_type: str) -> Dict[str, Any]:
+        """
+        Проверяет код в пуле процессов и при ошибках делает одну точечную
+        попытку исправления вместо повторной генерации с нуля
+        """
+        check = await self.validator.validate(result['main_code'], result['requirements'])
+        if check['ok']:
+            result['validation'] = {"status": "passed", "errors": [], "repair_attempts": 0}
+            return result
+        
+        if not Config.VALIDATION_REPAIR:
+            result['validation'] = {"status": "failed", "errors": check['errors'], "repair_attempts": 0}
+            return result
+        
+        errors_text = "\n".join(f"- {error}" for error in check['errors'])
+        try:
+            response = await self.chat.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": self._get_system_prompt(bot_type)},
+                    {"role": "user", "content": user_prompt},
+                    {"role": "assistant", "content": f"```python\n# main.py\n{result['main_code']}\n```"},
+                    {"role": "user", "content": (
+                        "Проверка кода нашла ошибки:\n"
+                        f"{errors_text}\n\n"
+                        "Исправь только их и верни полный main.py и requirements.txt в том же формате."
+                    )}
+                ],
+                temperature=0.2,
+                max_tokens=4000
+            )
+            repaired = parse_response(response.choices[0].message.content)
+        except Exception as e:
+            # Ошибка исправления не должна терять уже сгенерированный код
+            result['validation'] = {"status": "failed", "errors": check['errors'] + [str(e)], "repair_attempts": 1}
+            return result
+        
+        requirements = repaired['requirements'] if 'requirements.txt' in repaired['files'] else result['requirements']
+        recheck = await self.validator.validate(repaired['main_code'], requirements)
+        if recheck['ok']:
+            result['main_code'] = repaired['main_code']
+            result['requirements'] = requirements
+            result['validation'] = {"status": "repaired", "errors": [], "repair_attempts": 1}
+        else:
+            # Исходный код остается: пользователь получит его вместе со списком проблем
+            result['validation'] = {"status": "failed", "errors": check['errors'], "repair_attempts": 1}
+        return result
+    
+    def template_mode(self, user_prompt: str, bot_type: str, premium: bool) -> Optional[str]:
+        """
+        Решает, можно ли собрать бота из шаблона: 'instant' - локальный рендер
+        без модели, 'customize' - модель пишет только собственные обработчики,
+        None - нужна полная генерация
+        """
+        if not Config.TEMPLATE_FAST_PATH or not self.templates.has(bot_type):
+            return None
+        
+        _, confidence, score = self.classifier.classify_with_score(user_prompt)
+        if confidence < Config.TEMPLATE_MIN_CONFIDENCE or score < Config.TEMPLATE_MIN_SCORE:
+            return None
+        
+        return 'customize' if premium else 'instant'
+    
+    def render_template(self, user_prompt: str, bot_type: str, custom_handlers: Optional[str] = None) -> Dict[str, Any]:
+        """Собирает бота из шаблона локально, без запроса к модели"""
+        bundle = self.templates.render(bot_type, user_prompt, custom_handlers)
+        return self._build_result(bundle, user_prompt, bot_type)
+    
+    async def agenerate_from_template(self, user_prompt: str, bot_type: str, hedge: bool = False) -> Dict[str, Any]:
+        """Шаблон + короткая генерация только собственных обработчиков"""
+        cache_type = f"{bot_type}:template"
+        try:
+            cached = await self.cache.aget(user_prompt, cache_type)
+            if cached is not None:
+                return {**cached, "cached": True}
+            
+            return await self.inflight.do(
+                ('template', make_cache_key(user_prompt, cache_type)),
+                lambda: self._agenerate_from_template(user_prompt, bot_type, cache_type, hedge)
+            )
             
         except Exception as e:
             return {
@@ -48,6 +263,143 @@ class AIService:
                 "status": "error"
             }
     
+    async def _agenerate_from_template(self, user_prompt: str, bot_type: str, cache_type: str,
+                                       hedge: bool) -> Dict[str, Any]:
+        response = await self.chat.create(
+            hedge=hedge,
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": self._get_handlers_prompt(bot_type)},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.7,
+            max_tokens=Config.TEMPLATE_HANDLERS_MAX_TOKENS
+        )
+        
+        custom_handlers = parse_response(response.choices[0].message.content)['main_code'].strip()
+        # Без функции регистрации шаблон не запустится
+        if 'def register_custom_handlers' not in custom_handlers:
+            custom_handlers = f"{custom_handlers}\n\n\n{DEFAULT_CUSTOM_HANDLERS}"
+        
+        result = self.render_template(user_prompt, bot_type, custom_handlers)
+        result = await self._validate_and_repair(result, user_prompt, bot_type)
+        await self.cache.aset(user_prompt, cache_type, result)
+        return result
+    
+    def _get_handlers_prompt(self, bot_type: str) -> str:
+        """Системный промпт для генерации только собственных обработчиков шаблона"""
+        meta = self.templates.manifest[bot_type]
+        return f"""
+        Ты - эксперт по созданию Telegram ботов на python-telegram-bot (версия 20+).
+        
+        У нас есть готовый бот-шаблон "{meta['title']}": {meta['summary']}.
+        Базовые команды и меню в нем уже реализованы.
+        
+        Напиши только дополнительные async обработчики, которых требует описание пользователя,
+        и функцию register_custom_handlers(application), которая их регистрирует.
+        Добавь нужные импорты в начало блока. Не переписывай весь бот.
+        
+        Верни один блок:
+        ```python
+        # handlers.py
+        [обработчики и register_custom_handlers]
+        ```
+        """
+    
+    def _completion_params(self, user_prompt: str, bot_type: str, base_code: Optional[str] = None) -> Dict[str, Any]:
+        """Собирает параметры запроса к модели"""
+        system_prompt = self._get_system_prompt(bot_type)
+        
+        messages = [{"role": "system", "content": system_prompt}]
+        if base_code:
+            # Доработка похожего бота: модель правит готовый код, а не пишет с нуля
+            messages.append({"role": "assistant", "content": f"```python\n# main.py\n{base_code}\n```"})
+            messages.append({
+                "role": "user",
+                "content": f"Доработай этот код под новое описание, сохранив рабочие части:\n{user_prompt}"
+            })
+        else:
+            messages.append({"role": "user", "content": user_prompt})
+        
+        return {
+            "model": "gpt-4",
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 4000
+        }
+    
+    def _fanout_plan_params(self, user_prompt: str, bot_type: str) -> Dict[str, Any]:
+        """Запрос короткого плана, общего для всех файлов проекта"""
+        system_prompt = """
+        Ты - эксперт по созданию Telegram ботов на python-telegram-bot (версия 20+).
+        Составь краткий план бота по описанию пользователя. Код не пиши.
+        
+        Первая строка - описание бота одним предложением. Дальше списками:
+        1. Команды и кнопки с тем, что они делают
+        2. Обработчики и состояния диалога
+        3. Хранимые данные
+        4. Настройки: имена полей Config и переменных окружения
+        5. Внешние библиотеки
+        """
+        specialization = self.classifier.system_prompt(bot_type)
+        if specialization:
+            system_prompt += "\n\n" + specialization
+        
+        return {
+            "model": "gpt-4",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": Config.FANOUT_PLAN_MAX_TOKENS
+        }
+    
+    def _fanout_file_params(self, filename: str, plan: str, user_prompt: str, bot_type: str) -> Dict[str, Any]:
+        """Запрос одного файла проекта по общему плану"""
+        language, cheap, instructions = FANOUT_FILES[filename]
+        system_prompt = f"""
+        Ты - эксперт по созданию Telegram ботов на python-telegram-bot (версия 20+).
+        Остальные файлы проекта пишутся параллельно по тому же плану, поэтому строго
+        следуй плану: те же команды, имена настроек и зависимости.
+        
+        Напиши только файл {filename}. {instructions}
+        
+        План бота:
+        {plan}
+        
+        Верни один блок:
+        ```{language}
+        # {filename}
+        [содержимое файла]
+        ```
+        """
+        return {
+            "model": Config.FANOUT_CHEAP_MODEL if cheap else "gpt-4",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": Config.FANOUT_FILE_MAX_TOKENS if cheap else Config.FANOUT_MAIN_MAX_TOKENS
+        }
+    
+    def _build_result(self, bundle: Dict[str, Any], user_prompt: str, bot_type: str) -> Dict[str, Any]:
+        """Собирает результат генерации из разобранного ответа модели"""
+        # Стандартные файлы дополняются тем, что сгенерировала модель
+        additional_files = self._generate_additional_files(user_prompt, bot_type)
+        for filename, content in bundle['files'].items():
+            if filename not in ('main.py', 'requirements.txt'):
+                additional_files[filename] = content
+        
+        return {
+            "main_code": bundle['main_code'],
+            "additional_files": additional_files,
+            "description": bundle['description'],
+            "requirements": bundle['requirements'],
+            "status": "success"
+        }
+    
     def _get_system_prompt(self, bot_type: str) -> str:
         """Генерирует системный промпт для создания бота"""
         base_prompt = """
@@ -84,62 +436,13 @@ class AIService:
         ```
         """
         
-        if bot_type == "ecommerce":
-            base_prompt += "\n\nСпециально для e-commerce бота добавь:\n- Каталог товаров\n- Корзину\n- Обработку заказов\n- Интеграцию с платежными системами"
-        elif bot_type == "support":
-            base_prompt += "\n\nСпециально для support бота добавь:\n- Систему тикетов\n- FAQ\n- Переадресацию к операторам\n- Базу знаний"
-        elif bot_type == "news":
-            base_prompt += "\n\nСпециально для news бота добавь:\n- Парсинг новостей\n- Категории\n- Подписки\n- Рассылки"
+        # Специализации категорий описаны в Config.BOT_CATEGORIES_FILE
+        specialization = self.classifier.system_prompt(bot_type)
+        if specialization:
+            base_prompt += "\n\n" + specialization
         
         return base_prompt
     
-    def _extract_code_from_response(self, response: str) -> str:
-        """Извлекает код из ответа AI"""
-        # Ищем код между ```python и ```
-        python_pattern = r'```python\s*\n(.*?)\n```'
-        matches = re.findall(python_pattern, response, re.DOTALL)
-        
-        if matches:
-            return matches[0]
-        
-        # Если не найден python блок, ищем любой код
-        code_pattern = r'```\s*\n(.*?)\n```'
-        matches = re.findall(code_pattern, response, re.DOTALL)
-        
-        if matches:
-            return matches[0]
-        
-        return response
-    
-    def _extract_description(self, response: str) -> str:
-        """Извлекает описание бота из ответа"""
-        # Простое извлечение описания - первые несколько строк до кода
-        lines = response.split('\n')
-        description_lines = []
-        
-        for line in lines:
-            if line.strip().startswith('```'):
-                break
-            if line.strip():
-                description_lines.append(line.strip())
-        
-        return ' '.join(description_lines[:3])  # Первые 3 строки
-    
-    def _extract_requirements(self, response: str) -> list:
-        """Извлекает зависимости из requirements.txt"""
-        requirements_pattern = r'```txt\s*\n(.*?)\n```'
-        matches = re.findall(requirements_pattern, response, re.DOTALL)
-        
-        if matches:
-            return [line.strip() for line in matches[0].split('\n') if line.strip()]
-        
-        # Стандартные зависимости
-        return [
-            "python-telegram-bot==20.7",
-            "python-dotenv==1.0.0",
-            "requests==2.31.0"
-        ]
-    
     def _generate_additional_files(self, user_prompt: str, bot_type: str) -> Dict[str, str]:
         """Генерирует дополнительные файлы для бота"""
         additional_files = {}
@@ -172,13 +475,5 @@ DEBUG=False
     
     def analyze_bot_requirements(self, user_prompt: str) -> str:
         """Анализирует требования пользователя и определяет тип бота"""
-        prompt_lower = user_prompt.lower()
-        
-        if any(word in prompt_lower for word in ['магазин', 'товар', 'заказ', 'корзина', 'ecommerce', 'e-commerce']):
-            return "ecommerce"
-        elif any(word in prompt_lower for word in ['поддержка', 'support', 'помощь', 'тикет', 'faq']):
-            return "support"
-        elif any(word in prompt_lower for word in ['новости', 'news', 'рассылка', 'канал']):
-            return "news"
-        else:
-            return "general"
+        bot_type, _ = self.classifier.classify(user_prompt)
+        return bot_type
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк конвейера генерации: классификация, шаблоны, очередь,
+потоковый запрос к модели, разбор ответа и проверка кода.
+
+Модель подменяется локальным сервером fake_openai.py, поэтому тысячи
+имитированных пользователей не тратят квоту OpenAI.
+
+Запуск:
+    python benchmark.py --users 2000 --serve --latency 1 --tokens-per-second 200
+    python benchmark.py --users 500 --base-url http://127.0.0.1:8100/v1
+    python benchmark.py --similarity 300000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+import fake_openai
+
+DESCRIPTIONS = [
+    "Бот-магазин с каталогом товаров, корзиной и оформлением заказа",
+    "Бот поддержки: FAQ, тикеты и связь с оператором",
+    "Новостной бот с подпиской на рубрики и ежедневной рассылкой",
+    "Эхо-бот, который повторяет сообщения пользователя",
+    "Бот для записи на стрижку с выбором мастера и времени",
+    "Бот-викторина с рейтингом участников",
+    "Бот, который напоминает выпить воды каждые два часа",
+]
+
+
+def percentile(values, share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+class Benchmark:
+    """Имитирует пользователей, которые одновременно заказывают ботов"""
+
+    def __init__(self, users: int, premium_share: float, arrival_rate: float, seed: int = None):
+        # Импорт после настройки окружения: Config читает переменные при импорте
+        from ai_service import AIService
+        from generation_queue import GenerationScheduler, QueueFullError
+
+        self.ai_service = AIService()
+        self.scheduler = GenerationScheduler()
+        self.queue_full_error = QueueFullError
+        self.users = users
+        self.premium_share = premium_share
+        self.arrival_rate = arrival_rate
+        self.random = random.Random(seed)
+        self.latencies = []
+        self.first_chunk = []
+        self.outcomes = {"ok": 0, "template": 0, "error": 0, "queue_full": 0}
+        self.validation = {}
+
+    async def run(self) -> float:
+        await self.scheduler.start()
+        started = time.monotonic()
+        try:
+            tasks = []
+            for user_id in range(1, self.users + 1):
+                tasks.append(asyncio.create_task(self._user(user_id)))
+                if self.arrival_rate:
+                    await asyncio.sleep(self.random.expovariate(self.arrival_rate))
+            await asyncio.gather(*tasks)
+        finally:
+            await self.scheduler.stop()
+            self.ai_service.validator.shutdown()
+        return time.monotonic() - started
+
+    async def _user(self, user_id: int):
+        # Уникальный хвост описания, чтобы кэш генераций не искажал замер
+        description = f"{self.random.choice(DESCRIPTIONS)} (пользователь {user_id})"
+        premium = self.random.random() < self.premium_share
+        started = time.monotonic()
+        first_chunk_at = None
+
+        bot_type = self.ai_service.analyze_bot_requirements(description)
+        mode = self.ai_service.template_mode(description, bot_type, premium)
+        if mode == 'instant':
+            self.ai_service.render_template(description, bot_type)
+            self.outcomes["template"] += 1
+            return
+
+        async def on_chunk(delta, blocks):
+            nonlocal first_chunk_at
+            if first_chunk_at is None and delta:
+                first_chunk_at = time.monotonic()
+
+        if mode == 'customize':
+            factory = lambda: self.ai_service.agenerate_from_template(description, bot_type, hedge=premium)
+        else:
+            factory = lambda: self.ai_service.agenerate_bot_code(
+                description, bot_type, on_chunk=on_chunk, hedge=premium
+            )
+
+        try:
+            job = self.scheduler.submit(user_id, premium, factory)
+        except self.queue_full_error:
+            self.outcomes["queue_full"] += 1
+            return
+
+        result = await job.future
+        if result.get('status') == 'error':
+            self.outcomes["error"] += 1
+            return
+
+        self.outcomes["ok"] += 1
+        self.latencies.append(time.monotonic() - started)
+        if first_chunk_at is not None:
+            self.first_chunk.append(first_chunk_at - started)
+        status = result.get('validation', {}).get('status', 'unknown')
+        self.validation[status] = self.validation.get(status, 0) + 1
+
+    def report(self, elapsed: float):
+        done = self.outcomes["ok"] + self.outcomes["template"]
+        print("\n📊 Результаты бенчмарка")
+        print("=" * 50)
+        print(f"Пользователей: {self.users}, время: {elapsed:.1f}с, пропускная способность: {done / elapsed:.1f} бот/с")
+        print(f"Исходы: {self.outcomes}")
+        print(f"Проверка кода: {self.validation}")
+        for name, values in (("Генерация", self.latencies), ("До первого куска", self.first_chunk)):
+            if values:
+                print(f"{name}: avg {statistics.mean(values):.2f}с, p50 {percentile(values, 0.5):.2f}с, "
+                      f"p95 {percentile(values, 0.95):.2f}с, p99 {percentile(values, 0.99):.2f}с, "
+                      f"max {max(values):.2f}с")
+        print(f"Очередь: {self.scheduler.metrics()}")
+        print(f"Клиент OpenAI: {self.ai_service.chat.metrics()}")
+
+
+def random_flips(rng: random.Random, value: int, max_bits: int) -> int:
+    for bit in rng.sample(range(64), rng.randint(0, max_bits)):
+        value ^= 1 << bit
+    return value
+
+
+def similarity_benchmark(entries: int, lookups: int = 2000, seed: int = None):
+    """
+    Поиск похожих описаний на event loop: индекс из entries хешей, две трети
+    из которых - кластеры близких описаний (частый случай: "бот-магазин ..."),
+    остальные случайные. Половина запросов - вариации сохраненных хешей
+    в пределах порога, половина - случайные
+    """
+    from similarity_index import PromptSimilarityIndex
+
+    rng = random.Random(seed)
+    index = PromptSimilarityIndex()
+    values = []
+    centers = [rng.getrandbits(64) for _ in range(max(1, entries // 1000))]
+    for generation_id in range(entries):
+        if generation_id % 3:
+            value = random_flips(rng, rng.choice(centers), 8)
+        else:
+            value = rng.getrandbits(64)
+        values.append(value)
+        index.add_hash(generation_id, value, 'general')
+
+    timings = []
+    found = expected = 0
+    for i in range(lookups):
+        near = i % 2 == 0
+        value = random_flips(rng, rng.choice(values), index.max_distance) if near else rng.getrandbits(64)
+        started = time.perf_counter()
+        match = index.find_hash(value, 'general')
+        timings.append((time.perf_counter() - started) * 1000)
+        if near:
+            expected += 1
+            found += match is not None
+
+    print("\n🔎 Поиск похожих описаний")
+    print("=" * 50)
+    print(f"Записей: {entries}, индекс: {index.stats()}")
+    print(f"Поиск: avg {statistics.mean(timings):.3f}мс, p50 {percentile(timings, 0.5):.3f}мс, "
+          f"p99 {percentile(timings, 0.99):.3f}мс, max {max(timings):.3f}мс")
+    print(f"Найдено похожих: {found} из {expected}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = fake_openai.build_parser()
+    parser.description = "Offline benchmark of the bot generation pipeline"
+    parser.set_defaults(port=0)
+    parser.add_argument('--users', type=int, default=1000, help="Число имитированных пользователей")
+    parser.add_argument('--premium-share', type=float, default=0.1, help="Доля Premium-пользователей")
+    parser.add_argument('--arrival-rate', type=float, default=0.0,
+                        help="Пользователей в секунду (пуассоновский поток); 0 - все сразу")
+    parser.add_argument('--workers', type=int, help="Воркеров очереди (по умолчанию GENERATION_WORKERS)")
+    parser.add_argument('--serve', action='store_true', help="Поднять fake_openai в этом же процессе")
+    parser.add_argument('--base-url', help="Адрес уже запущенного совместимого сервера")
+    parser.add_argument('--similarity', type=int, metavar='ENTRIES',
+                        help="Замерить только поиск похожих описаний на индексе из ENTRIES хешей")
+    return parser
+
+
+async def main(args: argparse.Namespace):
+    if args.similarity:
+        similarity_benchmark(args.similarity, seed=args.seed)
+        return
+
+    server = None
+    if args.serve:
+        server = fake_openai.server_from_args(args)
+        port = await server.start(args.host, args.port)
+        os.environ['OPENAI_BASE_URL'] = f"http://{args.host}:{port}/v1"
+    elif args.base_url:
+        os.environ['OPENAI_BASE_URL'] = args.base_url
+    else:
+        raise SystemExit("Укажите --serve или --base-url: бенчмарк не ходит в настоящий API")
+
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('GENERATION_CACHE_BACKEND', 'none')
+    os.environ.setdefault('GENERATION_QUEUE_LIMIT', str(args.users))
+    if args.workers:
+        os.environ['GENERATION_WORKERS'] = str(args.workers)
+
+    benchmark = Benchmark(args.users, args.premium_share, args.arrival_rate, args.seed)
+    try:
+        elapsed = await benchmark.run()
+    finally:
+        if server:
+            await server.stop()
+
+    benchmark.report(elapsed)
+    if server:
+        print(f"Сервер: {server.stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(build_parser().parse_args()))
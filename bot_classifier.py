@@ -0,0 +1,135 @@
+import json
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+_TOKEN_RE = re.compile(r'[a-zа-я0-9]+')
+
+# Окончания упорядочены от длинных к коротким: отрезается самое длинное
+_RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией',
+    'ах', 'ях', 'ов', 'ев', 'ей', 'ой', 'ый', 'ий', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ом', 'ем', 'ам', 'ям', 'ую', 'юю', 'ию', 'ия', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'
+], key=len, reverse=True)
+_EN_ENDINGS = sorted(['ing', 'ies', 'es', 'ed', 's'], key=len, reverse=True)
+_MIN_STEM = 3
+
+
+def stem(word: str) -> str:
+    """Легкий стеммер: отрезает типичные русские и английские окончания"""
+    endings = _RU_ENDINGS if re.search('[а-я]', word) else _EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_text(text: str) -> str:
+    """Нормализует текст в строку основ, разделенных пробелами"""
+    tokens = _TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+    return ' ' + ' '.join(stem(token) for token in tokens)
+
+
+class _Automaton:
+    """Автомат Ахо-Корасик: все ключевые слова ищутся за один проход по тексту"""
+
+    def __init__(self, patterns: Dict[str, List[Tuple[int, float]]]):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern, payload in patterns.items():
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].extend(payload)
+
+        # Суффиксные ссылки строятся обходом в ширину; у детей корня они ведут в корень
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                if node:
+                    self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text: str) -> Iterable[Tuple[int, float]]:
+        node = 0
+        for char in text:
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            if self.output[node]:
+                yield from self.output[node]
+
+
+class BotTypeClassifier:
+    """
+    Классификатор типа бота по описанию. Категории, веса ключевых слов
+    и специализации системного промпта задаются в Config.BOT_CATEGORIES_FILE
+    """
+
+    def __init__(self, categories_file: str = None):
+        self.categories_file = categories_file or Config.BOT_CATEGORIES_FILE
+        with open(self.categories_file, encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.min_score = data.get('min_score', 1.0)
+        # Сумма весов, при которой описание считается однозначным
+        self.confident_score = data.get('confident_score', 4.0)
+        self.categories = [category['name'] for category in data['categories']]
+        self.prompts = {category['name']: category.get('prompt', '') for category in data['categories']}
+
+        # Ключевое слово совпадает с началом основы слова в тексте
+        patterns = {}
+        for index, category in enumerate(data['categories']):
+            for keyword, weight in category['keywords'].items():
+                pattern = stem_text(keyword)
+                patterns.setdefault(pattern, []).append((index, weight))
+        self._automaton = _Automaton(patterns)
+
+    def classify(self, user_prompt: str) -> Tuple[str, float]:
+        """Возвращает (тип бота, уверенность 0..1)"""
+        bot_type, confidence, _ = self.classify_with_score(user_prompt)
+        return bot_type, confidence
+
+    def classify_with_score(self, user_prompt: str) -> Tuple[str, float, float]:
+        """
+        Возвращает (тип бота, уверенность 0..1, сумма весов лучшей категории).
+        Уверенность учитывает и силу совпадения (одно слабое ключевое слово
+        не дает уверенности), и отрыв от второй категории
+        """
+        scores = [0.0] * len(self.categories)
+        for index, weight in self._automaton.search(stem_text(user_prompt)):
+            scores[index] += weight
+
+        best_score = max(scores, default=0.0)
+        if best_score < self.min_score:
+            return "general", 0.0, best_score
+
+        # При равенстве побеждает категория, объявленная раньше
+        best = scores.index(best_score)
+        runner_up = max((score for index, score in enumerate(scores) if index != best), default=0.0)
+        strength = min(1.0, best_score / self.confident_score)
+        margin = (best_score - runner_up) / best_score
+        return self.categories[best], strength * margin, best_score
+
+    def classify_batch(self, prompts: Iterable[str]) -> List[Tuple[str, float]]:
+        """Классифицирует много описаний (например, всю историю генераций)"""
+        return [self.classify(prompt or '') for prompt in prompts]
+
+    def system_prompt(self, bot_type: str) -> Optional[str]:
+        """Специализация системного промпта для категории"""
+        return self.prompts.get(bot_type) or None
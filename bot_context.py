@@ -0,0 +1,50 @@
+import functools
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram import Update
+from telegram.ext import CallbackContext, ContextTypes, ExtBot
+
+from database import AsyncSessionLocal
+
+RT = TypeVar('RT')
+
+
+class BotContext(CallbackContext[ExtBot, dict, dict, dict]):
+    """
+    Контекст обработчика с сессией БД на время одного апдейта.
+    Сессия открывается при первом обращении к context.db и закрывается
+    обработчиком, обернутым в with_db_session
+    """
+
+    def __init__(self, application, chat_id: Optional[int] = None, user_id: Optional[int] = None):
+        super().__init__(application=application, chat_id=chat_id, user_id=user_id)
+        self._db_session = None
+
+    @property
+    def db(self) -> AsyncSession:
+        if self._db_session is None:
+            self._db_session = AsyncSessionLocal()
+        return self._db_session
+
+    async def close_db(self):
+        if self._db_session is not None:
+            session, self._db_session = self._db_session, None
+            await session.close()
+
+
+# Передается в Application.builder().context_types(...)
+BOT_CONTEXT_TYPES = ContextTypes(context=BotContext)
+
+
+def with_db_session(callback: Callable[[Update, BotContext], Awaitable[RT]]) -> Callable[[Update, BotContext], Awaitable[RT]]:
+    """Закрывает сессию БД апдейта после завершения обработчика"""
+
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: BotContext) -> RT:
+        try:
+            return await callback(update, context)
+        finally:
+            await context.close_db()
+
+    return wrapper
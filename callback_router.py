@@ -0,0 +1,124 @@
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler
+
+from bot_context import BotContext, with_db_session
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ':'
+# Кнопки в старых сообщениях используют формат "download_12"
+LEGACY_SEPARATOR = '_'
+# Ограничение Telegram на callback_data
+MAX_CALLBACK_DATA = 64
+
+
+def callback_data(name: str, *args: Any) -> str:
+    """Компактная callback_data маршрута: "name" или "name:arg1:arg2" """
+    data = SEPARATOR.join([name, *map(str, args)])
+    if len(data.encode()) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data is longer than {MAX_CALLBACK_DATA} bytes: {data}")
+    return data
+
+
+class CallbackRoute:
+    """Маршрут кнопки: обработчик, типы аргументов и счетчики времени"""
+
+    def __init__(self, name: str, callback: Callable[..., Awaitable[Any]], arg_types: Tuple[Callable[[str], Any], ...]):
+        self.name = name
+        self.callback = callback
+        self.arg_types = arg_types
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def pattern(self) -> str:
+        if not self.arg_types:
+            return f"^{re.escape(self.name)}$"
+        return f"^{re.escape(self.name)}[{SEPARATOR}{LEGACY_SEPARATOR}]"
+
+    def parse(self, data: str) -> List[Any]:
+        if not self.arg_types:
+            return []
+        separator, payload = data[len(self.name)], data[len(self.name) + 1:]
+        # Последний аргумент забирает остаток строки (может сам содержать разделитель)
+        parts = payload.split(separator, len(self.arg_types) - 1)
+        if len(parts) != len(self.arg_types):
+            raise ValueError(f"{self.name} expects {len(self.arg_types)} arguments, got {data!r}")
+        return [arg_type(part) for arg_type, part in zip(self.arg_types, parts)]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_time / self.calls * 1000, 1) if self.calls else 0.0,
+            "max_ms": round(self.max_time * 1000, 1)
+        }
+
+
+class CallbackRouter:
+    """
+    Реестр обработчиков кнопок. Каждый маршрут регистрируется один раз
+    с типами аргументов и становится отдельным CallbackQueryHandler
+    со своим pattern, поэтому апдейт сразу попадает в нужный обработчик
+    без цепочки сравнений. Аргументы разбираются из callback_data и
+    передаются в обработчик уже приведенными к типам
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, CallbackRoute] = {}
+
+    def add(self, name: str, callback: Callable[..., Awaitable[Any]], *arg_types: Callable[[str], Any]):
+        """callback(update, context, *args); arg_types - преобразования строковых аргументов"""
+        if SEPARATOR in name:
+            raise ValueError(f"Route name must not contain '{SEPARATOR}': {name}")
+        if name in self._routes:
+            raise ValueError(f"Route {name} is already registered")
+        self._routes[name] = CallbackRoute(name, callback, arg_types)
+
+    def _make_handler(self, route: CallbackRoute):
+        async def handle(update: Update, context: BotContext):
+            try:
+                args = route.parse(update.callback_query.data)
+            except ValueError as e:
+                logger.warning(f"Malformed callback data: {e}")
+                await update.callback_query.answer()
+                return
+
+            started = time.perf_counter()
+            try:
+                return await route.callback(update, context, *args)
+            except Exception:
+                route.errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                route.calls += 1
+                route.total_time += elapsed
+                route.max_time = max(route.max_time, elapsed)
+
+        handle.__name__ = f"route_{route.name}"
+        return with_db_session(handle)
+
+    async def _answer_unknown(self, update: Update, context: BotContext):
+        # Иначе у кнопки без обработчика бесконечно крутятся часики
+        logger.info(f"Unhandled callback data: {update.callback_query.data}")
+        await update.callback_query.answer()
+
+    def handlers(self) -> List[CallbackQueryHandler]:
+        """Обработчики для Application.add_handlers: по одному на маршрут и запасной в конце"""
+        handlers = [
+            CallbackQueryHandler(self._make_handler(route), pattern=route.pattern)
+            for route in self._routes.values()
+        ]
+        handlers.append(CallbackQueryHandler(self._answer_unknown))
+        return handlers
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: route.stats() for name, route in self._routes.items()}
@@ -0,0 +1,145 @@
+import ast
+import asyncio
+import hashlib
+import logging
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Пакеты, у которых имя импорта отличается от имени в requirements.txt
+PACKAGE_IMPORT_NAMES = {
+    'python-telegram-bot': 'telegram',
+    'python-dotenv': 'dotenv',
+    'beautifulsoup4': 'bs4',
+    'pillow': 'PIL',
+    'pyyaml': 'yaml',
+    'scikit-learn': 'sklearn',
+    'psycopg2-binary': 'psycopg2',
+    'pymongo': 'pymongo',
+    'redis': 'redis',
+}
+
+# Модули, которые генерируются вместе с ботом
+LOCAL_MODULES = {'config', 'handlers', 'database', 'keyboards', 'utils', 'models'}
+
+_REQUIREMENT_NAME_RE = re.compile(r'^\s*([A-Za-z0-9_.\-]+)')
+_PTB_VERSION_RE = re.compile(r'python-telegram-bot\s*==\s*(\d+)')
+
+
+def _import_names(requirements: List[str]) -> set:
+    names = set()
+    for line in requirements:
+        match = _REQUIREMENT_NAME_RE.match(line)
+        if not match or line.strip().startswith('#'):
+            continue
+        package = match.group(1).lower()
+        names.add(PACKAGE_IMPORT_NAMES.get(package, package.replace('-', '_')))
+    return names
+
+
+def validate_code(code: str, requirements: List[str]) -> Dict[str, Any]:
+    """
+    Проверяет сгенерированный код: синтаксис, соответствие импортов
+    requirements.txt и использование API python-telegram-bot v20.
+    Выполняется в отдельном процессе, поэтому - функция верхнего уровня.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return {"ok": False, "errors": [f"Синтаксическая ошибка в строке {e.lineno}: {e.msg}"]}
+
+    errors = []
+
+    # Импорты сторонних пакетов должны быть перечислены в requirements.txt
+    declared = _import_names(requirements)
+    imported = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imported.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            imported.add(node.module.split('.')[0])
+    for module in sorted(imported - declared - LOCAL_MODULES - set(sys.stdlib_module_names)):
+        errors.append(f"Модуль '{module}' импортируется, но не указан в requirements.txt")
+
+    for requirement in requirements:
+        version = _PTB_VERSION_RE.search(requirement)
+        if version and int(version.group(1)) < 20:
+            errors.append(f"Нужен python-telegram-bot версии 20+, указано: {requirement.strip()}")
+
+    errors.extend(_check_ptb_v20(tree))
+
+    return {"ok": not errors, "errors": errors}
+
+
+def _check_ptb_v20(tree: ast.AST) -> List[str]:
+    """Ищет конструкции python-telegram-bot v13, удаленные в v20"""
+    errors = []
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module == 'telegram.ext':
+            if any(alias.name == 'Filters' for alias in node.names):
+                errors.append("В v20 используется 'filters', а не 'Filters'")
+        elif isinstance(node, ast.Attribute) and node.attr == 'dispatcher':
+            errors.append(f"Строка {node.lineno}: 'dispatcher' удален в v20, используйте Application")
+        elif isinstance(node, ast.keyword) and node.arg == 'use_context':
+            errors.append("Аргумент 'use_context' удален в v20")
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'Updater':
+            errors.append(f"Строка {node.lineno}: вместо Updater используйте Application.builder()")
+        elif isinstance(node, ast.FunctionDef):
+            # Обработчики (update, context) в v20 должны быть корутинами
+            # Методы класса-обработчика начинаются с self/cls
+            args = [arg.arg for arg in node.args.args]
+            if args[:1] in (['self'], ['cls']):
+                args = args[1:]
+            if args[:2] == ['update', 'context']:
+                errors.append(f"Строка {node.lineno}: обработчик '{node.name}' должен быть async def")
+
+    return errors
+
+
+class CodeValidator:
+    """Проверка кода в пуле процессов с кэшем результатов по хешу кода"""
+
+    def __init__(self, workers: int = None, cache_size: int = 1024):
+        self.workers = workers or Config.VALIDATION_WORKERS
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pool = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Пул создается лениво, чтобы не плодить процессы при импорте
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    @staticmethod
+    def code_hash(code: str, requirements: List[str]) -> str:
+        raw = code + '\0' + '\n'.join(requirements)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def validate(self, code: str, requirements: List[str]) -> Dict[str, Any]:
+        """Проверяет код, не блокируя event loop"""
+        key = self.code_hash(code, requirements)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor(), validate_code, code, list(requirements))
+
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -8,15 +8,63 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
     
+    # Webhook Mode (BOT_MODE=webhook вместо long polling)
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # одновременных запросов от Telegram
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 1))  # процессов на одном порту
+    
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    # Совместимый сервер вместо api.openai.com, например fake_openai.py для нагрузочных тестов
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+    
+    # OpenAI Client Resilience
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 180))  # дедлайн на весь вызов, секунды
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+    OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', 1.0))
+    OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', 30.0))
+    OPENAI_BREAKER_THRESHOLD = int(os.getenv('OPENAI_BREAKER_THRESHOLD', 5))
+    OPENAI_BREAKER_RESET = float(os.getenv('OPENAI_BREAKER_RESET', 30.0))
+    OPENAI_HEDGE_AFTER = float(os.getenv('OPENAI_HEDGE_AFTER', 20.0))  # 0 - без хеджирования
+    # Обычные (не потоковые) запросы хеджируются по полному времени ответа, которое растет
+    # с max_tokens; по умолчанию хеджируется только время до первого куска потока
+    OPENAI_HEDGE_CREATE = os.getenv('OPENAI_HEDGE_CREATE', 'False').lower() == 'true'
+    OPENAI_HEDGE_TOKENS_PER_SECOND = float(os.getenv('OPENAI_HEDGE_TOKENS_PER_SECOND', 30.0))
     
     # Database Configuration
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bot_creator.db')
+    # Пул соединений асинхронного движка (PostgreSQL)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    
+    # User Profile Cache
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))  # правки из веб-админки видны не позже чем через TTL
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 5))
     
     # Redis Configuration
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Conversation State (context.user_data), общее для всех процессов бота
+    PERSISTENCE_BACKEND = os.getenv('PERSISTENCE_BACKEND', 'sqlite')  # sqlite, redis, memory
+    PERSISTENCE_PATH = os.getenv('PERSISTENCE_PATH', 'bot_state.db')
+    PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', 1.0))  # период пакетной записи, сек
+    PERSISTENCE_TTL = int(os.getenv('PERSISTENCE_TTL', 30 * 24 * 3600))  # только для redis
+    
+    # Rate Limiting (token bucket: емкость - допустимый всплеск, скорость - пополнение в минуту)
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # memory, redis, none
+    RATE_LIMIT_GENERATION_BURST = int(os.getenv('RATE_LIMIT_GENERATION_BURST', 3))
+    RATE_LIMIT_GENERATION_PER_MINUTE = float(os.getenv('RATE_LIMIT_GENERATION_PER_MINUTE', 2))
+    RATE_LIMIT_UI_BURST = int(os.getenv('RATE_LIMIT_UI_BURST', 20))
+    RATE_LIMIT_UI_PER_MINUTE = float(os.getenv('RATE_LIMIT_UI_PER_MINUTE', 60))
+    # Общий бюджет токенов OpenAI в минуту на все процессы (0 - без ограничения)
+    RATE_LIMIT_OPENAI_TPM = int(os.getenv('RATE_LIMIT_OPENAI_TPM', 150000))
+    RATE_LIMIT_GENERATION_TOKENS = int(os.getenv('RATE_LIMIT_GENERATION_TOKENS', 5000))  # оценка на одну генерацию
+    
     # Server Configuration
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 8000))
@@ -33,6 +81,58 @@ class Config:
     FREE_GENERATIONS = 2
     PREMIUM_GENERATIONS_PER_MONTH = 50
     
+    # Generation Cache
+    GENERATION_CACHE_BACKEND = os.getenv('GENERATION_CACHE_BACKEND', 'sqlite')  # sqlite, redis, none
+    GENERATION_CACHE_PATH = os.getenv('GENERATION_CACHE_PATH', 'generation_cache.db')
+    GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', 256))
+    GENERATION_CACHE_PERSISTENT_SIZE = int(os.getenv('GENERATION_CACHE_PERSISTENT_SIZE', 10000))
+    GENERATION_CACHE_TTL = int(os.getenv('GENERATION_CACHE_TTL', 7 * 24 * 3600))
+    
+    # Similar Prompts (доля совпадающих бит SimHash, начиная с которой описания считаются похожими)
+    SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', 0.9))
+    # Полосы LSH (соседние значения полосы проверяются multi-probe) и лимит проверяемых записей корзины
+    SIMILARITY_BANDS = int(os.getenv('SIMILARITY_BANDS', 4))
+    SIMILARITY_MAX_BUCKET_SCAN = int(os.getenv('SIMILARITY_MAX_BUCKET_SCAN', 64))
+    
+    # Streaming Progress (интервалы обновления сообщения о генерации)
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', 3.0))
+    STREAM_EDIT_MIN_CHARS = int(os.getenv('STREAM_EDIT_MIN_CHARS', 400))
+    
+    # Generation Queue
+    GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 4))
+    GENERATION_QUEUE_LIMIT = int(os.getenv('GENERATION_QUEUE_LIMIT', 200))
+    # Позиции в очереди пересчитываются не чаще интервала и не больше QUEUE_POSITION_MAX_EDITS правок за раз
+    QUEUE_POSITION_INTERVAL = float(os.getenv('QUEUE_POSITION_INTERVAL', 3.0))
+    QUEUE_POSITION_MAX_EDITS = int(os.getenv('QUEUE_POSITION_MAX_EDITS', 20))
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+    # Аренда задачи генерации: процесс продлевает ее, пока жив; просроченные задачи подхватывает другой процесс
+    GENERATION_LEASE_SECONDS = int(os.getenv('GENERATION_LEASE_SECONDS', 60))
+    GENERATION_MAX_ATTEMPTS = int(os.getenv('GENERATION_MAX_ATTEMPTS', 3))
+    # Повторно доставленные апдейты (ретраи вебхука) отбрасываются по update_id
+    UPDATE_DEDUP_TTL = int(os.getenv('UPDATE_DEDUP_TTL', 600))
+    UPDATE_DEDUP_SIZE = int(os.getenv('UPDATE_DEDUP_SIZE', 10000))
+    
+    # Bot Categories (ключевые слова и специализации промпта для классификатора)
+    BOT_CATEGORIES_FILE = os.getenv('BOT_CATEGORIES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_categories.json'))
+    
+    # Generated Code Validation
+    VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', 2))
+    VALIDATION_REPAIR = os.getenv('VALIDATION_REPAIR', 'True').lower() == 'true'
+    
     # Bot Templates Directory
-    BOT_TEMPLATES_DIR = 'bot_templates'
+    BOT_TEMPLATES_DIR = os.getenv('BOT_TEMPLATES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_templates'))
+    
+    # Template Fast Path (шаблон вместо полной генерации при уверенной классификации)
+    TEMPLATE_FAST_PATH = os.getenv('TEMPLATE_FAST_PATH', 'True').lower() == 'true'
+    TEMPLATE_MIN_CONFIDENCE = float(os.getenv('TEMPLATE_MIN_CONFIDENCE', 0.8))
+    # Минимальная сумма весов ключевых слов для мгновенного шаблона
+    TEMPLATE_MIN_SCORE = float(os.getenv('TEMPLATE_MIN_SCORE', 3.0))
+    TEMPLATE_HANDLERS_MAX_TOKENS = int(os.getenv('TEMPLATE_HANDLERS_MAX_TOKENS', 1500))
+    
+    # Fan-out Generation (короткий план, затем каждый файл отдельным параллельным запросом)
+    GENERATION_FANOUT = os.getenv('GENERATION_FANOUT', 'False').lower() == 'true'
+    FANOUT_CHEAP_MODEL = os.getenv('FANOUT_CHEAP_MODEL', 'gpt-3.5-turbo')  # config.py, requirements.txt, README.md
+    FANOUT_PLAN_MAX_TOKENS = int(os.getenv('FANOUT_PLAN_MAX_TOKENS', 700))
+    FANOUT_MAIN_MAX_TOKENS = int(os.getenv('FANOUT_MAIN_MAX_TOKENS', 3000))
+    FANOUT_FILE_MAX_TOKENS = int(os.getenv('FANOUT_FILE_MAX_TOKENS', 1000))
     GENERATED_BOTS_DIR = 'generated_bots'
@@ -1,9 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import create_engine, inspect, text, Column, Integer, BigInteger, String, DateTime, Boolean, Text, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from datetime import datetime
+import logging
 from config import Config
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
 class User(Base):
@@ -36,12 +40,17 @@ class Bot(Base):
     webhook_url = Column(String(500))
     owner_id = Column(Integer, ForeignKey('users.id'))
     status = Column(String(50), default='created')  # created, active, inactive, error
-    generated_code = Column(Text)
+    generated_code = deferred(Column(Text))  # загружается только при скачивании (undefer)
+    generated_files = deferred(Column(Text))  # JSON {имя файла: содержимое} остальных файлов проекта
     created_at = Column(DateTime, default=datetime.utcnow)
     last_updated = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     owner = relationship("User", back_populates="bots")
+    files = relationship("BotFile", back_populates="bot", cascade="all, delete-orphan")
+    
+    # Keyset-пагинация списка "Мои боты"
+    __table_args__ = (Index('ix_bots_owner_created', 'owner_id', 'created_at', 'id'),)
 
 class Generation(Base):
     __tablename__ = 'generations'
@@ -50,14 +59,46 @@ class Generation(Base):
     user_id = Column(Integer, ForeignKey('users.id'))
     bot_id = Column(Integer, ForeignKey('bots.id'))
     prompt = Column(Text, nullable=False)
+    bot_type = Column(String(50))  # ecommerce, support, news, general
+    prompt_simhash = Column(BigInteger)  # SimHash описания для поиска похожих генераций
     generated_code = Column(Text)
-    status = Column(String(50), default='pending')  # pending, completed, failed
+    status = Column(String(50), default='pending')  # pending, running, completed, failed, cancelled
+    validation_status = Column(String(20))  # passed, repaired, failed
+    repair_attempts = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime)
     
+    # Задача генерации: куда доставить результат и кто ее выполняет
+    chat_id = Column(BigInteger)
+    message_id = Column(Integer)  # сообщение "Генерирую бота..."
+    quota_premium = Column(Boolean)  # из какого лимита зарезервирована генерация
+    base_generation_id = Column(Integer, ForeignKey('generations.id'))  # доработка похожей генерации
+    lease_owner = Column(String(100))
+    lease_expires_at = Column(DateTime)
+    attempts = Column(Integer, default=0)
+    error = Column(Text)
+    
     # Relationships
     user = relationship("User", backref="generations")
     bot = relationship("Bot", backref="generations")
+    
+    __table_args__ = (Index('ix_generations_status_lease', 'status', 'lease_expires_at'),)
+
+class BotFile(Base):
+    """file_id документа, уже загруженного в Telegram, для повторной отправки без загрузки"""
+    __tablename__ = 'bot_files'
+    
+    id = Column(Integer, primary_key=True)
+    bot_id = Column(Integer, ForeignKey('bots.id'), nullable=False)
+    kind = Column(String(50), nullable=False)  # code, bundle
+    content_hash = Column(String(64), nullable=False)  # sha256 отправленного файла
+    file_id = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationships
+    bot = relationship("Bot", back_populates="files")
+    
+    __table_args__ = (UniqueConstraint('bot_id', 'kind'),)
 
 # Database setup
 # Для Vercel используем PostgreSQL, для локальной разработки - SQLite
@@ -71,8 +112,66 @@ else:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Асинхронный движок для Telegram бота: запросы не блокируют event loop
+_ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+}
+
+def async_database_url(url: str) -> str:
+    """Подставляет асинхронный драйвер в строку подключения"""
+    scheme, separator, rest = url.partition('://')
+    return _ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+if database_url.startswith('sqlite'):
+    async_engine = create_async_engine(async_database_url(database_url))
+else:
+    async_engine = create_async_engine(
+        async_database_url(database_url),
+        pool_pre_ping=True,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW
+    )
+
+# expire_on_commit=False: после commit объекты читаются без повторного запроса
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    migrate_schema()
+
+def migrate_schema(bind=None):
+    """
+    Доводит существующую базу до текущих моделей. create_all создает только
+    новые таблицы (bot_files), поэтому недостающие колонки добавляются через
+    ALTER TABLE, а индексы - если их еще нет. Все новые колонки nullable
+    и заполняются на стороне Python, так что ADD COLUMN без DEFAULT безопасен
+    """
+    bind = bind or engine
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                statement = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                for foreign_key in column.foreign_keys:
+                    statement += f' REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})'
+                logger.info(f"Migrating schema: {statement}")
+                connection.execute(text(statement))
+            
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    logger.info(f"Migrating schema: create index {index.name}")
+                    index.create(connection)
 
 def get_db():
     db = SessionLocal()
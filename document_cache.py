@@ -0,0 +1,68 @@
+import hashlib
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from telegram.error import BadRequest
+
+from database import AsyncSessionLocal, BotFile
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+async def _cached_file_id(bot_id: int, kind: str, digest: str):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(BotFile.file_id).where(
+            BotFile.bot_id == bot_id,
+            BotFile.kind == kind,
+            BotFile.content_hash == digest
+        ))
+
+
+async def _store_file_id(bot_id: int, kind: str, digest: str, file_id: str):
+    async with AsyncSessionLocal() as db:
+        entry = await db.scalar(select(BotFile).where(BotFile.bot_id == bot_id, BotFile.kind == kind))
+        if entry is None:
+            db.add(BotFile(bot_id=bot_id, kind=kind, content_hash=digest, file_id=file_id))
+        else:
+            # Содержимое изменилось - старый file_id больше не подходит
+            entry.content_hash = digest
+            entry.file_id = file_id
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Параллельная загрузка того же файла уже сохранила запись
+            await db.rollback()
+
+
+async def send_bot_document(telegram_bot, chat_id: int, bot_id: int, kind: str, content: bytes, filename: str,
+                            caption: str):
+    """
+    Отправляет файл бота. Первый раз файл загружается в Telegram, его
+    file_id запоминается вместе с хэшем содержимого; пока содержимое
+    не изменится, файл пересылается по file_id без повторной загрузки
+    """
+    digest = content_hash(content)
+    try:
+        file_id = await _cached_file_id(bot_id, kind, digest)
+    except Exception as e:
+        logger.warning(f"File cache lookup failed for bot {bot_id}: {e}")
+        file_id = None
+
+    if file_id:
+        try:
+            return await telegram_bot.send_document(chat_id, document=file_id, caption=caption)
+        except BadRequest as e:
+            # file_id мог стать недействительным (например, после смены токена бота)
+            logger.warning(f"Cached file_id rejected for bot {bot_id}: {e}")
+
+    sent = await telegram_bot.send_document(chat_id, document=content, filename=filename, caption=caption)
+    try:
+        await _store_file_id(bot_id, kind, digest, sent.document.file_id)
+    except Exception as e:
+        logger.warning(f"Failed to cache file_id for bot {bot_id}: {e}")
+    return sent
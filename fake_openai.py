@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Локальный сервер, совместимый с OpenAI Chat Completions, для нагрузочного
+и латентностного тестирования без расходов на API.
+
+Отдает записанные ответы (кассеты) из каталога, умеет имитировать задержку
+до первого токена, скорость потоковой выдачи и ошибки 429/5xx. В режиме
+записи проксирует запросы в настоящий API и сохраняет ответы как кассеты.
+
+Запуск:
+    python fake_openai.py --port 8100 --latency 2 --tokens-per-second 40
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 python main.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import random
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CASSETTES_DIR = Path(__file__).resolve().parent / 'cassettes'
+
+# Приблизительное деление текста на "токены": слова до 4 символов и пробелы
+_TOKEN_RE = re.compile(r'\S{1,4}|\s+')
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+def messages_key(messages: List[Dict[str, Any]]) -> str:
+    """Ключ кассеты: хеш всех сообщений запроса"""
+    raw = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _system_message(messages: List[Dict[str, Any]]) -> str:
+    for message in messages:
+        if message.get('role') == 'system':
+            return str(message.get('content') or '')
+    return ''
+
+
+def _last_user_message(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            return str(message.get('content') or '')
+    return ''
+
+
+class CassetteLibrary:
+    """
+    Кассеты - JSON-файлы вида {"key": ..., "match": [...], "content": ...}.
+    Ответ выбирается по точному ключу запроса, затем по ключевым словам
+    из "match", затем детерминированно по хешу описания. Кассеты с
+    "system_match" отвечают только на запросы с таким системным промптом
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.by_key = {}
+        self.cassettes = []
+        if not directory.exists():
+            logger.warning(f"Cassettes directory not found: {directory}")
+            return
+        for path in sorted(directory.glob('*.json')):
+            with open(path, encoding='utf-8') as f:
+                self.add(json.load(f))
+        logger.info(f"Loaded {len(self.cassettes)} cassettes from {directory}")
+
+    def add(self, cassette: Dict[str, Any]):
+        self.cassettes.append(cassette)
+        if cassette.get('key'):
+            self.by_key[cassette['key']] = cassette
+
+    def find(self, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        cassette = self.by_key.get(messages_key(messages))
+        if cassette:
+            return cassette
+
+        system = _system_message(messages).lower()
+        prompt = _last_user_message(messages).lower()
+        # "system_match" отделяет ответы на особые промпты (например, только обработчики шаблона)
+        candidates = [
+            cassette for cassette in self.cassettes
+            if any(word.lower() in system for word in cassette.get('system_match', ()))
+        ] or [cassette for cassette in self.cassettes if not cassette.get('system_match')]
+
+        for cassette in candidates:
+            if any(word.lower() in prompt for word in cassette.get('match', ())):
+                return cassette
+
+        if not candidates:
+            return None
+        digest = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+        return candidates[digest % len(candidates)]
+
+    def save(self, messages: List[Dict[str, Any]], content: str) -> Path:
+        key = messages_key(messages)
+        cassette = {
+            "key": key,
+            "prompt": _last_user_message(messages),
+            "content": content
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"recorded_{key}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(cassette, f, ensure_ascii=False, indent=2)
+        self.add(cassette)
+        return path
+
+
+class FakeOpenAIServer:
+    """Минимальный HTTP/1.1 сервер с keep-alive для POST /v1/chat/completions"""
+
+    def __init__(self, cassettes: CassetteLibrary, latency: float = 0.0, jitter: float = 0.0,
+                 tokens_per_second: float = 0.0, chunk_tokens: int = 1,
+                 rate_limit_rate: float = 0.0, server_error_rate: float = 0.0,
+                 retry_after: float = 1.0, upstream: Optional[str] = None,
+                 upstream_key: Optional[str] = None, seed: Optional[int] = None):
+        self.cassettes = cassettes
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.upstream = upstream
+        self.upstream_key = upstream_key
+        self.random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._server = None
+        self._connections = {}
+        self.stats = {
+            "requests": 0,
+            "streams": 0,
+            "rate_limited": 0,
+            "server_errors": 0,
+            "recorded": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+        }
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8100):
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=2 ** 20)
+        port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Fake OpenAI server listening on http://{host}:{port}/v1")
+        return port
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            # Простаивающие keep-alive соединения закрываются, чтобы обработчики завершились сами
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._connections.values(), return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, body = request
+                keep_alive = await self._dispatch(writer, method, path, body)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        return method, path.split('?', 1)[0], body
+
+    async def _dispatch(self, writer, method: str, path: str, body: bytes) -> bool:
+        if method == 'GET' and path in ('/health', '/v1/health'):
+            await self._send_json(writer, 200, self.stats)
+            return True
+        if method != 'POST' or not path.endswith('/chat/completions'):
+            await self._send_error(writer, 404, f"Unknown endpoint {method} {path}", 'invalid_request_error')
+            return True
+
+        try:
+            params = json.loads(body)
+        except ValueError:
+            await self._send_error(writer, 400, "Request body is not valid JSON", 'invalid_request_error')
+            return True
+
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            return await self._chat_completion(writer, params)
+        finally:
+            self.stats["in_flight"] -= 1
+
+    async def _chat_completion(self, writer, params: Dict[str, Any]) -> bool:
+        # Ошибки отдаются сразу: так ведет себя перегруженный upstream
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            await self._send_error(writer, 429, "Rate limit reached (injected)", 'rate_limit_error',
+                                   {'Retry-After': f"{self.retry_after:g}"})
+            return True
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            self.stats["server_errors"] += 1
+            status = self.random.choice((500, 503))
+            await self._send_error(writer, status, "Upstream failure (injected)", 'server_error')
+            return True
+
+        messages = params.get('messages') or []
+        model = params.get('model', 'gpt-4')
+
+        if self.upstream:
+            content = await self._record(params)
+        else:
+            cassette = self.cassettes.find(messages)
+            if cassette is None:
+                await self._send_error(writer, 404, "No cassette for this request", 'invalid_request_error')
+                return True
+            content = cassette['content']
+
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+        completion_id = f"chatcmpl-fake{next(self._ids)}"
+        if params.get('stream'):
+            self.stats["streams"] += 1
+            await self._stream(writer, completion_id, model, content)
+            return True
+
+        prompt_tokens = sum(len(_TOKEN_RE.findall(str(m.get('content') or ''))) for m in messages)
+        completion_tokens = len(_TOKEN_RE.findall(content))
+        await self._send_json(writer, 200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+        return True
+
+    async def _stream(self, writer, completion_id: str, model: str, content: str):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        created = int(time.time())
+        tokens = _TOKEN_RE.findall(content)
+        delay = self.chunk_tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        self._write_chunk(writer, event({"role": "assistant", "content": ""}))
+        for i in range(0, len(tokens), self.chunk_tokens):
+            self._write_chunk(writer, event({"content": ''.join(tokens[i:i + self.chunk_tokens])}))
+            await writer.drain()
+            if delay:
+                await asyncio.sleep(delay)
+        self._write_chunk(writer, event({}, 'stop'))
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _record(self, params: Dict[str, Any]) -> str:
+        """Запрашивает настоящий API (без потока) и сохраняет ответ как кассету"""
+        import httpx
+
+        upstream_params = {key: value for key, value in params.items() if key != 'stream'}
+        async with httpx.AsyncClient(timeout=300) as client:
+            response = await client.post(
+                f"{self.upstream.rstrip('/')}/chat/completions",
+                json=upstream_params,
+                headers={"Authorization": f"Bearer {self.upstream_key}"}
+            )
+            response.raise_for_status()
+        content = response.json()['choices'][0]['message']['content']
+        path = self.cassettes.save(params.get('messages') or [], content)
+        self.stats["recorded"] += 1
+        logger.info(f"Recorded cassette {path.name}")
+        return content
+
+    @staticmethod
+    def _write_chunk(writer, data: bytes):
+        writer.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    async def _send_json(self, writer, status: int, payload: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        lines = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _send_error(self, writer, status: int, message: str, error_type: str,
+                          headers: Optional[Dict[str, str]] = None):
+        await self._send_json(writer, status, {
+            "error": {"message": message, "type": error_type, "param": None, "code": None}
+        }, headers)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fake OpenAI Chat Completions server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--cassettes', default=str(DEFAULT_CASSETTES_DIR), help="Каталог с кассетами")
+    parser.add_argument('--latency', type=float, default=1.0, help="Задержка до первого токена, сек")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Разброс задержки, ± сек")
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help="Скорость потока; 0 - без задержек")
+    parser.add_argument('--chunk-tokens', type=int, default=1, help="Токенов в одном SSE-событии")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help="Доля ответов 500/503")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After для 429, сек")
+    parser.add_argument('--record', metavar='UPSTREAM_URL',
+                        help="Проксировать в настоящий API и записывать кассеты (ключ из OPENAI_API_KEY)")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+
+def server_from_args(args: argparse.Namespace) -> FakeOpenAIServer:
+    upstream_key = None
+    if args.record:
+        import os
+        upstream_key = os.getenv('OPENAI_API_KEY')
+    return FakeOpenAIServer(
+        CassetteLibrary(Path(args.cassettes)),
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        chunk_tokens=args.chunk_tokens,
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        retry_after=args.retry_after,
+        upstream=args.record,
+        upstream_key=upstream_key,
+        seed=args.seed
+    )
+
+
+async def serve(args: argparse.Namespace):
+    server = server_from_args(args)
+    await server.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(build_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
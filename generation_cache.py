@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_EDGE_PUNCTUATION_RE = re.compile(r'^[\s\.,!?;:«»"\'-]+|[\s\.,!?;:«»"\'-]+$')
+
+
+def normalize_prompt(user_prompt: str) -> str:
+    """Приводит описание бота к каноническому виду для ключа кэша"""
+    text = user_prompt.lower().replace('ё', 'е')
+    text = _WHITESPACE_RE.sub(' ', text)
+    return _EDGE_PUNCTUATION_RE.sub('', text)
+
+
+def make_cache_key(user_prompt: str, bot_type: str) -> str:
+    """Ключ кэша: тип бота + нормализованное описание"""
+    raw = f"{bot_type}\n{normalize_prompt(user_prompt)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SQLiteCacheBackend:
+    """Постоянный уровень кэша в отдельном SQLite файле"""
+
+    def __init__(self, path: str, max_entries: int, ttl: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generation_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_generation_cache_accessed "
+            "ON generation_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE generation_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            # Вытесняем устаревшие и самые давно использованные записи
+            self._conn.execute(
+                "DELETE FROM generation_cache WHERE created_at < ?", (now - self.ttl,)
+            )
+            self._conn.execute(
+                "DELETE FROM generation_cache WHERE key IN ("
+                "SELECT key FROM generation_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+
+class RedisCacheBackend:
+    """Постоянный уровень кэша в Redis (Config.REDIS_URL)"""
+
+    def __init__(self, url: str, ttl: int):
+        import redis  # Опциональная зависимость
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._redis.get(f"generation_cache:{key}")
+        return json.loads(value) if value else None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        # Размер ограничивается политикой maxmemory самого Redis
+        self._redis.set(f"generation_cache:{key}", json.dumps(value, ensure_ascii=False), ex=self.ttl)
+
+
+class GenerationCache:
+    """Двухуровневый кэш результатов генерации: LRU в памяти + SQLite/Redis"""
+
+    def __init__(self, max_size: int = None, ttl: int = None, backend: str = None):
+        self.max_size = max_size or Config.GENERATION_CACHE_SIZE
+        self.ttl = ttl or Config.GENERATION_CACHE_TTL
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.persistent = self._create_backend(backend or Config.GENERATION_CACHE_BACKEND)
+
+    def _create_backend(self, backend: str):
+        """Создает постоянный уровень кэша"""
+        try:
+            if backend == 'sqlite':
+                return SQLiteCacheBackend(
+                    Config.GENERATION_CACHE_PATH,
+                    Config.GENERATION_CACHE_PERSISTENT_SIZE,
+                    self.ttl
+                )
+            if backend == 'redis':
+                return RedisCacheBackend(Config.REDIS_URL, self.ttl)
+        except Exception as e:
+            logger.warning(f"Generation cache backend '{backend}' unavailable: {e}")
+        return None
+
+    def get(self, user_prompt: str, bot_type: str) -> Optional[Dict[str, Any]]:
+        """Возвращает закэшированный результат или None"""
+        key = make_cache_key(user_prompt, bot_type)
+
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            self.memory_hits += 1
+            return value
+
+        value = self._get_persistent(key)
+        if value is not None:
+            self.hits += 1
+            self._set_memory(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    def set(self, user_prompt: str, bot_type: str, result: Dict[str, Any]):
+        """Сохраняет успешный результат генерации"""
+        key = make_cache_key(user_prompt, bot_type)
+        self._set_memory(key, result)
+        if self.persistent:
+            try:
+                self.persistent.set(key, result)
+            except Exception as e:
+                logger.warning(f"Generation cache write failed: {e}")
+
+    async def aget(self, user_prompt: str, bot_type: str) -> Optional[Dict[str, Any]]:
+        """Асинхронный get: постоянный уровень читается вне event loop"""
+        key = make_cache_key(user_prompt, bot_type)
+
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            self.memory_hits += 1
+            return value
+
+        value = await asyncio.to_thread(self._get_persistent, key)
+        if value is not None:
+            self.hits += 1
+            self._set_memory(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    async def aset(self, user_prompt: str, bot_type: str, result: Dict[str, Any]):
+        """Асинхронный set: запись в постоянный уровень вне event loop"""
+        await asyncio.to_thread(self.set, user_prompt, bot_type, result)
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _set_memory(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = (time.time(), value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def _get_persistent(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.persistent:
+            return None
+        try:
+            return self.persistent.get(key)
+        except Exception as e:
+            logger.warning(f"Generation cache read failed: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "memory_size": len(self._memory),
+            "backend": type(self.persistent).__name__ if self.persistent else None
+        }
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from database import AsyncSessionLocal, Generation, User
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('pending', 'running')
+
+
+class LeaseLostError(Exception):
+    """Задачу забрал другой процесс: ее аренда истекла"""
+
+
+class JobRecord:
+    """Снимок задачи генерации, не привязанный к сессии БД"""
+
+    __slots__ = (
+        'id', 'user_id', 'telegram_id', 'chat_id', 'message_id', 'prompt', 'bot_type',
+        'quota_premium', 'base_generation_id', 'attempts'
+    )
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+
+class GenerationJobStore:
+    """
+    Задачи генерации в таблице generations. Строка создается со статусом
+    pending до запроса к модели и арендуется процессом (lease_owner,
+    lease_expires_at). Процесс продлевает аренду всех своих задач одним
+    UPDATE раз в треть срока; задачи с истекшей арендой - процесс упал
+    или был перезапущен - забирает и продолжает любой живой процесс
+    """
+
+    def __init__(self, lease_seconds: int = None, owner: str = None):
+        self.lease_seconds = lease_seconds or Config.GENERATION_LEASE_SECONDS
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._lease_task = None
+        self._resume_tasks = set()
+        self.resumed = 0
+
+    def _lease_until(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    async def create(self, user_id: int, telegram_id: int, chat_id: int, message_id: int, prompt: str,
+                     bot_type: str, prompt_simhash: int, premium: bool,
+                     base_generation_id: Optional[int] = None) -> JobRecord:
+        """Записывает задачу до запроса к модели; зарезервированная квота хранится вместе с ней"""
+        generation = Generation(
+            user_id=user_id,
+            prompt=prompt,
+            bot_type=bot_type,
+            prompt_simhash=prompt_simhash,
+            status='pending',
+            chat_id=chat_id,
+            message_id=message_id,
+            quota_premium=premium,
+            base_generation_id=base_generation_id,
+            lease_owner=self.owner,
+            lease_expires_at=self._lease_until(),
+            attempts=0
+        )
+        async with AsyncSessionLocal() as db:
+            db.add(generation)
+            await db.commit()
+
+        return JobRecord(
+            id=generation.id, user_id=user_id, telegram_id=telegram_id, chat_id=chat_id,
+            message_id=message_id, prompt=prompt, bot_type=bot_type, quota_premium=premium,
+            base_generation_id=base_generation_id, attempts=0
+        )
+
+    async def attach_message(self, job_id: int, message_id: int):
+        """Запоминает сообщение о ходе генерации (отправляется после создания задачи)"""
+        await self._finish(job_id, message_id=message_id)
+
+    async def mark_running(self, job_id: int):
+        """Воркер начинает генерацию; без аренды задачу выполняет другой процесс"""
+        statement = (
+            update(Generation)
+            .where(Generation.id == job_id, Generation.lease_owner == self.owner,
+                   Generation.status.in_(ACTIVE_STATUSES))
+            .values(status='running', attempts=Generation.attempts + 1, lease_expires_at=self._lease_until())
+            .execution_options(synchronize_session=False)
+        )
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(statement)
+            await db.commit()
+        if result.rowcount == 0:
+            raise LeaseLostError(f"Generation job {job_id} is leased by another process")
+
+    async def complete(self, db: AsyncSession, job_id: int, **values) -> bool:
+        """
+        Отмечает задачу выполненной в транзакции сохранения бота (commit делает
+        вызывающий). False - аренда потеряна, результат сохранит другой процесс
+        """
+        statement = (
+            update(Generation)
+            .where(Generation.id == job_id, Generation.lease_owner == self.owner, Generation.status == 'running')
+            .values(status='completed', completed_at=datetime.utcnow(), lease_owner=None,
+                    lease_expires_at=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(statement)
+        return result.rowcount == 1
+
+    async def fail(self, job_id: int, error: str) -> bool:
+        """False - задача уже не активна (например, ее отменил пользователь), квоту возвращать не нужно"""
+        return await self._finish(job_id, status='failed', error=error[:1000], completed_at=datetime.utcnow())
+
+    async def release(self, job_id: int):
+        """Возвращает задачу в очередь: ее сразу сможет забрать любой процесс"""
+        await self._finish(job_id, status='pending', lease_expires_at=datetime.utcnow())
+
+    async def cancel(self, job_id: int, user_id: int) -> Optional[bool]:
+        """
+        Отменяет задачу пользователя (users.id), в каком бы процессе она ни выполнялась.
+        Возвращает quota_premium для возврата генерации или None, если задача
+        уже завершилась. lease_owner сохраняется: по нему процесс-владелец
+        узнает об отмене и прерывает генерацию
+        """
+        statement = (
+            update(Generation)
+            .where(Generation.id == job_id, Generation.user_id == user_id, Generation.status.in_(ACTIVE_STATUSES))
+            .values(status='cancelled', completed_at=datetime.utcnow(), error='Cancelled by user')
+            .returning(Generation.quota_premium)
+            .execution_options(synchronize_session=False)
+        )
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(statement)).first()
+            await db.commit()
+        return None if row is None else bool(row.quota_premium)
+
+    async def take_cancelled(self) -> List[int]:
+        """Задачи процесса, отмененные пользователем (в том числе из другого процесса)"""
+        async with AsyncSessionLocal() as db:
+            job_ids = list((await db.scalars(
+                select(Generation.id).where(Generation.lease_owner == self.owner, Generation.status == 'cancelled')
+            )).all())
+            if job_ids:
+                await db.execute(
+                    update(Generation)
+                    .where(Generation.id.in_(job_ids))
+                    .values(lease_owner=None, lease_expires_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        return job_ids
+
+    async def _finish(self, job_id: int, **values) -> bool:
+        if 'status' in values and values['status'] != 'pending':
+            values.update(lease_owner=None, lease_expires_at=None)
+        statement = (
+            update(Generation)
+            .where(Generation.id == job_id, Generation.lease_owner == self.owner,
+                   Generation.status.in_(ACTIVE_STATUSES))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(statement)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to update generation job {job_id}: {e}")
+            return False
+        return result.rowcount == 1
+
+    async def renew(self) -> int:
+        """Продлевает аренду всех задач процесса одним запросом"""
+        statement = (
+            update(Generation)
+            .where(Generation.lease_owner == self.owner, Generation.status.in_(ACTIVE_STATUSES))
+            .values(lease_expires_at=self._lease_until())
+            .execution_options(synchronize_session=False)
+        )
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(statement)
+            await db.commit()
+        return result.rowcount
+
+    async def claim_expired(self, limit: int = 50) -> List[JobRecord]:
+        """Забирает задачи с истекшей арендой. Условный UPDATE не дает двум процессам взять одну задачу"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(
+                    Generation.id, Generation.user_id, User.telegram_id, Generation.chat_id, Generation.message_id,
+                    Generation.prompt, Generation.bot_type, Generation.quota_premium,
+                    Generation.base_generation_id, Generation.attempts
+                )
+                .join(User, User.id == Generation.user_id)
+                .where(Generation.status.in_(ACTIVE_STATUSES), Generation.lease_expires_at < now)
+                .order_by(Generation.id)
+                .limit(limit)
+            )).all()
+
+            claimed = []
+            for row in rows:
+                result = await db.execute(
+                    update(Generation)
+                    .where(Generation.id == row.id, Generation.status.in_(ACTIVE_STATUSES),
+                           Generation.lease_expires_at < now)
+                    .values(status='pending', lease_owner=self.owner, lease_expires_at=self._lease_until())
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    claimed.append(JobRecord(**row._asdict()))
+            await db.commit()
+        return claimed
+
+    async def start(self, on_resume: Callable[[JobRecord], Awaitable[None]], on_cancel: Callable[[int], None]):
+        """
+        Запускает продление аренды, подхват брошенных задач (сразу и затем
+        периодически) и прерывание задач, отмененных в других процессах
+        """
+        self._lease_task = asyncio.create_task(self._lease_loop(on_resume, on_cancel))
+
+    async def stop(self):
+        """
+        Останавливает продление аренды. Незавершенные задачи процесса сразу
+        становятся доступны другим процессам и следующему запуску
+        """
+        if self._lease_task:
+            self._lease_task.cancel()
+            await asyncio.gather(self._lease_task, return_exceptions=True)
+            self._lease_task = None
+        for task in list(self._resume_tasks):
+            task.cancel()
+        await asyncio.gather(*self._resume_tasks, return_exceptions=True)
+
+        statement = (
+            update(Generation)
+            .where(Generation.lease_owner == self.owner, Generation.status.in_(ACTIVE_STATUSES))
+            .values(lease_expires_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(statement)
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to release generation jobs: {e}")
+
+    async def _lease_loop(self, on_resume: Callable[[JobRecord], Awaitable[None]], on_cancel: Callable[[int], None]):
+        while True:
+            try:
+                await self.renew()
+                for job_id in await self.take_cancelled():
+                    on_cancel(job_id)
+                for job in await self.claim_expired():
+                    self.resumed += 1
+                    logger.info(f"Resuming generation job {job.id} (attempt {job.attempts + 1})")
+                    task = asyncio.create_task(on_resume(job))
+                    self._resume_tasks.add(task)
+                    task.add_done_callback(self._resume_tasks.discard)
+            except Exception as e:
+                logger.error(f"Generation job lease loop failed: {e}")
+            await asyncio.sleep(self.lease_seconds / 3)
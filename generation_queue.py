@@ -0,0 +1,264 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PREMIUM_LANE = 'premium'
+FREE_LANE = 'free'
+
+_job_ids = itertools.count(1)
+
+
+class QueueFullError(Exception):
+    """Очередь генераций переполнена"""
+
+
+class GenerationJob:
+    """Задача генерации, ожидающая свободного воркера"""
+
+    def __init__(self, user_id: int, premium: bool, factory: Callable[[], Awaitable[Any]],
+                 on_position: Optional[Callable[[int], Awaitable[None]]] = None):
+        self.id = next(_job_ids)
+        self.user_id = user_id
+        self.lane = PREMIUM_LANE if premium else FREE_LANE
+        self.factory = factory
+        self.on_position = on_position
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.last_position = None
+        self.task = None
+        self.cancelled = False
+
+
+class GenerationScheduler:
+    """
+    Планировщик генераций: ограниченное число воркеров, приоритетная полоса
+    для Premium и справедливый round-robin между пользователями внутри полосы
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None):
+        self.workers = workers or Config.GENERATION_WORKERS
+        self.max_queue = max_queue or Config.GENERATION_QUEUE_LIMIT
+        self._lanes = {PREMIUM_LANE: OrderedDict(), FREE_LANE: OrderedDict()}
+        self._available = None
+        self._worker_tasks = []
+        self._running = {}
+        self._wait_times = deque(maxlen=200)
+        self._notify_handle = None
+        self._notify_tasks = set()
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    async def start(self):
+        """Запускает воркеры в текущем event loop"""
+        self._stopping = False
+        self._available = asyncio.Semaphore(0)
+        for i in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"Generation scheduler started with {self.workers} workers")
+
+    async def stop(self):
+        """Останавливает воркеры"""
+        self._stopping = True
+        if self._notify_handle:
+            self._notify_handle.cancel()
+            self._notify_handle = None
+        for task in [*self._worker_tasks, *self._notify_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, *self._notify_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, user_id: int, premium: bool, factory: Callable[[], Awaitable[Any]],
+               on_position: Optional[Callable[[int], Awaitable[None]]] = None) -> GenerationJob:
+        """Ставит задачу в очередь; результат доступен через job.future"""
+        if self.depth() >= self.max_queue:
+            raise QueueFullError(f"Generation queue is full ({self.max_queue})")
+
+        job = GenerationJob(user_id, premium, factory, on_position)
+        self._lanes[job.lane].setdefault(user_id, deque()).append(job)
+        self._available.release()
+        self._notify_positions()
+        return job
+
+    def cancel(self, job: GenerationJob) -> bool:
+        """
+        Отменяет задачу: ожидающая убирается из очереди, запущенная прерывается,
+        и воркер сразу берет следующую. False - задача уже завершилась
+        """
+        if job.future.done():
+            return False
+        job.cancelled = True
+
+        users = self._lanes[job.lane]
+        jobs = users.get(job.user_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del users[job.user_id]
+            job.future.cancel()
+            self.cancelled += 1
+            self._notify_positions()
+        elif job.task:
+            job.task.cancel()
+        return True
+
+    def depth(self, lane: str = None) -> int:
+        """Количество задач в очереди"""
+        lanes = [self._lanes[lane]] if lane else self._lanes.values()
+        return sum(len(jobs) for users in lanes for jobs in users.values())
+
+    def position(self, job: GenerationJob) -> Optional[int]:
+        """Позиция задачи в очереди (1 - следующая), None если уже запущена"""
+        users = self._lanes[job.lane]
+        jobs = users.get(job.user_id)
+        if not jobs or job not in jobs:
+            return None
+
+        index = jobs.index(job)
+        position = self.depth(PREMIUM_LANE) if job.lane == FREE_LANE else 0
+
+        # Round-robin: в каждом раунде у каждого пользователя берется по одной задаче.
+        # Раньше идут все задачи предыдущих раундов и задачи этого раунда
+        # у пользователей, стоящих в круге перед владельцем
+        before_owner = True
+        for user_id, user_jobs in users.items():
+            if user_id == job.user_id:
+                before_owner = False
+            position += min(len(user_jobs), index)
+            if before_owner and len(user_jobs) > index:
+                position += 1
+
+        return position + 1
+
+    def _next_job(self) -> Optional[GenerationJob]:
+        for lane in (PREMIUM_LANE, FREE_LANE):
+            users = self._lanes[lane]
+            if not users:
+                continue
+            user_id, jobs = next(iter(users.items()))
+            job = jobs.popleft()
+            # Пользователь уходит в конец круга
+            del users[user_id]
+            if jobs:
+                users[user_id] = jobs
+            return job
+        return None
+
+    async def _worker(self, worker_id: int):
+        while True:
+            await self._available.acquire()
+            job = self._next_job()
+            if job is None:
+                continue
+
+            job.started_at = time.monotonic()
+            self._wait_times.append(job.started_at - job.enqueued_at)
+            self._running[job.id] = job
+            self._notify_positions()
+
+            try:
+                job.task = asyncio.create_task(job.factory())
+                result = await job.task
+                if not job.future.done():
+                    job.future.set_result(result)
+                self.completed += 1
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                # Отменена только задача - воркер продолжает работу; при остановке выходит
+                if job.cancelled and not self._stopping:
+                    self.cancelled += 1
+                    continue
+                raise
+            except Exception as e:
+                logger.error(f"Generation job {job.id} failed: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+                self.failed += 1
+            finally:
+                self._running.pop(job.id, None)
+
+    def _positions(self) -> Dict[GenerationJob, int]:
+        """Позиции всех задач за один проход в порядке, в котором их возьмут воркеры"""
+        positions = {}
+        position = 0
+        for lane in (PREMIUM_LANE, FREE_LANE):
+            users = list(self._lanes[lane].values())
+            round_index = 0
+            while users:
+                for jobs in users:
+                    position += 1
+                    positions[jobs[round_index]] = position
+                round_index += 1
+                users = [jobs for jobs in users if len(jobs) > round_index]
+        return positions
+
+    @staticmethod
+    def _position_changed(last_position: Optional[int], position: int) -> bool:
+        # Первые места показываются точно, дальше - когда позиция переходит через десяток
+        if last_position is None:
+            return True
+        if position <= 10:
+            return position != last_position
+        return position // 10 != last_position // 10
+
+    def _notify_positions(self):
+        """
+        Планирует рассылку позиций в очереди. Изменения за QUEUE_POSITION_INTERVAL
+        собираются в один пересчет, чтобы не упираться в лимиты Telegram
+        """
+        if self._notify_handle is None and not self._stopping:
+            self._notify_handle = asyncio.get_running_loop().call_later(
+                Config.QUEUE_POSITION_INTERVAL, self._sweep_positions
+            )
+
+    def _sweep_positions(self):
+        """Сообщает пользователям новые позиции, не больше QUEUE_POSITION_MAX_EDITS за раз"""
+        self._notify_handle = None
+        edits = 0
+        for job, position in self._positions().items():
+            if not job.on_position or not self._position_changed(job.last_position, position):
+                continue
+            if edits >= Config.QUEUE_POSITION_MAX_EDITS:
+                # Остальные задачи получат позицию в следующий пересчет
+                self._notify_positions()
+                break
+            edits += 1
+            job.last_position = position
+            task = asyncio.create_task(self._safe_notify(job, position))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+
+    async def _safe_notify(self, job: GenerationJob, position: int):
+        # Задача могла стартовать раньше, чем дошло уведомление
+        if job.started_at is not None:
+            return
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.debug(f"Queue position notify failed: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        """Метрики очереди: глубина по полосам и время ожидания"""
+        waits = sorted(self._wait_times)
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "queued_premium": self.depth(PREMIUM_LANE),
+            "queued_free": self.depth(FREE_LANE),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "avg_wait": round(sum(waits) / len(waits), 2) if waits else 0.0,
+            "p95_wait": round(waits[int((len(waits) - 1) * 0.95)], 2) if waits else 0.0,
+            "max_wait": round(waits[-1], 2) if waits else 0.0
+        }
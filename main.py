@@ -1,12 +1,35 @@
 import logging
 import asyncio
+import functools
+import html
+import math
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from database import User, Bot, Generation, create_tables, SessionLocal
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import undefer
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import User, Bot, Generation, create_tables, SessionLocal, AsyncSessionLocal
+from bot_context import BOT_CONTEXT_TYPES, BotContext, with_db_session
 from ai_service import AIService
+from generation_queue import GenerationScheduler, QueueFullError
+from similarity_index import PromptSimilarityIndex, simhash, simhash_to_db
+from user_cache import UserProfile, UserProfileCache
+from webhook_server import run_webhook
+from state_persistence import StatePersistence
+from quota import QuotaReservation, has_quota, is_premium_active, refund_generation, reserve_generation
+from generation_jobs import GenerationJobStore, JobRecord, LeaseLostError
+from generation_cache import normalize_prompt
+from singleflight import RecentIds, SingleFlight
+from rate_limit import GENERATION, OPENAI_TOKENS, UI, RateLimiter
+from document_cache import send_bot_document
+from callback_router import CallbackRouter, callback_data
+from project_bundle import build_project_zip, dump_project_files, load_project_files
 from config import Config
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,18 +38,176 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MY_BOTS_PAGE_SIZE = 5
+# Кнопки, которые расходуют генерацию; reuse не обращается к модели
+_EPOCH = datetime(1970, 1, 1)
+
+def encode_bots_cursor(created_at: datetime, bot_id: int) -> str:
+    """Курсор страницы "Мои боты" для callback_data (лимит Telegram - 64 байта)"""
+    return f"{(created_at - _EPOCH) // timedelta(microseconds=1)}_{bot_id}"
+
+def decode_bots_cursor(cursor: str) -> Tuple[datetime, int]:
+    micros, bot_id = cursor.split("_")
+    return _EPOCH + timedelta(microseconds=int(micros)), int(bot_id)
+
+def bot_code_file(name: str, description: str, code: str) -> bytes:
+    """Содержимое .py файла бота, одинаковое при создании и скачивании"""
+    return f"# {name}\n# {description}\n\n{code}".encode()
+
+class GenerationProgress:
+    """Показывает ход потоковой генерации и отправляет готовые файлы"""
+    
+    def __init__(self, message, processing_msg, reply_markup=None):
+        self.message = message
+        self.processing_msg = processing_msg
+        self.reply_markup = reply_markup
+        self.received_chars = 0
+        self.sent_files = []
+        # Хотя бы один файл не дошел - итоговый результат отправляется целиком
+        self.delivery_failed = False
+        self._send_paused_until = 0.0
+        self._chars_at_last_edit = 0
+        self._last_edit_at = time.monotonic()
+    
+    async def on_chunk(self, delta: str, blocks: list):
+        """Колбэк для AIService.agenerate_bot_code"""
+        self.received_chars += len(delta)
+        
+        for block in blocks:
+            await self._send_block(block)
+        
+        await self._maybe_edit()
+    
+    async def _send_block(self, block: dict):
+        """
+        Отправляет файл сразу после того, как модель его дописала. Ошибка Telegram
+        не прерывает оплаченную генерацию: файл пропускается, а результат
+        отправляется целиком после сохранения
+        """
+        if not block['content'].strip():
+            return
+        
+        filename = block['filename'] or f"file_{len(self.sent_files) + 1}.{block['language'] or 'txt'}"
+        if time.monotonic() < self._send_paused_until:
+            self.delivery_failed = True
+            return
+        try:
+            await self.message.reply_document(
+                document=block['content'].encode(),
+                filename=filename,
+                caption=f"📄 {filename}"
+            )
+        except RetryAfter as e:
+            self._send_paused_until = time.monotonic() + e.retry_after
+            self.delivery_failed = True
+            logger.warning(f"Progress file {filename} skipped, retry after {e.retry_after}s")
+            return
+        except TelegramError as e:
+            self.delivery_failed = True
+            logger.warning(f"Progress file {filename} not sent: {e}")
+            return
+        self.sent_files.append(filename)
+    
+    async def _maybe_edit(self):
+        """Редактирует сообщение не чаще лимитов Telegram"""
+        now = time.monotonic()
+        if now - self._last_edit_at < Config.STREAM_EDIT_INTERVAL:
+            return
+        if self.received_chars - self._chars_at_last_edit < Config.STREAM_EDIT_MIN_CHARS:
+            return
+        
+        self._last_edit_at = now
+        self._chars_at_last_edit = self.received_chars
+        
+        files_text = ", ".join(self.sent_files) if self.sent_files else "—"
+        try:
+            await self.processing_msg.edit_text(
+                "🔄 <b>Генерирую бота...</b>\n\n"
+                f"Получено символов: {self.received_chars}\n"
+                f"Готовые файлы: {files_text}",
+                parse_mode='HTML',
+                reply_markup=self.reply_markup
+            )
+        except RetryAfter as e:
+            # Telegram попросил подождать - откладываем следующее обновление
+            self._last_edit_at = now + e.retry_after
+        except TelegramError as e:
+            # Сообщение удалено или текст не изменился - прогресс не должен прерывать генерацию
+            logger.debug(f"Progress edit skipped: {e}")
+
 class BotCreatorBot:
     def __init__(self):
         self.ai_service = AIService()
-        self.db = SessionLocal()
+        self.scheduler = GenerationScheduler()
+        self.similarity_index = PromptSimilarityIndex()
+        self.user_cache = UserProfileCache()
+        self.jobs = GenerationJobStore()
+        # Генерации пользователей, которые еще идут: (telegram_id, описание, основа)
+        self.user_generations = SingleFlight()
+        self.recent_updates = RecentIds()
+        # user_data и отметки апдейтов в хранилище, общем для воркеров вебхука
+        self.state = StatePersistence()
+        self.rate_limiter = RateLimiter()
+        # Задачи генерации этого процесса в очереди планировщика и отмененные пользователем
+        self._queued_jobs = {}
+        self._cancelled_jobs = set()
+        self._rate_limit_notified = {}
+        self.telegram = None
+        self.callbacks = self._build_callback_router()
+    
+    def _build_callback_router(self) -> CallbackRouter:
+        """Маршруты кнопок; имя маршрута - префикс callback_data"""
+        router = CallbackRouter()
+        router.add("create_bot", self.create_bot)
+        router.add("my_bots", self.my_bots)
+        router.add("my_bots_page", self.my_bots_page, str, decode_bots_cursor)
+        router.add("premium", self.premium)
+        router.add("help", self.help)
+        router.add("back_to_main", self.back_to_main)
+        router.add("download", self.download_bot, int)
+        router.add("bundle", self.download_bundle, int)
+        router.add("deploy", self.deploy_bot, int)
+        router.add("bot_details", self.show_bot_details, int)
+        router.add("reuse", functools.partial(self.reuse_generation, mode="reuse"), int)
+        router.add("adapt", functools.partial(self.reuse_generation, mode="adapt"), int)
+        router.add("regenerate", functools.partial(self.reuse_generation, generation_id=None, mode="regenerate"))
+        router.add("cancel", self.cancel_generation, int)
+        return router
+    
+    async def post_init(self, application: Application):
+        """Запускает воркеры очереди генераций, строит индекс похожих описаний и продолжает брошенные задачи"""
+        self.telegram = application.bot
+        await self.scheduler.start()
+        await self.user_cache.start()
+        await asyncio.to_thread(self._load_similarity_index)
+        # Сразу подхватывает задачи, брошенные при прошлой остановке
+        await self.jobs.start(self._resume_job, self._cancel_local_job)
+    
+    def _load_similarity_index(self):
+        """Загружает успешные генерации в индекс похожих описаний"""
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Generation.id, Generation.prompt, Generation.bot_type, Generation.prompt_simhash
+            ).filter(Generation.status == 'completed').yield_per(1000)
+            self.similarity_index.load(rows)
+        finally:
+            db.close()
+    
+    async def post_shutdown(self, application: Application):
+        """Останавливает воркеры очереди генераций и пул проверки кода"""
+        await self.scheduler.stop()
+        await self.jobs.stop()
+        await self.user_cache.stop()
+        self.ai_service.validator.shutdown()
         
-    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def start(self, update: Update, context: BotContext):
         """Обработчик команды /start"""
         user = update.effective_user
         user_id = user.id
         
         # Регистрируем пользователя в базе данных
-        db_user = self.db.query(User).filter(User.telegram_id == user_id).first()
+        db_user = await self._get_user(context.db, user_id)
         if not db_user:
             db_user = User(
                 telegram_id=user_id,
@@ -34,8 +215,9 @@ class BotCreatorBot:
                 first_name=user.first_name,
                 last_name=user.last_name
             )
-            self.db.add(db_user)
-            self.db.commit()
+            context.db.add(db_user)
+            await context.db.commit()
+            db_user = self.user_cache.put(db_user)
         
         welcome_text = f"""
 🤖 <b>Добро пожаловать в Bot Creator!</b>
@@ -53,8 +235,8 @@ class BotCreatorBot:
 • 💎 Premium: {Config.PREMIUM_GENERATIONS_PER_MONTH} генераций в месяц
 
 <b>Твоя статистика:</b>
-• Использовано бесплатных: {db_user.free_generations_used}/{Config.FREE_GENERATIONS}
-• Premium статус: {'✅' if db_user.is_premium else '❌'}
+• Использовано бесплатных: {db_user.free_generations_used or 0}/{db_user.free_generations_limit or Config.FREE_GENERATIONS}
+• Premium статус: {'✅' if is_premium_active(db_user) else '❌'}
 
 Выбери действие:
         """
@@ -69,16 +251,16 @@ class BotCreatorBot:
         
         await update.message.reply_text(welcome_text, parse_mode='HTML', reply_markup=reply_markup)
     
-    async def create_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def create_bot(self, update: Update, context: BotContext):
         """Обработчик создания бота"""
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
-        db_user = self.db.query(User).filter(User.telegram_id == user_id).first()
+        db_user = await self._get_user(context.db, user_id)
         
         # Проверяем лимиты
-        if not db_user.is_premium and db_user.free_generations_used >= Config.FREE_GENERATIONS:
+        if not has_quota(db_user):
             await query.edit_message_text(
                 "❌ <b>Лимит исчерпан!</b>\n\n"
                 "Ты использовал все бесплатные генерации. "
@@ -103,7 +285,7 @@ class BotCreatorBot:
         # Устанавливаем состояние ожидания описания
         context.user_data['waiting_for_description'] = True
     
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def handle_message(self, update: Update, context: BotContext):
         """Обработчик текстовых сообщений"""
         if context.user_data.get('waiting_for_description'):
             await self.process_bot_description(update, context)
@@ -112,7 +294,7 @@ class BotCreatorBot:
                 "Используй команды из меню или /start для начала работы! 🤖"
             )
     
-    async def process_bot_description(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def process_bot_description(self, update: Update, context: BotContext):
         """Обработка описания бота от пользователя"""
         description = update.message.text
         user_id = update.effective_user.id
@@ -120,70 +302,493 @@ class BotCreatorBot:
         # Убираем состояние ожидания
         context.user_data['waiting_for_description'] = False
         
+        # Определяем тип бота
+        bot_type = self.ai_service.analyze_bot_requirements(description)
+        
+        # Если похожий бот уже генерировался, предлагаем не тратить новую генерацию
+        match = self.similarity_index.find(description, bot_type)
+        if match:
+            generation_id, score = match
+            context.user_data['pending_description'] = description
+            keyboard = [
+                [InlineKeyboardButton("♻️ Использовать готовый", callback_data=callback_data("reuse", generation_id))],
+                [InlineKeyboardButton("✏️ Доработать его", callback_data=callback_data("adapt", generation_id))],
+                [InlineKeyboardButton("🆕 Сгенерировать заново", callback_data="regenerate")]
+            ]
+            await update.message.reply_text(
+                "♻️ <b>Похожий бот уже создавался</b>\n\n"
+                f"Совпадение с твоим описанием: {round(score * 100)}%\n\n"
+                "Можно сразу взять готовый результат, доработать его под твое описание "
+                "или сгенерировать бота с нуля.",
+                parse_mode='HTML',
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
+        
+        await self.run_generation(context.db, update.message, user_id, description, bot_type)
+    
+    async def _get_user(self, db: AsyncSession, telegram_id: int) -> Optional[UserProfile]:
+        """Профиль пользователя по Telegram ID (из кэша, если есть) или None"""
+        profile = self.user_cache.get(telegram_id)
+        if profile is None:
+            db_user = await db.scalar(select(User).where(User.telegram_id == telegram_id))
+            if db_user is None:
+                return None
+            profile = self.user_cache.put(db_user)
+        return profile
+    
+    async def drop_duplicate_updates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Отбрасывает повторно доставленный апдейт (группа -3, раньше всех обработчиков).
+        Ретрай Telegram может попасть в другой воркер вебхука, поэтому при нескольких
+        воркерах update_id дополнительно отмечается в общем хранилище состояния
+        """
+        duplicate = not self.recent_updates.add(update.update_id)
+        if not duplicate and Config.BOT_MODE == 'webhook' and Config.WEBHOOK_WORKERS > 1:
+            try:
+                duplicate = not await self.state.mark_seen('update', update.update_id, Config.UPDATE_DEDUP_TTL)
+            except Exception as e:
+                # Недоступное хранилище не должно останавливать бота
+                logger.warning(f"Shared update dedup unavailable: {e}")
+            if duplicate:
+                self.recent_updates.duplicates += 1
+        if duplicate:
+            logger.info(f"Duplicate update {update.update_id} dropped")
+            raise ApplicationHandlerStop
+    
+    async def rate_limit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Ограничивает частоту действий пользователя (группа -1, до основных обработчиков).
+        Здесь только дешевая корзина UI: слот генерации и бюджет OpenAI списываются
+        в _execute_job, когда действительно нужен запрос к модели
+        """
+        user = update.effective_user
+        if user is None or user.id in Config.ADMIN_USER_IDS:
+            return
+        
+        retry_after = await self.rate_limiter.acquire(UI, user.id)
+        if not retry_after:
+            return
+        
+        await self._notify_rate_limited(update, retry_after)
+        raise ApplicationHandlerStop
+    
+    async def _notify_rate_limited(self, update: Update, retry_after: float):
+        """Отвечает один раз за период ограничения, чтобы не тратить лимиты Telegram на спам"""
+        text = f"⏳ Слишком много запросов. Попробуй через {math.ceil(retry_after)} с"
+        
+        now = time.monotonic()
+        user_id = update.effective_user.id
+        notify = self._rate_limit_notified.get(user_id, 0) <= now
+        if notify:
+            self._rate_limit_notified[user_id] = now + retry_after
+            if len(self._rate_limit_notified) > Config.USER_CACHE_SIZE:
+                self._rate_limit_notified = {
+                    key: until for key, until in self._rate_limit_notified.items() if until > now
+                }
+        
+        try:
+            if update.callback_query:
+                # На нажатие нужно ответить в любом случае, иначе кнопка "зависнет"
+                await update.callback_query.answer(text if notify else None)
+            elif update.message and notify:
+                await update.message.reply_text(text)
+        except BadRequest as e:
+            logger.debug(f"Rate limit notice skipped: {e}")
+    
+    async def _acquire_generation(self, telegram_id: int) -> Tuple[float, bool]:
+        """
+        Списывает оценку токенов из общего бюджета OpenAI, а после него - слот из корзины
+        генераций пользователя; если слота нет, токены возвращаются.
+        Возвращает (через сколько секунд повторить, исчерпан ли общий бюджет)
+        """
+        if telegram_id in Config.ADMIN_USER_IDS:
+            return 0.0, False
+        tokens = Config.RATE_LIMIT_GENERATION_TOKENS
+        retry_after = await self.rate_limiter.acquire(OPENAI_TOKENS, cost=tokens)
+        if retry_after:
+            return retry_after, True
+        retry_after = await self.rate_limiter.acquire(GENERATION, telegram_id)
+        if retry_after:
+            await self.rate_limiter.refund(OPENAI_TOKENS, cost=tokens)
+        return retry_after, False
+    
+    async def _release_generation(self, telegram_id: int):
+        """Возвращает списанное _acquire_generation, если запроса к модели не было"""
+        if telegram_id in Config.ADMIN_USER_IDS:
+            return
+        await self.rate_limiter.refund(OPENAI_TOKENS, cost=Config.RATE_LIMIT_GENERATION_TOKENS)
+        await self.rate_limiter.refund(GENERATION, telegram_id)
+    
+    async def track_activity(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отмечает активность пользователя без запроса к БД (группа -2, до основных обработчиков)"""
+        if update.effective_user:
+            self.user_cache.touch(update.effective_user.id)
+    
+    async def run_generation(self, db: AsyncSession, message, user_id: int, description: str, bot_type: str,
+                             base_code: str = None, base_generation_id: int = None):
+        """Создает задачу генерации, выполняет ее через очередь и отправляет результат в чат message"""
+        # Повторная отправка того же описания или двойное нажатие не запускают вторую генерацию
+        key = (user_id, normalize_prompt(description), base_generation_id)
+        if self.user_generations.in_flight(key):
+            await message.reply_text("⏳ Этот бот уже генерируется - результат придет в этот чат!")
+            return
+        await self.user_generations.do(
+            key, lambda: self._run_generation(db, message, user_id, description, bot_type, base_code, base_generation_id)
+        )
+    
+    async def _run_generation(self, db: AsyncSession, message, user_id: int, description: str, bot_type: str,
+                              base_code: Optional[str], base_generation_id: Optional[int]):
+        db_user = await self._get_user(db, user_id)
+        # Транзакция закрывается, чтобы соединение не простаивало, пока генерация ждет очереди
+        await db.commit()
+        if db_user is None:
+            await message.reply_text("Сначала нажми /start 🤖")
+            return
+        
+        # Генерация списывается до запроса к модели и возвращается, если не состоялась
+        reservation = await reserve_generation(db_user.id, is_premium_active(db_user))
+        self.user_cache.invalidate(user_id)
+        if reservation is None:
+            await message.reply_text(
+                "❌ <b>Лимит исчерпан!</b>\n\n"
+                "Ты использовал все доступные генерации. "
+                "Оформи Premium подписку для продолжения работы!",
+                parse_mode='HTML',
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Оформить Premium", callback_data="premium")]])
+            )
+            return
+        
+        # Задача записывается до запроса к модели: после падения процесса ее продолжит другой
+        try:
+            job = await self.jobs.create(
+                user_id=db_user.id, telegram_id=user_id, chat_id=message.chat_id, message_id=None,
+                prompt=description, bot_type=bot_type, prompt_simhash=simhash_to_db(simhash(description)),
+                premium=reservation.premium, base_generation_id=base_generation_id
+            )
+        except Exception as e:
+            logger.error(f"Failed to create generation job: {e}")
+            await refund_generation(reservation)
+            self.user_cache.invalidate(user_id)
+            await message.reply_text(
+                "❌ <b>Произошла ошибка</b>\n\nПопробуй еще раз или обратись в поддержку!",
+                parse_mode='HTML'
+            )
+            return
+        
         # Показываем процесс генерации
-        processing_msg = await update.message.reply_text(
+        processing_msg = await message.reply_text(
             "🔄 <b>Генерирую бота...</b>\n\n"
             "Это может занять несколько минут. Пожалуйста, подожди! ⏳",
-            parse_mode='HTML'
+            parse_mode='HTML',
+            reply_markup=self._cancel_markup(job.id)
         )
+        job.message_id = processing_msg.message_id
+        await self.jobs.attach_message(job.id, processing_msg.message_id)
+        
+        # Генерируем код бота потоком, показывая прогресс и готовые файлы
+        progress = GenerationProgress(message, processing_msg, self._cancel_markup(job.id))
+        await self._execute_job(job, reservation, base_code, is_premium_active(db_user), progress)
+    
+    async def _resume_job(self, job: JobRecord):
+        """Продолжает задачу, брошенную упавшим или перезапущенным процессом"""
+        reservation = QuotaReservation(job.user_id, job.quota_premium, used=0)
+        if job.attempts >= Config.GENERATION_MAX_ATTEMPTS:
+            if not await self.jobs.fail(job.id, "Too many attempts"):
+                return
+            await refund_generation(reservation)
+            self.user_cache.invalidate(job.telegram_id)
+            await self._edit_status(
+                job, "❌ <b>Не удалось сгенерировать бота</b>\n\nГенерация возвращена на баланс, попробуй еще раз!"
+            )
+            return
+        
+        base_code = None
+        async with AsyncSessionLocal() as db:
+            db_user = await self._get_user(db, job.telegram_id)
+            if job.base_generation_id:
+                base_code = await db.scalar(
+                    select(Generation.generated_code).where(Generation.id == job.base_generation_id)
+                )
+        premium = bool(db_user and is_premium_active(db_user))
+        
+        await self._edit_status(job, "🔄 <b>Продолжаю генерацию бота...</b>\n\nБот перезапускался, результат придет сюда ⏳",
+                                cancellable=True)
+        # Задача уже прошла лимиты до перезапуска
+        await self._execute_job(job, reservation, base_code, premium, rate_limited=False)
+    
+    @staticmethod
+    def _cancel_markup(job_id: int) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отменить", callback_data=callback_data("cancel", job_id))]])
+    
+    def _cancel_local_job(self, job_id: int):
+        """Прерывает генерацию в этом процессе; воркер сразу берет следующую задачу"""
+        queued = self._queued_jobs.get(job_id)
+        if queued is not None:
+            self._cancelled_jobs.add(job_id)
+            self.scheduler.cancel(queued)
+    
+    async def cancel_generation(self, update: Update, context: BotContext, job_id: int):
+        """Кнопка "Отменить" под сообщением о генерации"""
+        query = update.callback_query
+        user_id = query.from_user.id
+        db_user = await self._get_user(context.db, user_id)
+        premium = await self.jobs.cancel(job_id, db_user.id) if db_user else None
+        if premium is None:
+            await query.answer("Генерация уже завершена")
+            return
         
+        # Отмена в БД видна всем процессам; если задача выполняется здесь - прерываем сразу
+        self._cancel_local_job(job_id)
+        await refund_generation(QuotaReservation(db_user.id, premium, used=0))
+        self.user_cache.invalidate(user_id)
+        await query.answer("Генерация отменена")
+        await query.edit_message_text(
+            "❌ <b>Генерация отменена</b>\n\nГенерация возвращена на баланс.",
+            parse_mode='HTML'
+        )
+    
+    async def _edit_status(self, job: JobRecord, text: str, cancellable: bool = False):
+        """
+        Обновляет сообщение о ходе генерации (в том числе после перезапуска процесса).
+        cancellable - генерация еще идет, кнопка отмены остается
+        """
+        if job.message_id is None:
+            return
+        try:
+            await self.telegram.edit_message_text(
+                text, chat_id=job.chat_id, message_id=job.message_id, parse_mode='HTML',
+                reply_markup=self._cancel_markup(job.id) if cancellable else None
+            )
+        except TelegramError as e:
+            # Сообщение удалено, текст не изменился или Telegram просит подождать -
+            # статус не должен мешать доставке результата
+            logger.debug(f"Status edit skipped: {e}")
+    
+    async def _execute_job(self, job: JobRecord, reservation: QuotaReservation, base_code: Optional[str],
+                           premium: bool, progress: Optional[GenerationProgress] = None, rate_limited: bool = True):
+        """
+        Генерирует бота по задаче, сохраняет результат и доставляет его в чат задачи.
+        premium - статус пользователя (очередь, hedging, шаблоны), а не счетчик, из которого
+        зарезервирована генерация: Premium с исчерпанным лимитом остается в премиум-очереди.
+        rate_limited - списать слот генерации и бюджет OpenAI перед запросом к модели
+        """
+        description, bot_type = job.prompt, job.bot_type
+        finished = False
+        charged = False
+        error = "Generation failed"
         try:
-            # Определяем тип бота
-            bot_type = self.ai_service.analyze_bot_requirements(description)
+            template_mode = None
+            if base_code is None:
+                template_mode = self.ai_service.template_mode(description, bot_type, premium)
             
-            # Генерируем код бота
-            result = self.ai_service.generate_bot_code(description, bot_type)
+            if template_mode == 'instant':
+                # Шаблон рендерится локально за миллисекунды, без очереди и модели
+                await self.jobs.mark_running(job.id)
+                result = self.ai_service.render_template(description, bot_type)
+            else:
+                if template_mode == 'customize':
+                    # Модель пишет только собственные обработчики поверх шаблона
+                    generate = lambda: self.ai_service.agenerate_from_template(
+                        description, bot_type, hedge=premium
+                    )
+                else:
+                    generate = lambda: self.ai_service.agenerate_bot_code(
+                        description, bot_type, on_chunk=progress.on_chunk if progress else None,
+                        base_code=base_code, hedge=premium
+                    )
+                
+                async def factory():
+                    await self.jobs.mark_running(job.id)
+                    return await generate()
+                
+                async def show_position(position: int):
+                    await self._edit_status(
+                        job, f"⏳ <b>Бот в очереди на генерацию</b>\n\nПозиция в очереди: {position}",
+                        cancellable=True
+                    )
+                
+                if rate_limited:
+                    retry_after, overloaded = await self._acquire_generation(job.telegram_id)
+                    if retry_after:
+                        seconds = math.ceil(retry_after)
+                        await self._edit_status(
+                            job, f"⏳ <b>Сейчас очень много генераций</b>\n\nПопробуй через {seconds} с" if overloaded
+                            else f"⏳ <b>Слишком много генераций</b>\n\nПопробуй через {seconds} с"
+                        )
+                        error = "Rate limited"
+                        return
+                    charged = True
+                
+                try:
+                    queued = self.scheduler.submit(job.telegram_id, premium, factory, on_position=show_position)
+                except QueueFullError:
+                    await self._release_generation(job.telegram_id)
+                    charged = False
+                    await self._edit_status(
+                        job, "⏳ <b>Сейчас слишком много запросов</b>\n\nПопробуй еще раз через пару минут!"
+                    )
+                    error = "Generation queue is full"
+                    return
+                
+                self._queued_jobs[job.id] = queued
+                result = await queued.future
+                if charged and result.get('cached'):
+                    # Ответ взят из кэша: модель не вызывалась
+                    await self._release_generation(job.telegram_id)
             
             if result['status'] == 'error':
-                await processing_msg.edit_text(
-                    f"❌ <b>Ошибка генерации</b>\n\n{result['error']}\n\nПопробуй еще раз!",
-                    parse_mode='HTML'
-                )
+                error = result['error']
+                await self._edit_status(job, f"❌ <b>Ошибка генерации</b>\n\n{result['error']}\n\nПопробуй еще раз!")
                 return
             
-            # Сохраняем в базу данных
-            db_user = self.db.query(User).filter(User.telegram_id == user_id).first()
+            async with AsyncSessionLocal() as db:
+                new_bot = await self._save_generation(db, job.user_id, description, bot_type, result, job_id=job.id)
+            finished = True
+            if new_bot is None:
+                # Задачу забрал другой процесс, результат доставит он
+                return
             
-            # Создаем запись о боте
-            new_bot = Bot(
-                name=f"Bot_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                description=result['description'],
-                owner_id=db_user.id,
-                generated_code=result['main_code'],
-                status='created'
-            )
-            self.db.add(new_bot)
+            # Отправляем результат
+            # Исправленный после проверки код отправляется заново
+            repaired = (result.get('validation') or {}).get('status') == 'repaired'
+            code_sent = bool(progress and progress.sent_files) and not progress.delivery_failed and not repaired
+            await self._edit_status(job, "✅ <b>Бот сгенерирован!</b>")
+            await self.send_generated_bot(job.chat_id, new_bot, result, code_sent=code_sent)
             
+        except LeaseLostError:
+            finished = True
+        except asyncio.CancelledError:
+            finished = True
+            if job.id in self._cancelled_jobs:
+                # Отменил пользователь: квоту вернул и сообщение обновил обработчик отмены
+                return
+            # Процесс останавливается: задача остается в БД и продолжится после перезапуска
+            raise
+        except Exception as e:
+            logger.error(f"Error generating bot: {e}")
+            error = str(e)
+            await self._edit_status(job, "❌ <b>Произошла ошибка</b>\n\nПопробуй еще раз или обратись в поддержку!")
+        finally:
+            self._queued_jobs.pop(job.id, None)
+            self._cancelled_jobs.discard(job.id)
+            if not finished and await self.jobs.fail(job.id, error):
+                await refund_generation(reservation)
+                self.user_cache.invalidate(job.telegram_id)
+    
+    async def _save_generation(self, db: AsyncSession, user_id: int, description: str, bot_type: str,
+                               result: dict, job_id: int = None) -> Optional[Bot]:
+        """
+        Сохраняет бота и запись о генерации (квота уже зарезервирована) и обновляет индекс похожих.
+        job_id - задача генерации, которую нужно отметить выполненной; None, если задачу
+        забрал другой процесс
+        """
+        # Создаем запись о боте
+        new_bot = Bot(
+            name=f"Bot_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            description=result['description'],
+            owner_id=user_id,
+            generated_code=result['main_code'],
+            generated_files=dump_project_files(result),
+            status='created'
+        )
+        db.add(new_bot)
+        await db.flush()
+        
+        prompt_hash = simhash(description)
+        validation = result.get('validation', {})
+        values = dict(
+            bot_id=new_bot.id,
+            generated_code=result['main_code'],
+            validation_status=validation.get('status'),
+            repair_attempts=validation.get('repair_attempts', 0)
+        )
+        if job_id is None:
             # Создаем запись о генерации
             generation = Generation(
-                user_id=db_user.id,
-                bot_id=new_bot.id,
+                user_id=user_id,
                 prompt=description,
-                generated_code=result['main_code'],
+                bot_type=bot_type,
+                prompt_simhash=simhash_to_db(prompt_hash),
                 status='completed',
-                completed_at=datetime.utcnow()
+                completed_at=datetime.utcnow(),
+                **values
             )
-            self.db.add(generation)
-            
-            # Обновляем счетчик генераций
-            if db_user.is_premium:
-                db_user.premium_generations_used += 1
-            else:
-                db_user.free_generations_used += 1
-            
-            self.db.commit()
-            
-            # Отправляем результат
-            await self.send_generated_bot(update, context, new_bot, result)
-            
-        except Exception as e:
-            logger.error(f"Error generating bot: {e}")
-            await processing_msg.edit_text(
-                "❌ <b>Произошла ошибка</b>\n\nПопробуй еще раз или обратись в поддержку!",
-                parse_mode='HTML'
+            db.add(generation)
+            await db.flush()
+            job_id = generation.id
+        elif not await self.jobs.complete(db, job_id, **values):
+            await db.rollback()
+            return None
+        await db.commit()
+        
+        self.similarity_index.add_hash(job_id, prompt_hash, bot_type)
+        return new_bot
+    
+    async def reuse_generation(self, update: Update, context: BotContext, generation_id: int,
+                               mode: str):
+        """Выбор пользователя для похожей генерации: reuse, adapt или regenerate"""
+        query = update.callback_query
+        await query.answer()
+        
+        description = context.user_data.pop('pending_description', None)
+        if not description:
+            await query.edit_message_text("❌ Описание устарело. Начни создание бота заново: /start")
+            return
+        
+        user_id = query.from_user.id
+        bot_type = self.ai_service.analyze_bot_requirements(description)
+        
+        source = None
+        if generation_id:
+            source = await context.db.scalar(select(Generation).where(
+                Generation.id == generation_id,
+                Generation.status == 'completed'
+            ))
+        
+        if mode == 'regenerate' or not source:
+            await query.edit_message_text("🆕 Генерирую бота с нуля")
+            await self.run_generation(context.db, query.message, user_id, description, bot_type)
+            return
+        
+        if mode == 'adapt':
+            await query.edit_message_text("✏️ Дорабатываю похожего бота под твое описание")
+            await self.run_generation(context.db, query.message, user_id, description, bot_type,
+                                      base_code=source.generated_code, base_generation_id=source.id)
+            return
+        
+        # Готовый результат отдается без запроса к модели, но тоже расходует генерацию
+        db_user = await self._get_user(context.db, user_id)
+        reservation = await reserve_generation(db_user.id, is_premium_active(db_user)) if db_user else None
+        self.user_cache.invalidate(user_id)
+        if reservation is None:
+            await query.edit_message_text(
+                "❌ <b>Лимит исчерпан!</b>\n\nОформи Premium подписку для продолжения работы!",
+                parse_mode='HTML',
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💎 Оформить Premium", callback_data="premium")]])
             )
+            return
+        
+        await query.edit_message_text("♻️ Использую готовый результат")
+        try:
+            # Ленивая загрузка связей в асинхронной сессии недоступна - данные бота читаются явно
+            source_bot = (await context.db.execute(
+                select(Bot.description, Bot.generated_files).where(Bot.id == source.bot_id)
+            )).first()
+            files = load_project_files(source_bot.generated_files if source_bot else None)
+            result = {
+                "main_code": source.generated_code,
+                "description": (source_bot.description if source_bot else None) or description,
+                "additional_files": {name: content for name, content in files.items() if name != 'requirements.txt'},
+                "requirements": [line.strip() for line in files['requirements.txt'].splitlines() if line.strip()]
+            }
+            new_bot = await self._save_generation(context.db, db_user.id, description, bot_type, result)
+        except Exception:
+            await refund_generation(reservation)
+            raise
+        await self.send_generated_bot(query.message.chat_id, new_bot, result)
     
-    async def send_generated_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot: Bot, result: dict):
+    async def send_generated_bot(self, chat_id: int, bot: Bot, result: dict, code_sent: bool = False):
         """Отправляет сгенерированный бот пользователю"""
         bot_info = f"""
 ✅ <b>Бот успешно создан!</b>
@@ -199,32 +804,75 @@ class BotCreatorBot:
 • README с инструкциями
         """
         
+        # Автоматическая проверка не смогла исправить код - предупреждаем
+        validation = result.get('validation') or {}
+        if validation.get('status') == 'failed':
+            bot_info += "\n⚠️ <b>Проверка кода нашла проблемы:</b>\n" + "\n".join(
+                f"• {html.escape(error)}" for error in validation['errors'][:5]
+            )
+        
         keyboard = [
-            [InlineKeyboardButton("📥 Скачать код", callback_data=f"download_{bot.id}")],
-            [InlineKeyboardButton("🚀 Развернуть", callback_data=f"deploy_{bot.id}")],
+            [InlineKeyboardButton("📥 Скачать код", callback_data=callback_data("download", bot.id))],
+            [InlineKeyboardButton("📦 Скачать проект", callback_data=callback_data("bundle", bot.id))],
+            [InlineKeyboardButton("🚀 Развернуть", callback_data=callback_data("deploy", bot.id))],
             [InlineKeyboardButton("📋 Мои боты", callback_data="my_bots")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(bot_info, parse_mode='HTML', reply_markup=reply_markup)
+        await self.telegram.send_message(chat_id, bot_info, parse_mode='HTML', reply_markup=reply_markup)
+        
+        # Файлы уже отправлены по ходу потоковой генерации
+        if code_sent:
+            return
         
         # Отправляем код как файл
-        code_text = f"# {bot.name}\n# {result['description']}\n\n{result['main_code']}"
-        await update.message.reply_document(
-            document=code_text.encode(),
+        await send_bot_document(
+            self.telegram, chat_id, bot.id, 'code', bot_code_file(bot.name, result['description'], result['main_code']),
             filename=f"{bot.name}.py",
             caption="📄 Основной код бота"
         )
     
-    async def my_bots(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показывает список ботов пользователя"""
+    async def my_bots(self, update: Update, context: BotContext, cursor: Optional[Tuple[datetime, int]] = None,
+                      backwards: bool = False):
+        """
+        Показывает страницу ботов пользователя, новые сверху. cursor - (created_at, id)
+        последнего бота предыдущей страницы (или первого, если листаем назад)
+        """
         query = update.callback_query
         await query.answer()
         
         user_id = query.from_user.id
-        db_user = self.db.query(User).filter(User.telegram_id == user_id).first()
+        db_user = await self._get_user(context.db, user_id)
+        bots = []
+        if db_user:
+            # Для списка нужны только короткие колонки, код бота не читается
+            statement = select(
+                Bot.id, Bot.name, Bot.status, Bot.created_at,
+                func.substr(Bot.description, 1, 50).label('description')
+            ).where(Bot.owner_id == db_user.id)
+            if cursor:
+                created_at, bot_id = cursor
+                if backwards:
+                    statement = statement.where(or_(
+                        Bot.created_at > created_at, and_(Bot.created_at == created_at, Bot.id > bot_id)
+                    ))
+                else:
+                    statement = statement.where(or_(
+                        Bot.created_at < created_at, and_(Bot.created_at == created_at, Bot.id < bot_id)
+                    ))
+            if backwards:
+                statement = statement.order_by(Bot.created_at.asc(), Bot.id.asc())
+            else:
+                statement = statement.order_by(Bot.created_at.desc(), Bot.id.desc())
+            # Лишняя строка показывает, есть ли еще страница в этом направлении
+            bots = (await context.db.execute(statement.limit(MY_BOTS_PAGE_SIZE + 1))).all()
         
-        if not db_user or not db_user.bots:
+        has_more = len(bots) > MY_BOTS_PAGE_SIZE
+        bots = bots[:MY_BOTS_PAGE_SIZE]
+        if backwards:
+            bots.reverse()
+        
+        if not bots:
             await query.edit_message_text(
                 "📋 <b>Мои боты</b>\n\n"
                 "У тебя пока нет созданных ботов.\n"
@@ -237,13 +885,30 @@ class BotCreatorBot:
         bots_text = "📋 <b>Мои боты</b>\n\n"
         keyboard = []
         
-        for i, bot in enumerate(db_user.bots[:5], 1):  # Показываем первые 5 ботов
+        for i, bot in enumerate(bots, 1):
             status_emoji = "✅" if bot.status == "active" else "⏸️" if bot.status == "inactive" else "❌"
             bots_text += f"{i}. {status_emoji} <b>{bot.name}</b>\n"
-            bots_text += f"   {bot.description[:50]}...\n"
+            bots_text += f"   {bot.description or ''}...\n"
             bots_text += f"   <i>Создан: {bot.created_at.strftime('%d.%m.%Y')}</i>\n\n"
             
-            keyboard.append([InlineKeyboardButton(f"🔧 {bot.name}", callback_data=f"bot_details_{bot.id}")])
+            keyboard.append([InlineKeyboardButton(f"🔧 {bot.name}", callback_data=callback_data("bot_details", bot.id))])
+        
+        # Назад листать можно, если пришли с курсором вперед, и наоборот
+        has_prev = has_more if backwards else cursor is not None
+        has_next = cursor is not None if backwards else has_more
+        navigation = []
+        if has_prev:
+            first = bots[0]
+            navigation.append(InlineKeyboardButton(
+                "⬅️ Новее", callback_data=callback_data("my_bots_page", "prev", encode_bots_cursor(first.created_at, first.id))
+            ))
+        if has_next:
+            last = bots[-1]
+            navigation.append(InlineKeyboardButton(
+                "Старше ➡️", callback_data=callback_data("my_bots_page", "next", encode_bots_cursor(last.created_at, last.id))
+            ))
+        if navigation:
+            keyboard.append(navigation)
         
         keyboard.append([InlineKeyboardButton("🚀 Создать новый", callback_data="create_bot")])
         keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")])
@@ -251,6 +916,10 @@ class BotCreatorBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(bots_text, parse_mode='HTML', reply_markup=reply_markup)
     
+    async def my_bots_page(self, update: Update, context: BotContext, direction: str, cursor: Tuple[datetime, int]):
+        """Кнопки "Новее"/"Старше" списка ботов"""
+        await self.my_bots(update, context, cursor, backwards=direction == "prev")
+    
     async def premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик Premium подписки"""
         query = update.callback_query
@@ -311,7 +980,7 @@ class BotCreatorBot:
         
         await query.edit_message_text(help_text, parse_mode='HTML', reply_markup=reply_markup)
     
-    async def back_to_main(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def back_to_main(self, update: Update, context: BotContext):
         """Возврат в главное меню"""
         query = update.callback_query
         await query.answer()
@@ -319,49 +988,84 @@ class BotCreatorBot:
         # Имитируем команду /start
         await self.start(update, context)
     
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий на кнопки"""
-        query = update.callback_query
-        data = query.data
-        
-        if data == "create_bot":
-            await self.create_bot(update, context)
-        elif data == "my_bots":
-            await self.my_bots(update, context)
-        elif data == "premium":
-            await self.premium(update, context)
-        elif data == "help":
-            await self.help(update, context)
-        elif data == "back_to_main":
-            await self.back_to_main(update, context)
-        elif data.startswith("download_"):
-            bot_id = int(data.split("_")[1])
-            await self.download_bot(update, context, bot_id)
-        elif data.startswith("deploy_"):
-            bot_id = int(data.split("_")[1])
-            await self.deploy_bot(update, context, bot_id)
-        elif data.startswith("bot_details_"):
-            bot_id = int(data.split("_")[2])
-            await self.show_bot_details(update, context, bot_id)
-    
-    async def download_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot_id: int):
+    def _format_route_stats(self) -> str:
+        """Самые медленные экраны по среднему времени обработки кнопки"""
+        routes = [(name, stats) for name, stats in self.callbacks.stats().items() if stats['calls']]
+        if not routes:
+            return ""
+        routes.sort(key=lambda item: item[1]['avg_ms'], reverse=True)
+        return "\n\n⏱ <b>Кнопки</b> (avg / max, мс)\n\n" + "\n".join(
+            f"{name}: {stats['avg_ms']} / {stats['max_ms']} ({stats['calls']} вызовов, ошибок {stats['errors']})"
+            for name, stats in routes[:10]
+        )
+    
+    async def queue_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Метрики очереди генераций (только для администраторов)"""
+        if update.effective_user.id not in Config.ADMIN_USER_IDS:
+            return
+        
+        metrics = self.scheduler.metrics()
+        client = self.ai_service.chat.metrics()
+        profiles = self.user_cache.stats()
+        limited = ", ".join(f"{name} {count}" for name, count in self.rate_limiter.stats().items())
+        await update.message.reply_text(
+            "📊 <b>Очередь генераций</b>\n\n"
+            f"Воркеры: {metrics['running']}/{metrics['workers']}\n"
+            f"В очереди Premium: {metrics['queued_premium']}\n"
+            f"В очереди Free: {metrics['queued_free']}\n"
+            f"Выполнено: {metrics['completed']}, ошибок: {metrics['failed']}, отменено: {metrics['cancelled']}\n"
+            f"Ожидание: avg {metrics['avg_wait']}с, p95 {metrics['p95_wait']}с, max {metrics['max_wait']}с\n"
+            f"Продолжено после перезапуска: {self.jobs.resumed}\n"
+            f"Объединено одинаковых генераций: {self.ai_service.inflight.shared}, "
+            f"повторных апдейтов: {self.recent_updates.duplicates}\n"
+            f"Ограничено запросов: {limited}\n\n"
+            "🔌 <b>OpenAI</b>\n\n"
+            f"Предохранитель: {client['breaker_state']} (размыкался {client['breaker_opened']} раз)\n"
+            f"Вызовы: {client['calls']}, попытки: {client['attempts']}, повторы: {client['retries']}\n"
+            f"Ошибки: {client['failures']}, отклонено: {client['rejected']}\n"
+            f"Хеджирование: {client['hedges_launched']} запущено, {client['hedges_won']} выиграло\n\n"
+            f"👤 Кэш профилей: {profiles['profiles']} записей, попаданий {profiles['hits']}, промахов {profiles['misses']}"
+            + self._format_route_stats(),
+            parse_mode='HTML'
+        )
+    
+    async def download_bot(self, update: Update, context: BotContext, bot_id: int):
         """Скачивание кода бота"""
         query = update.callback_query
         await query.answer()
         
-        bot = self.db.query(Bot).filter(Bot.id == bot_id).first()
+        bot = await context.db.get(Bot, bot_id, options=[undefer(Bot.generated_code)])
         if not bot:
             await query.edit_message_text("❌ Бот не найден!")
             return
         
-        # Отправляем код как файл
-        code_text = f"# {bot.name}\n# {bot.description}\n\n{bot.generated_code}"
-        await query.message.reply_document(
-            document=code_text.encode(),
+        # Отправляем код как файл; неизменный код пересылается по file_id без загрузки
+        await send_bot_document(
+            context.bot, query.message.chat_id, bot.id, 'code', bot_code_file(bot.name, bot.description, bot.generated_code),
             filename=f"{bot.name}.py",
             caption=f"📄 Код бота: {bot.name}"
         )
     
+    async def download_bundle(self, update: Update, context: BotContext, bot_id: int):
+        """Скачивание всего проекта бота одним ZIP архивом"""
+        query = update.callback_query
+        await query.answer()
+        
+        bot = await context.db.get(Bot, bot_id, options=[undefer(Bot.generated_code), undefer(Bot.generated_files)])
+        if not bot:
+            await query.edit_message_text("❌ Бот не найден!")
+            return
+        
+        # Сжатие не блокирует event loop
+        archive = await asyncio.to_thread(
+            build_project_zip, bot.name, bot.description, bot.generated_code, load_project_files(bot.generated_files)
+        )
+        await send_bot_document(
+            context.bot, query.message.chat_id, bot.id, 'bundle', archive,
+            filename=f"{bot.name}.zip",
+            caption=f"📦 Проект бота: {bot.name}"
+        )
+    
     async def deploy_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot_id: int):
         """Развертывание бота"""
         query = update.callback_query
@@ -374,12 +1078,12 @@ class BotCreatorBot:
             parse_mode='HTML'
         )
     
-    async def show_bot_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot_id: int):
+    async def show_bot_details(self, update: Update, context: BotContext, bot_id: int):
         """Показывает детали бота"""
         query = update.callback_query
         await query.answer()
         
-        bot = self.db.query(Bot).filter(Bot.id == bot_id).first()
+        bot = await context.db.get(Bot, bot_id)
         if not bot:
             await query.edit_message_text("❌ Бот не найден!")
             return
@@ -397,31 +1101,61 @@ class BotCreatorBot:
         """
         
         keyboard = [
-            [InlineKeyboardButton("📥 Скачать", callback_data=f"download_{bot.id}")],
-            [InlineKeyboardButton("🚀 Развернуть", callback_data=f"deploy_{bot.id}")],
+            [InlineKeyboardButton("📥 Скачать", callback_data=callback_data("download", bot.id))],
+            [InlineKeyboardButton("📦 Скачать проект", callback_data=callback_data("bundle", bot.id))],
+            [InlineKeyboardButton("🚀 Развернуть", callback_data=callback_data("deploy", bot.id))],
             [InlineKeyboardButton("◀️ Назад к списку", callback_data="my_bots")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(details_text, parse_mode='HTML', reply_markup=reply_markup)
 
-def main():
-    """Основная функция запуска бота"""
-    # Создаем таблицы в базе данных
-    create_tables()
-    
-    # Создаем экземпляр бота
+def create_application() -> Application:
+    """Создает бота и приложение с обработчиками (в режиме вебхука - в каждом воркере)"""
     bot_creator = BotCreatorBot()
     
     # Создаем приложение
-    application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+    # concurrent_updates: пока одна генерация ждет очереди, остальные апдейты обрабатываются
+    builder = (
+        Application.builder()
+        .token(Config.TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(Config.CONCURRENT_UPDATES)
+        .context_types(BOT_CONTEXT_TYPES)
+        # user_data хранится вне процесса: переживает рестарт и общее для воркеров вебхука
+        .persistence(bot_creator.state)
+        .post_init(bot_creator.post_init)
+        .post_shutdown(bot_creator.post_shutdown)
+    )
+    if Config.BOT_MODE == 'webhook':
+        # Апдейты приходят в webhook_server, Updater для long polling не нужен
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Добавляем обработчики
-    application.add_handler(CommandHandler("start", bot_creator.start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_creator.handle_message))
-    application.add_handler(CallbackQueryHandler(bot_creator.button_callback))
+    application.add_handler(TypeHandler(Update, bot_creator.drop_duplicate_updates), group=-3)
+    application.add_handler(TypeHandler(Update, bot_creator.track_activity), group=-2)
+    # Ограничение частоты: превысившие лимит апдейты не доходят до обработчиков
+    application.add_handler(TypeHandler(Update, bot_creator.rate_limit), group=-1)
+    # Каждый апдейт получает свою сессию БД (context.db), которая закрывается после обработки
+    application.add_handler(CommandHandler("start", with_db_session(bot_creator.start)))
+    application.add_handler(CommandHandler("queue", bot_creator.queue_stats))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, with_db_session(bot_creator.handle_message)))
+    # Каждая кнопка - отдельный CallbackQueryHandler со своим pattern
+    application.add_handlers(bot_creator.callbacks.handlers())
+    return application
+
+def main():
+    """Основная функция запуска бота"""
+    # Создаем таблицы в базе данных
+    create_tables()
+    
+    if Config.BOT_MODE == 'webhook':
+        print("🤖 Bot Creator запущен (webhook)!")
+        run_webhook(create_application)
+        return
     
     # Запускаем бота
+    application = create_application()
     print("🤖 Bot Creator запущен!")
     application.run_polling()
 
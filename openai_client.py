@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import openai
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitOpenError(Exception):
+    """Upstream деградировал: запросы временно не отправляются"""
+
+
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold ошибок подряд размыкается на
+    reset_timeout секунд, затем пропускает один пробный запрос (half-open)
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        self.failure_threshold = failure_threshold or Config.OPENAI_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or Config.OPENAI_BREAKER_RESET
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+
+    def before_call(self):
+        """Пропускает запрос или бросает CircuitOpenError"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(
+                    f"Сервис генерации временно перегружен, попробуй через {self.retry_in()} сек"
+                )
+            self.state = self.HALF_OPEN
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError("Сервис генерации восстанавливается, попробуй чуть позже")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        """Пробный запрос отменен, не дождавшись ответа"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"OpenAI circuit breaker opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def retry_in(self) -> int:
+        return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+
+class ResilientChatClient:
+    """
+    Обертка над AsyncOpenAI: дедлайн на вызов, повторы с экспоненциальной
+    задержкой и jitter (с учетом Retry-After), предохранитель и хеджирование
+    медленных запросов
+    """
+
+    def __init__(self, client: openai.AsyncOpenAI, breaker: CircuitBreaker = None):
+        self.client = client
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = Config.OPENAI_MAX_RETRIES
+        self.timeout = Config.OPENAI_TIMEOUT
+        self.backoff_base = Config.OPENAI_BACKOFF_BASE
+        self.backoff_max = Config.OPENAI_BACKOFF_MAX
+        self.hedge_after = Config.OPENAI_HEDGE_AFTER
+        self.hedge_create = Config.OPENAI_HEDGE_CREATE
+        self.hedge_tokens_per_second = Config.OPENAI_HEDGE_TOKENS_PER_SECOND
+        self.stats = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "failures": 0,
+            "rejected": 0,
+            "hedges_launched": 0,
+            "hedges_won": 0,
+        }
+
+    async def create(self, deadline: Optional[float] = None, hedge: bool = False, **params) -> Any:
+        """chat.completions.create с повторами; deadline - секунды на весь вызов"""
+        return await self._call(lambda remaining: self._create_once(params, remaining, hedge), deadline)
+
+    async def stream(self, deadline: Optional[float] = None, hedge: bool = False, **params) -> AsyncIterator[str]:
+        """
+        Потоковая генерация. Повторы возможны только до первого куска текста:
+        после него ответ уже частично передан пользователю
+        """
+        expires_at = time.monotonic() + (deadline or self.timeout)
+        stream, first = await self._call(
+            lambda remaining: self._open_stream(params, remaining, hedge), deadline
+        )
+
+        try:
+            chunk = first
+            while chunk is not None:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError("Generation deadline exceeded")
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), remaining)
+                except StopAsyncIteration:
+                    chunk = None
+        finally:
+            await stream.response.aclose()
+
+    async def _call(self, attempt, deadline: Optional[float]):
+        self.stats["calls"] += 1
+        expires_at = time.monotonic() + (deadline or self.timeout)
+        retry = 0
+
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats["rejected"] += 1
+                raise
+
+            remaining = expires_at - time.monotonic()
+            self.stats["attempts"] += 1
+            try:
+                result = await asyncio.wait_for(attempt(remaining), remaining)
+                self.breaker.record_success()
+                return result
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                delay = self._backoff(retry, e)
+                if retry >= self.max_retries or time.monotonic() + delay >= expires_at:
+                    self.stats["failures"] += 1
+                    raise
+                logger.warning(f"OpenAI call failed ({type(e).__name__}), retry {retry + 1} in {delay:.1f}s")
+                self.stats["retries"] += 1
+                retry += 1
+                await asyncio.sleep(delay)
+            except Exception:
+                # Ошибки запроса (400, 401 и т.п.) повторять бессмысленно
+                self.breaker.record_success()
+                self.stats["failures"] += 1
+                raise
+
+    def _backoff(self, retry: int, error: Exception) -> float:
+        """Full jitter, но не меньше Retry-After от сервера"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            try:
+                delay = max(delay, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    def _create_hedge_after(self, params: Dict[str, Any]) -> float:
+        """
+        Порог хеджирования обычного запроса: ответ приходит целиком, поэтому
+        к hedge_after добавляется ожидаемое время генерации max_tokens
+        """
+        if not self.hedge_create or not self.hedge_after:
+            return 0.0
+        return self.hedge_after + params.get('max_tokens', 0) / self.hedge_tokens_per_second
+
+    async def _create_once(self, params: Dict[str, Any], remaining: float, hedge: bool):
+        hedge_after = self._create_hedge_after(params) if hedge else 0.0
+        if not hedge_after or remaining <= hedge_after:
+            return await self.client.chat.completions.create(**params)
+        return await self._hedged(lambda: self.client.chat.completions.create(**params), hedge_after=hedge_after)
+
+    async def _open_stream(self, params: Dict[str, Any], remaining: float, hedge: bool):
+        async def open_once():
+            stream = await self.client.chat.completions.create(**params, stream=True)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await stream.response.aclose()
+                raise
+            return stream, first
+
+        if not hedge or not self.hedge_after or remaining <= self.hedge_after:
+            return await open_once()
+        # Для потока хеджируется время до первого куска текста
+        return await self._hedged(open_once, cleanup=lambda opened: opened[0].response.aclose(),
+                                  hedge_after=self.hedge_after)
+
+    async def _hedged(self, factory, cleanup=None, hedge_after: float = None):
+        """Если первый запрос не ответил за hedge_after секунд, параллельно запускается второй"""
+        primary = asyncio.create_task(factory())
+        tasks = [primary]
+        winner = None
+        error = None
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after or self.hedge_after)
+            if not done:
+                self.stats["hedges_launched"] += 1
+                tasks.append(asyncio.create_task(factory()))
+
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if winner is None:
+            raise error
+
+        # Оба запроса могли завершиться одновременно - лишний поток закрывается
+        for task in tasks:
+            if task is not winner and cleanup and not task.cancelled() and task.exception() is None:
+                await cleanup(task.result())
+
+        if winner is not primary:
+            self.stats["hedges_won"] += 1
+        return winner.result()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Состояние повторов и предохранителя"""
+        return {
+            **self.stats,
+            "breaker_state": self.breaker.state,
+            "breaker_failures": self.breaker.failures,
+            "breaker_opened": self.breaker.times_opened,
+        }
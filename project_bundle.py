@@ -0,0 +1,57 @@
+import io
+import json
+import logging
+import zipfile
+from typing import Any, Dict, Optional
+
+from response_parser import DEFAULT_REQUIREMENTS, safe_filename
+
+logger = logging.getLogger(__name__)
+
+# Фиксированная дата файлов: одинаковый проект дает байт-в-байт одинаковый архив,
+# и повторная отправка идет по закэшированному file_id
+_ZIP_DATE_TIME = (2024, 1, 1, 0, 0, 0)
+
+
+def project_files(result: Dict[str, Any]) -> Dict[str, str]:
+    """Файлы проекта из результата генерации, кроме main.py (он хранится в Bot.generated_code)"""
+    files = dict(result.get('additional_files') or {})
+    files['requirements.txt'] = '\n'.join(result.get('requirements') or DEFAULT_REQUIREMENTS) + '\n'
+    return files
+
+
+def dump_project_files(result: Dict[str, Any]) -> str:
+    return json.dumps(project_files(result), ensure_ascii=False)
+
+
+def load_project_files(generated_files: Optional[str]) -> Dict[str, str]:
+    # Боты, созданные до появления Bot.generated_files, получают стандартные зависимости
+    files = json.loads(generated_files) if generated_files else {}
+    files.setdefault('requirements.txt', '\n'.join(DEFAULT_REQUIREMENTS) + '\n')
+    return files
+
+
+def build_project_zip(name: str, description: Optional[str], main_code: str, files: Dict[str, str]) -> bytes:
+    """
+    Собирает ZIP проекта в памяти, без временных файлов на диске. Имена файлов
+    проверяются и здесь: они могли прийти из Bot.generated_files в обход парсера
+    """
+    folder = name if safe_filename(name) and '/' not in name else 'bot'
+    files = {'main.py': main_code or '', **files}
+    if 'README.md' not in files:
+        files['README.md'] = (
+            f"# {name}\n\n{description or ''}\n\n"
+            "## Запуск\n\n```bash\npip install -r requirements.txt\npython main.py\n```\n"
+        )
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        for filename in sorted(files):
+            if not safe_filename(filename):
+                logger.warning(f"Skipping unsafe project file name {filename!r}")
+                continue
+            info = zipfile.ZipInfo(f"{folder}/{filename}", date_time=_ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            archive.writestr(info, files[filename])
+    return buffer.getvalue()
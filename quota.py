@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, or_, update
+
+from config import Config
+from database import AsyncSessionLocal, User
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaReservation:
+    """Зарезервированная генерация: счетчик уже увеличен, при неудаче - возврат"""
+
+    def __init__(self, user_id: int, premium: bool, used: int):
+        self.user_id = user_id
+        self.premium = premium
+        self.used = used
+        self.refunded = False
+
+
+def _columns(premium: bool):
+    if premium:
+        return User.premium_generations_used, User.premium_generations_limit, Config.PREMIUM_GENERATIONS_PER_MONTH
+    return User.free_generations_used, User.free_generations_limit, Config.FREE_GENERATIONS
+
+
+def is_premium_active(profile, now: Optional[datetime] = None) -> bool:
+    """Premium включен и не истек - то же условие, что и в _try_reserve"""
+    if not profile.is_premium:
+        return False
+    expires_at = profile.premium_expires_at
+    return expires_at is None or expires_at > (now or datetime.utcnow())
+
+
+def _limit(value: Optional[int], premium: bool) -> int:
+    _, _, default_limit = _columns(premium)
+    return default_limit if value is None else value
+
+
+async def _try_reserve(user_id: int, premium: bool) -> Optional[QuotaReservation]:
+    used, limit, default_limit = _columns(premium)
+    conditions = [User.id == user_id, func.coalesce(used, 0) < func.coalesce(limit, default_limit)]
+    if premium:
+        # Как в is_premium_active
+        conditions.append(User.is_premium.is_(True))
+        conditions.append(or_(User.premium_expires_at.is_(None), User.premium_expires_at > datetime.utcnow()))
+
+    # Проверка лимита и инкремент - один условный UPDATE: параллельные запросы
+    # не проходят сверх лимита, а транзакция закрывается до запроса к модели
+    statement = (
+        update(User)
+        .where(*conditions)
+        .values({used: func.coalesce(used, 0) + 1})
+        .returning(used)
+        .execution_options(synchronize_session=False)
+    )
+    async with AsyncSessionLocal() as db:
+        value = (await db.execute(statement)).scalar_one_or_none()
+        await db.commit()
+
+    if value is None:
+        return None
+    return QuotaReservation(user_id, premium, value)
+
+
+async def reserve_generation(user_id: int, premium: bool) -> Optional[QuotaReservation]:
+    """
+    Резервирует генерацию для пользователя (users.id). Premium расходует
+    премиум-лимит, а если подписка истекла или лимит исчерпан - бесплатный.
+    Возвращает None, если лимиты исчерпаны
+    """
+    if premium:
+        reservation = await _try_reserve(user_id, True)
+        if reservation:
+            return reservation
+    return await _try_reserve(user_id, False)
+
+
+async def refund_generation(reservation: QuotaReservation):
+    """Возвращает генерацию, если она не состоялась; повторный вызов ничего не делает"""
+    if reservation.refunded:
+        return
+    reservation.refunded = True
+
+    used, _, _ = _columns(reservation.premium)
+    statement = (
+        update(User)
+        .where(User.id == reservation.user_id, used > 0)
+        .values({used: used - 1})
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(statement)
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Failed to refund generation for user {reservation.user_id}: {e}")
+
+
+def has_quota(profile) -> bool:
+    """
+    Быстрая проверка по профилю для подсказок в интерфейсе. Лимит
+    гарантирует только reserve_generation
+    """
+    # Лимит 0 - генерации закрыты; стандартный лимит только для NULL, как coalesce в _try_reserve
+    if is_premium_active(profile):
+        if (profile.premium_generations_used or 0) < _limit(profile.premium_generations_limit, True):
+            return True
+    return (profile.free_generations_used or 0) < _limit(profile.free_generations_limit, False)
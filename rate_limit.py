@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+GENERATION = 'generation'
+UI = 'ui'
+OPENAI_TOKENS = 'openai_tokens'
+
+
+def default_buckets() -> Dict[str, Tuple[float, float]]:
+    """Корзины из Config: имя -> (емкость, пополнение в секунду)"""
+    buckets = {
+        GENERATION: (Config.RATE_LIMIT_GENERATION_BURST, Config.RATE_LIMIT_GENERATION_PER_MINUTE / 60),
+        UI: (Config.RATE_LIMIT_UI_BURST, Config.RATE_LIMIT_UI_PER_MINUTE / 60),
+    }
+    if Config.RATE_LIMIT_OPENAI_TPM:
+        buckets[OPENAI_TOKENS] = (Config.RATE_LIMIT_OPENAI_TPM, Config.RATE_LIMIT_OPENAI_TPM / 60)
+    return buckets
+
+
+class MemoryBucketStore:
+    """Корзины в памяти процесса; самые давно не тронутые вытесняются при переполнении"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+        retry_after = 0.0
+        if tokens >= cost:
+            # Отрицательный cost - возврат, он не переполняет корзину
+            tokens = min(capacity, tokens - cost)
+        else:
+            retry_after = (cost - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+class RedisBucketStore:
+    """Корзины в Redis (Config.REDIS_URL), общие для всех процессов бота"""
+
+    # Пополнение и списание атомарно; время берется у Redis, чтобы часы процессов не расходились
+    _TAKE_SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens = tonumber(state[1]) or capacity
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local retry_after = 0
+    if tokens >= cost then
+        tokens = math.min(capacity, tokens - cost)
+    else
+        retry_after = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(retry_after)
+    """
+
+    def __init__(self, url: str):
+        import redis  # Опциональная зависимость
+
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self._TAKE_SCRIPT)
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float) -> float:
+        result = await asyncio.to_thread(self._take, keys=[f"rate_limit:{key}"], args=[capacity, rate, cost])
+        return float(result)
+
+
+class RateLimiter:
+    """
+    Token bucket для пользователей и общего бюджета токенов OpenAI.
+    acquire списывает cost из корзины и возвращает 0, если хватило,
+    иначе - через сколько секунд стоит повторить; refund возвращает
+    списанное, если оно не понадобилось
+    """
+
+    def __init__(self, backend: str = None, buckets: Dict[str, Tuple[float, float]] = None):
+        backend = backend or Config.RATE_LIMIT_BACKEND
+        self.enabled = backend != 'none'
+        self.store = self._create_store(backend)
+        self.buckets = {}
+        for name, (capacity, rate) in (buckets or default_buckets()).items():
+            # Без пополнения корзина никогда не восстановится (и retry_after делит на rate)
+            if capacity <= 0 or rate <= 0:
+                logger.warning(f"Rate limit bucket '{name}' disabled: capacity and rate must be > 0")
+                continue
+            self.buckets[name] = (capacity, rate)
+        self.limited: Dict[str, int] = {name: 0 for name in self.buckets}
+
+    @staticmethod
+    def _create_store(backend: str):
+        if backend == 'redis':
+            try:
+                return RedisBucketStore(Config.REDIS_URL)
+            except Exception as e:
+                # redis не входит в requirements: без него лимиты считаются в памяти процесса
+                logger.warning(f"Rate limit backend 'redis' unavailable, using memory: {e}")
+        return MemoryBucketStore()
+
+    async def acquire(self, bucket: str, key: Hashable = 'global', cost: float = 1) -> float:
+        if not self.enabled or bucket not in self.buckets:
+            return 0.0
+        capacity, rate = self.buckets[bucket]
+        try:
+            retry_after = await self.store.take(f"{bucket}:{key}", capacity, rate, cost)
+        except Exception as e:
+            # Недоступный Redis не должен останавливать бота
+            logger.warning(f"Rate limiter unavailable, request allowed: {e}")
+            return 0.0
+        if retry_after > 0:
+            self.limited[bucket] += 1
+        return retry_after
+
+    async def refund(self, bucket: str, key: Hashable = 'global', cost: float = 1):
+        if not self.enabled or bucket not in self.buckets:
+            return
+        capacity, rate = self.buckets[bucket]
+        try:
+            await self.store.take(f"{bucket}:{key}", capacity, rate, -cost)
+        except Exception as e:
+            logger.warning(f"Rate limiter refund skipped: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.limited)
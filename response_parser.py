@@ -0,0 +1,173 @@
+import re
+from typing import Any, Dict, List, Optional
+
+_FENCE_RE = re.compile(r'^```\s*([\w+-]*)\s*$')
+_FILENAME_RE = re.compile(r'^#\s*([\w./-]+\.\w+)\s*$')
+
+# Имена файлов для блоков без заголовка "# filename"
+_DEFAULT_FILENAMES = {
+    'python': 'main.py',
+    'py': 'main.py',
+    'txt': 'requirements.txt',
+    'text': 'requirements.txt',
+    'markdown': 'README.md',
+    'md': 'README.md',
+}
+
+DEFAULT_REQUIREMENTS = [
+    "python-telegram-bot==20.7",
+    "python-dotenv==1.0.0",
+    "requests==2.31.0"
+]
+
+
+def safe_filename(filename: str) -> Optional[str]:
+    """
+    Относительный путь файла внутри проекта или None. Имена пишет модель,
+    поэтому абсолютные пути, ".." и пустые сегменты не принимаются
+    """
+    if not filename or filename.startswith('/') or '\\' in filename:
+        return None
+    if any(part in ('', '.', '..') for part in filename.split('/')):
+        return None
+    return filename
+
+
+class ResponseParser:
+    """
+    Однопроходный разбор ответа модели: fenced-блоки с заголовками
+    "# filename" и описание до первого блока. Работает как на потоке
+    (feed/close), так и на готовом ответе (parse_response)
+    """
+
+    DESCRIPTION_LINES = 3
+
+    def __init__(self):
+        self._buffer = ''
+        self._in_block = False
+        self._nested = 0
+        self._language = ''
+        self._filename = None
+        self._rejected = False
+        self._lines = []
+        self._seen_fence = False
+        self._description = []
+        self._raw = []
+        self.blocks = []
+
+    def feed(self, chunk: str) -> List[Dict[str, Optional[str]]]:
+        """Принимает очередной кусок текста и возвращает завершенные блоки"""
+        self._raw.append(chunk)
+        buffer = self._buffer + chunk
+        completed = []
+
+        # Строки читаются по смещению, остаток буфера копируется один раз
+        start = 0
+        end = buffer.find('\n')
+        while end != -1:
+            block = self._process_line(buffer[start:end])
+            if block:
+                completed.append(block)
+            start = end + 1
+            end = buffer.find('\n', start)
+
+        self._buffer = buffer[start:]
+        return completed
+
+    def close(self) -> List[Dict[str, Optional[str]]]:
+        """Дочитывает остаток буфера в конце потока"""
+        completed = []
+        if self._buffer:
+            block = self._process_line(self._buffer)
+            self._buffer = ''
+            if block:
+                completed.append(block)
+        return completed
+
+    def _process_line(self, line: str) -> Optional[Dict[str, Optional[str]]]:
+        stripped = line.strip()
+        fence = _FENCE_RE.match(stripped)
+
+        if not self._in_block:
+            if fence:
+                self._seen_fence = True
+                self._in_block = True
+                self._nested = 0
+                self._language = fence.group(1).lower()
+                self._filename = None
+                self._rejected = False
+                self._lines = []
+            elif not self._seen_fence and stripped and len(self._description) < self.DESCRIPTION_LINES:
+                self._description.append(stripped)
+            return None
+
+        if fence:
+            # README часто содержит вложенные ```bash блоки
+            if fence.group(1):
+                self._nested += 1
+            elif self._nested:
+                self._nested -= 1
+            else:
+                return self._finish_block()
+            self._lines.append(line)
+            return None
+
+        # Первая строка вида "# main.py" задает имя файла
+        if not self._lines and self._filename is None and not self._rejected:
+            header = _FILENAME_RE.match(stripped)
+            if header:
+                # Блок с небезопасным именем выбрасывается целиком
+                self._filename = safe_filename(header.group(1))
+                self._rejected = self._filename is None
+                return None
+
+        self._lines.append(line)
+        return None
+
+    def _finish_block(self) -> Optional[Dict[str, Optional[str]]]:
+        self._in_block = False
+        if self._rejected:
+            return None
+        block = {
+            "language": self._language,
+            "filename": self._filename,
+            "content": '\n'.join(self._lines)
+        }
+        self.blocks.append(block)
+        return block
+
+    def bundle(self) -> Dict[str, Any]:
+        """Собирает файлы проекта из разобранных блоков"""
+        files = {}
+        for block in self.blocks:
+            filename = block['filename'] or _DEFAULT_FILENAMES.get(block['language'])
+            if filename and filename not in files:
+                files[filename] = block['content']
+
+        main_code = files.get('main.py')
+        if main_code is None:
+            # Как и раньше: первый блок, а если блоков нет - весь ответ
+            main_code = self.blocks[0]['content'] if self.blocks else ''.join(self._raw)
+
+        requirements_text = files.get('requirements.txt')
+        if requirements_text:
+            requirements = [line.strip() for line in requirements_text.split('\n') if line.strip()]
+        else:
+            requirements = list(DEFAULT_REQUIREMENTS)
+
+        return {
+            "main_code": main_code,
+            "config": files.get('config.py'),
+            "requirements": requirements,
+            "readme": files.get('README.md'),
+            "description": ' '.join(self._description),
+            "files": files
+        }
+
+
+def parse_response(response: str) -> Dict[str, Any]:
+    """Разбирает готовый ответ модели за один проход"""
+    parser = ResponseParser()
+    parser.feed(response)
+    parser.close()
+    return parser.bundle()
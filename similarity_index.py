@@ -0,0 +1,189 @@
+import hashlib
+import itertools
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from generation_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+SHINGLE_SIZE = 3
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+# Для каждого значения байта - его 8 бит, разложенные по 16-битным "полосам"
+# одного большого числа. Сумма таких чисел за одно сложение считает
+# все 64 битовых счетчика SimHash сразу, без цикла по битам.
+_LANE_BITS = 16
+_LANE_MASK = (1 << _LANE_BITS) - 1
+_BYTE_SPREAD = [
+    sum(1 << (_LANE_BITS * bit) for bit in range(8) if value >> bit & 1)
+    for value in range(256)
+]
+
+
+def _spread(h: int) -> int:
+    result = 0
+    for byte_index in range(8):
+        result |= _BYTE_SPREAD[h >> (8 * byte_index) & 0xFF] << (_LANE_BITS * 8 * byte_index)
+    return result
+
+
+def simhash(text: str) -> int:
+    """64-битный SimHash по символьным триграммам нормализованного текста"""
+    normalized = normalize_prompt(text)
+    if len(normalized) < SHINGLE_SIZE:
+        shingles = Counter([normalized])
+    else:
+        # Триграммы устойчивы к падежным окончаниям русских слов
+        shingles = Counter(normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1))
+
+    total = 0
+    counters = 0
+    for shingle, count in shingles.items():
+        counters += _spread(_feature_hash(shingle)) * count
+        total += count
+
+    # Бит установлен, если у большинства признаков он равен единице
+    value = 0
+    for bit in range(HASH_BITS):
+        if (counters >> (_LANE_BITS * bit) & _LANE_MASK) * 2 > total:
+            value |= 1 << bit
+    return value
+
+
+def simhash_to_db(value: int) -> int:
+    """Беззнаковый 64-битный хеш -> знаковое значение для BigInteger"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def simhash_from_db(value: int) -> int:
+    """Знаковое значение из BigInteger -> беззнаковый 64-битный хеш"""
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def similarity(a: int, b: int) -> float:
+    """Доля совпадающих бит двух SimHash"""
+    return 1 - (a ^ b).bit_count() / HASH_BITS
+
+
+class PromptSimilarityIndex:
+    """
+    LSH-индекс описаний из истории генераций. SimHash режется на несколько
+    широких полос: по принципу Дирихле у хешей с расстоянием Хэмминга не
+    больше max_distance хотя бы в одной полосе отличается не больше
+    max_distance // полос бит. Поиск проверяет корзины значения полосы и
+    всех соседних значений в этом радиусе (multi-probe), поэтому корзины
+    маленькие, а полного перебора нет. В корзине проверяются только
+    последние max_scan записей, чтобы кластер похожих описаний не замедлял
+    поиск на event loop
+    """
+
+    def __init__(self, threshold: float = None, bands: int = None, max_scan: int = None):
+        self.threshold = threshold or Config.SIMILARITY_THRESHOLD
+        self.max_distance = int(HASH_BITS * (1 - self.threshold))
+        self.max_scan = max_scan or Config.SIMILARITY_MAX_BUCKET_SCAN
+        self._bands = self._make_bands(bands or Config.SIMILARITY_BANDS)
+        self._probes = self._make_probes(self._bands, self.max_distance // len(self._bands))
+        # (bot_type, номер полосы, значение полосы) -> SimHash в порядке добавления (dict как упорядоченное множество)
+        self._buckets = defaultdict(dict)
+        # (bot_type, SimHash) -> id генерации (последней с таким хешем)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_bands(count: int) -> List[Tuple[int, int]]:
+        """Делит 64 бита на count полос (сдвиг, маска)"""
+        bands = []
+        offset = 0
+        for i in range(count):
+            width = HASH_BITS // count + (1 if i < HASH_BITS % count else 0)
+            bands.append((offset, (1 << width) - 1))
+            offset += width
+        return bands
+
+    @staticmethod
+    def _make_probes(bands: List[Tuple[int, int]], radius: int) -> List[List[int]]:
+        """Для каждой полосы - маски всех значений на расстоянии не больше radius"""
+        probes = []
+        for _, mask in bands:
+            width = mask.bit_length()
+            flips = [0]
+            for distance in range(1, radius + 1):
+                for bits in itertools.combinations(range(width), distance):
+                    flips.append(sum(1 << bit for bit in bits))
+            probes.append(flips)
+        return probes
+
+    def add(self, generation_id: int, prompt: str, bot_type: str) -> int:
+        """Добавляет завершенную генерацию в индекс и возвращает ее SimHash"""
+        value = simhash(prompt)
+        self.add_hash(generation_id, value, bot_type)
+        return value
+
+    def add_hash(self, generation_id: int, value: int, bot_type: str):
+        """Добавляет генерацию с уже посчитанным SimHash"""
+        with self._lock:
+            self._entries[(bot_type, value)] = generation_id
+            for i, (shift, mask) in enumerate(self._bands):
+                bucket = self._buckets[(bot_type, i, value >> shift & mask)]
+                # Повторно добавленный хеш переезжает в конец, к свежим записям
+                bucket.pop(value, None)
+                bucket[value] = None
+
+    def find(self, prompt: str, bot_type: str) -> Optional[Tuple[int, float]]:
+        """Возвращает (id генерации, похожесть) ближайшего описания того же типа"""
+        return self.find_hash(simhash(prompt), bot_type)
+
+    def find_hash(self, value: int, bot_type: str) -> Optional[Tuple[int, float]]:
+        """Поиск по уже посчитанному SimHash"""
+        best = None
+        best_distance = self.max_distance + 1
+
+        with self._lock:
+            for i, (shift, mask) in enumerate(self._bands):
+                band_value = value >> shift & mask
+                for flip in self._probes[i]:
+                    bucket = self._buckets.get((bot_type, i, band_value ^ flip))
+                    if not bucket:
+                        continue
+                    for candidate in itertools.islice(reversed(bucket), self.max_scan):
+                        distance = (candidate ^ value).bit_count()
+                        if distance < best_distance:
+                            best, best_distance = candidate, distance
+                if best_distance == 0:
+                    break
+            if best is None:
+                return None
+            generation_id = self._entries[(bot_type, best)]
+
+        return generation_id, similarity(best, value)
+
+    def load(self, rows) -> int:
+        """Строит индекс по строкам (id, prompt, bot_type, prompt_simhash)"""
+        count = 0
+        for generation_id, prompt, bot_type, stored_hash in rows:
+            if stored_hash is not None:
+                self.add_hash(generation_id, simhash_from_db(stored_hash), bot_type or 'general')
+            elif prompt:
+                self.add(generation_id, prompt, bot_type or 'general')
+            else:
+                continue
+            count += 1
+        logger.info(f"Similarity index loaded {count} generations")
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "bands": len(self._bands),
+            "probes": sum(len(flips) for flips in self._probes)
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+Subscriber = Callable[..., Awaitable[None]]
+
+
+class _Call:
+    __slots__ = ('task', 'waiters', 'subscribers', 'history')
+
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.subscribers = []
+        # Все опубликованные события: подписчик, пришедший позже, получает их сначала
+        self.history = []
+
+    async def publish(self, *event):
+        """Рассылает событие общей работы всем, кто ее сейчас ждет"""
+        self.history.append(event)
+        await asyncio.gather(*(self._deliver(subscriber, event) for subscriber in list(self.subscribers)))
+
+    async def subscribe(self, subscriber: Subscriber):
+        # Догоняет историю по порядку; между последней проверкой и добавлением
+        # в список нет await, поэтому ни одно событие не теряется и не дублируется
+        delivered = 0
+        while delivered < len(self.history):
+            event = self.history[delivered]
+            delivered += 1
+            if not await self._deliver(subscriber, event):
+                return
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    async def _deliver(self, subscriber: Subscriber, event: tuple) -> bool:
+        # Ошибка одного подписчика не должна прерывать общую работу для остальных
+        try:
+            await subscriber(*event)
+            return True
+        except Exception as e:
+            logger.warning(f"Single-flight subscriber failed and was dropped: {e}")
+            self.unsubscribe(subscriber)
+            return False
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом: первый запускает
+    работу, остальные ждут тот же результат. Работа идет в отдельной задаче
+    и отменяется, только когда ее перестали ждать все вызывающие.
+    Промежуточные события (stream) получает каждый вызывающий через свой
+    колбэк, пока он ждет: колбэки вызывающих в общую задачу не попадают
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        return await self._join(key, lambda call: factory(), None)
+
+    async def stream(self, key: Hashable, factory: Callable[[Subscriber], Awaitable[Any]],
+                     subscriber: Optional[Subscriber] = None) -> Any:
+        """
+        Как do, но factory получает publish(*event) для промежуточных событий.
+        subscriber(*event) вызывается для всех событий, начиная с уже
+        опубликованных, пока этот вызывающий ждет результат
+        """
+        return await self._join(key, lambda call: factory(call.publish), subscriber)
+
+    async def _join(self, key: Hashable, start: Callable[[_Call], Awaitable[Any]],
+                    subscriber: Optional[Subscriber]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call()
+            call.task = asyncio.create_task(start(call))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.shared += 1
+
+        call.waiters += 1
+        try:
+            if subscriber:
+                await call.subscribe(subscriber)
+            return await asyncio.shield(call.task)
+        finally:
+            if subscriber:
+                call.unsubscribe(subscriber)
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+class RecentIds:
+    """Множество недавно виденных id с TTL и ограничением размера"""
+
+    def __init__(self, ttl: float = None, max_size: int = None):
+        self.ttl = ttl or Config.UPDATE_DEDUP_TTL
+        self.max_size = max_size or Config.UPDATE_DEDUP_SIZE
+        self._seen = OrderedDict()
+        self.duplicates = 0
+
+    def add(self, item_id: Hashable) -> bool:
+        """Запоминает id; False - id уже встречался за последние ttl секунд"""
+        now = time.monotonic()
+        # Записи упорядочены по времени добавления - устаревшие всегда в начале
+        while self._seen and (next(iter(self._seen.values())) < now or len(self._seen) >= self.max_size):
+            self._seen.popitem(last=False)
+
+        if item_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen[item_id] = now + self.ttl
+        return True
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# (вид данных, id, версия, JSON)
+StateRecord = Tuple[str, int, int, str]
+
+
+class MemoryStateBackend:
+    """Хранилище в памяти процесса: для тестов и запуска в один процесс"""
+
+    def __init__(self):
+        self._data = {}
+        self._seen = {}
+
+    def load(self, kind: str, key: int) -> Optional[Tuple[int, str]]:
+        return self._data.get((kind, key))
+
+    def save_many(self, records: List[StateRecord]):
+        for kind, key, version, data in records:
+            current = self._data.get((kind, key))
+            if current is None or version > current[0]:
+                self._data[(kind, key)] = (version, data)
+
+    def delete(self, kind: str, key: int):
+        self._data.pop((kind, key), None)
+
+    def mark_seen(self, kind: str, key: int, ttl: int) -> bool:
+        now = time.time()
+        if self._seen.get((kind, key), 0) > now:
+            return False
+        self._seen[(kind, key)] = now + ttl
+        return True
+
+
+class SQLiteStateBackend:
+    """Состояние в SQLite файле, общем для всех процессов бота на хосте"""
+
+    # Раз в столько отметок mark_seen удаляются просроченные
+    SEEN_CLEANUP_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._seen_marks = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        # WAL: читатели из других процессов не ждут пишущего
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_state ("
+            "kind TEXT NOT NULL, key INTEGER NOT NULL, version INTEGER NOT NULL, "
+            "data TEXT NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen_ids ("
+            "kind TEXT NOT NULL, key INTEGER NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        self._conn.commit()
+
+    def load(self, kind: str, key: int) -> Optional[Tuple[int, str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, data FROM conversation_state WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save_many(self, records: List[StateRecord]):
+        with self._lock:
+            # Более старая версия не перезаписывает более новую из другого процесса
+            self._conn.executemany(
+                "INSERT INTO conversation_state (kind, key, version, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET version = excluded.version, data = excluded.data "
+                "WHERE excluded.version > conversation_state.version",
+                records
+            )
+            self._conn.commit()
+
+    def delete(self, kind: str, key: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversation_state WHERE kind = ? AND key = ?", (kind, key))
+            self._conn.commit()
+
+    def mark_seen(self, kind: str, key: int, ttl: int) -> bool:
+        now = time.time()
+        with self._lock:
+            # Новая запись или просроченная старая - первая отметка; иначе повтор
+            cursor = self._conn.execute(
+                "INSERT INTO seen_ids (kind, key, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (kind, key) DO UPDATE SET expires_at = excluded.expires_at "
+                "WHERE seen_ids.expires_at <= ?",
+                (kind, key, now + ttl, now)
+            )
+            self._seen_marks += 1
+            if self._seen_marks % self.SEEN_CLEANUP_EVERY == 0:
+                self._conn.execute("DELETE FROM seen_ids WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+
+class RedisStateBackend:
+    """Состояние в Redis (Config.REDIS_URL), общем для всех процессов и хостов"""
+
+    # Запись применяется, только если ее версия новее сохраненной
+    _SAVE_SCRIPT = """
+    local current = tonumber(redis.call('HGET', KEYS[1], 'version') or '0')
+    if tonumber(ARGV[1]) > current then
+        redis.call('HSET', KEYS[1], 'version', ARGV[1], 'data', ARGV[2])
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    """
+
+    def __init__(self, url: str, ttl: int):
+        import redis  # Опциональная зависимость
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+        self._save = self._redis.register_script(self._SAVE_SCRIPT)
+
+    @staticmethod
+    def _key(kind: str, key: int) -> str:
+        return f"bot_state:{kind}:{key}"
+
+    def load(self, kind: str, key: int) -> Optional[Tuple[int, str]]:
+        version, data = self._redis.hmget(self._key(kind, key), 'version', 'data')
+        if version is None or data is None:
+            return None
+        return int(version), data.decode('utf-8')
+
+    def save_many(self, records: List[StateRecord]):
+        pipeline = self._redis.pipeline(transaction=False)
+        for kind, key, version, data in records:
+            self._save(keys=[self._key(kind, key)], args=[version, data, self.ttl], client=pipeline)
+        pipeline.execute()
+
+    def delete(self, kind: str, key: int):
+        self._redis.delete(self._key(kind, key))
+
+    def mark_seen(self, kind: str, key: int, ttl: int) -> bool:
+        return bool(self._redis.set(f"bot_seen:{kind}:{key}", 1, nx=True, ex=ttl))
+
+
+def create_state_backend(backend: str):
+    """Создает хранилище состояния по Config.PERSISTENCE_BACKEND"""
+    if backend == 'redis':
+        return RedisStateBackend(Config.REDIS_URL, Config.PERSISTENCE_TTL)
+    if backend == 'memory':
+        return MemoryStateBackend()
+    return SQLiteStateBackend(Config.PERSISTENCE_PATH)
+
+
+class StatePersistence(BasePersistence[dict, dict, dict]):
+    """
+    Persistence для context.user_data, общая для нескольких процессов бота.
+
+    Данные пользователя читаются лениво, в refresh_user_data перед каждым
+    апдейтом: так изменения из других процессов видны сразу, а при старте
+    не загружается вся таблица. Записи получают версию (время в нс) и
+    сбрасываются в хранилище одной пачкой за проход update_persistence.
+    Локальная копия заменяется только более новой версией из хранилища,
+    поэтому еще не сброшенные изменения не теряются.
+    """
+
+    USER = 'user'
+
+    def __init__(self, backend=None, update_interval: float = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval or Config.PERSISTENCE_UPDATE_INTERVAL
+        )
+        self.backend = backend or create_state_backend(Config.PERSISTENCE_BACKEND)
+        self._versions: Dict[Tuple[str, int], int] = {}
+        self._pending: Dict[Tuple[str, int], Tuple[int, str]] = {}
+        self._flush_task = None
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        # Данные загружаются по одному пользователю в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        key = (self.USER, user_id)
+        stored = await asyncio.to_thread(self.backend.load, self.USER, user_id)
+        if stored is None:
+            return
+        version, data = stored
+        if version <= self._versions.get(key, 0):
+            return
+        user_data.clear()
+        user_data.update(json.loads(data))
+        self._versions[key] = version
+
+    async def update_user_data(self, user_id: int, data: dict):
+        key = (self.USER, user_id)
+        # Снимок делается сразу: PTB передает живой словарь пользователя
+        version = max(time.time_ns(), self._versions.get(key, 0) + 1)
+        self._versions[key] = version
+        self._pending[key] = (version, json.dumps(data, ensure_ascii=False))
+
+        # PTB вызывает update_user_data для всех измененных пользователей одновременно:
+        # первый вызов запускает сброс, остальные попадают в ту же пачку
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+        await asyncio.shield(self._flush_task)
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        await self.flush()
+
+    async def flush(self):
+        """Записывает накопленные изменения одной пачкой"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        records = [(kind, key, version, data) for (kind, key), (version, data) in batch.items()]
+        try:
+            await asyncio.to_thread(self.backend.save_many, records)
+        except Exception:
+            # Пачка вернется в очередь, если за это время не появилась более новая версия
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            raise
+
+    async def mark_seen(self, kind: str, key: int, ttl: int) -> bool:
+        """
+        Отмечает id в общем хранилище (один SETNX или INSERT): True - id встретился
+        впервые за ttl секунд среди всех процессов, использующих это хранилище
+        """
+        return await asyncio.to_thread(self.backend.mark_seen, kind, key, ttl)
+
+    async def drop_user_data(self, user_id: int):
+        key = (self.USER, user_id)
+        self._pending.pop(key, None)
+        self._versions.pop(key, None)
+        await asyncio.to_thread(self.backend.delete, self.USER, user_id)
+
+    # chat_data, bot_data, callback_data и диалоги ConversationHandler бот не хранит (store_data)
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
@@ -0,0 +1,69 @@
+import json
+import logging
+from pathlib import Path
+from string import Template
+from typing import Any, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CUSTOM_HANDLERS = '''def register_custom_handlers(application):
+    """Регистрирует собственные обработчики бота"""'''
+
+
+def _as_comment(text: str) -> str:
+    """Описание пользователя вставляется в код только как комментарий"""
+    return '\n'.join(f"# {line}".rstrip() for line in text.strip().splitlines())
+
+
+class TemplateLibrary:
+    """Библиотека параметризованных шаблонов ботов из Config.BOT_TEMPLATES_DIR"""
+
+    def __init__(self, templates_dir: str = None):
+        self.templates_dir = Path(templates_dir or Config.BOT_TEMPLATES_DIR)
+        self.manifest = {}
+        self._sources = {}
+
+        manifest_path = self.templates_dir / 'templates.json'
+        if not manifest_path.exists():
+            logger.warning(f"Bot templates manifest not found: {manifest_path}")
+            return
+
+        with open(manifest_path, encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        # Шаблоны читаются один раз при старте
+        for bot_type, meta in self.manifest.items():
+            self._sources[bot_type] = Template((self.templates_dir / meta['file']).read_text(encoding='utf-8'))
+        readme_path = self.templates_dir / 'README.md.tmpl'
+        self._readme = Template(readme_path.read_text(encoding='utf-8')) if readme_path.exists() else None
+
+    def has(self, bot_type: str) -> bool:
+        return bot_type in self._sources
+
+    def render(self, bot_type: str, user_prompt: str, custom_handlers: Optional[str] = None) -> Dict[str, Any]:
+        """Рендерит шаблон в результат того же вида, что и AIService.generate_bot_code"""
+        meta = self.manifest[bot_type]
+        description = _as_comment(user_prompt)
+
+        main_code = self._sources[bot_type].safe_substitute(
+            title=meta['title'],
+            description=description,
+            custom_handlers=custom_handlers or DEFAULT_CUSTOM_HANDLERS
+        )
+
+        files = {}
+        if self._readme:
+            files['README.md'] = self._readme.safe_substitute(
+                title=meta['title'],
+                summary=meta['summary'],
+                description=user_prompt.strip()
+            )
+
+        return {
+            "main_code": main_code,
+            "files": files,
+            "description": meta['summary'],
+            "requirements": list(meta['requirements'])
+        }
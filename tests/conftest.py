@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Config читает окружение при импорте: тесты не трогают рабочую базу и кэш
+_TEST_DIR = tempfile.mkdtemp(prefix='bot_creator_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}"
+os.environ['GENERATION_CACHE_BACKEND'] = 'none'
+os.environ['PERSISTENCE_BACKEND'] = 'memory'
+os.environ['RATE_LIMIT_BACKEND'] = 'memory'
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def run():
+    """Выполняет корутину в новом event loop; пул асинхронного движка к loop не привязывается"""
+    from database import async_engine
+
+    def runner(coroutine):
+        async def main():
+            try:
+                # Первое подключение нового пула открывается одно: одновременные
+                # первые подключения SQLAlchemy ждут друг друга на общем мьютексе
+                async with async_engine.connect():
+                    pass
+                return await coroutine
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(main())
+    return runner
+
+
+@pytest.fixture(scope='session')
+def tables():
+    from database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def make_user(tables):
+    """Создает пользователя в тестовой базе и возвращает users.id"""
+    from database import SessionLocal, User
+
+    def create(telegram_id: int, **fields) -> int:
+        db = SessionLocal()
+        try:
+            user = User(telegram_id=telegram_id, **fields)
+            db.add(user)
+            db.commit()
+            return user.id
+        finally:
+            db.close()
+    return create
@@ -0,0 +1,46 @@
+import pytest
+
+from ai_service import AIService
+from bot_classifier import BotTypeClassifier
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    return BotTypeClassifier()
+
+
+@pytest.fixture(scope='module')
+def ai_service():
+    return AIService()
+
+
+@pytest.mark.parametrize('prompt', [
+    "бот для заказа пиццы",
+    "канал с мемами",
+    "помощь с домашкой",
+])
+def test_single_weak_keyword_is_not_confident(classifier, ai_service, prompt):
+    bot_type, confidence = classifier.classify(prompt)
+    assert confidence < 0.5
+    assert ai_service.template_mode(prompt, bot_type, premium=False) is None
+
+
+def test_strong_description_is_confident(classifier, ai_service):
+    prompt = "Интернет магазин с каталогом товаров и корзиной"
+    bot_type, confidence = classifier.classify(prompt)
+    assert bot_type == 'ecommerce'
+    assert confidence == 1.0
+    assert ai_service.template_mode(prompt, bot_type, premium=False) == 'instant'
+    assert ai_service.template_mode(prompt, bot_type, premium=True) == 'customize'
+
+
+def test_close_runner_up_lowers_confidence(classifier):
+    # Магазин и поддержка набирают почти поровну - описание неоднозначно
+    bot_type, confidence, score = classifier.classify_with_score("магазин с техподдержкой")
+    assert bot_type == 'support'
+    assert score == 3.0
+    assert confidence < 0.5
+
+
+def test_no_keywords_is_general(classifier):
+    assert classifier.classify("бот для погоды") == ("general", 0.0)
@@ -0,0 +1,37 @@
+from code_validator import validate_code
+
+REQUIREMENTS = ["python-telegram-bot==20.7"]
+
+
+def test_sync_handler_function_is_flagged():
+    result = validate_code("def start(update, context):\n    pass\n", REQUIREMENTS)
+    assert not result['ok']
+    assert "обработчик 'start' должен быть async def" in result['errors'][0]
+
+
+def test_sync_handler_method_is_flagged():
+    code = (
+        "class Handlers:\n"
+        "    def start(self, update, context):\n"
+        "        pass\n"
+        "\n"
+        "    @classmethod\n"
+        "    def help(cls, update, context):\n"
+        "        pass\n"
+    )
+    result = validate_code(code, REQUIREMENTS)
+    assert not result['ok']
+    assert len(result['errors']) == 2
+    assert any("'start'" in error for error in result['errors'])
+    assert any("'help'" in error for error in result['errors'])
+
+
+def test_async_handler_method_passes():
+    code = (
+        "from telegram import Update\n"
+        "\n"
+        "class Handlers:\n"
+        "    async def start(self, update, context):\n"
+        "        pass\n"
+    )
+    assert validate_code(code, REQUIREMENTS) == {"ok": True, "errors": []}
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from database import AsyncSessionLocal, Generation
+from generation_jobs import GenerationJobStore, LeaseLostError
+
+
+async def create_job(store: GenerationJobStore, user_id: int, telegram_id: int, premium: bool = False):
+    return await store.create(
+        user_id=user_id, telegram_id=telegram_id, chat_id=telegram_id, message_id=None,
+        prompt="эхо бот", bot_type='echo', prompt_simhash=0, premium=premium
+    )
+
+
+async def expire_lease(job_id: int):
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Generation).where(Generation.id == job_id)
+            .values(lease_expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+        await db.commit()
+
+
+async def job_row(job_id: int) -> Generation:
+    async with AsyncSessionLocal() as db:
+        return await db.get(Generation, job_id)
+
+
+def test_expired_lease_is_claimed_once(run, make_user):
+    user_id = make_user(2001)
+    crashed, alive, other = (GenerationJobStore(owner=name) for name in ('crashed', 'alive', 'other'))
+
+    async def scenario():
+        job = await create_job(crashed, user_id, 2001)
+        await crashed.mark_running(job.id)
+        assert await alive.claim_expired() == []
+
+        await expire_lease(job.id)
+        claimed = await alive.claim_expired()
+        assert [record.id for record in claimed] == [job.id]
+        assert claimed[0].telegram_id == 2001 and claimed[0].attempts == 1
+        assert await other.claim_expired() == []
+
+        # Упавший процесс потерял аренду и не может ни продолжить, ни завершить задачу
+        with pytest.raises(LeaseLostError):
+            await crashed.mark_running(job.id)
+        assert not await crashed.fail(job.id, "late failure")
+
+        await alive.mark_running(job.id)
+        async with AsyncSessionLocal() as db:
+            assert await alive.complete(db, job.id, generated_code="print()")
+            await db.commit()
+
+        row = await job_row(job.id)
+        assert (row.status, row.attempts, row.lease_owner) == ('completed', 2, None)
+
+    run(scenario())
+
+
+def test_cancel_reaches_owning_process(run, make_user):
+    user_id = make_user(2002)
+    owner = GenerationJobStore(owner='owner')
+
+    async def scenario():
+        job = await create_job(owner, user_id, 2002, premium=True)
+        await owner.mark_running(job.id)
+
+        # Отмена может прийти в любой процесс; чужой пользователь задачу не отменит
+        assert await GenerationJobStore(owner='web').cancel(job.id, user_id + 1000) is None
+        assert await GenerationJobStore(owner='web').cancel(job.id, user_id) is True
+        assert await owner.cancel(job.id, user_id) is None
+
+        assert await owner.take_cancelled() == [job.id]
+        assert await owner.take_cancelled() == []
+        # Квоту за отмененную задачу вернул обработчик отмены - fail ее не вернет повторно
+        assert not await owner.fail(job.id, "cancelled")
+
+        row = await job_row(job.id)
+        assert (row.status, row.lease_owner) == ('cancelled', None)
+
+    run(scenario())
+
+
+def test_stop_releases_leases(run, make_user):
+    user_id = make_user(2003)
+    stopping, successor = GenerationJobStore(owner='stopping'), GenerationJobStore(owner='successor')
+
+    async def scenario():
+        job = await create_job(stopping, user_id, 2003)
+        await stopping.stop()
+        assert [record.id for record in await successor.claim_expired()] == [job.id]
+
+    run(scenario())
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from generation_queue import GenerationScheduler, QueueFullError
+
+
+def test_premium_first_and_round_robin_between_users(run):
+    async def scenario():
+        scheduler = GenerationScheduler(workers=1, max_queue=10)
+        await scheduler.start()
+        order = []
+        gate = asyncio.Event()
+
+        def job(name):
+            async def factory():
+                await gate.wait()
+                order.append(name)
+                return name
+            return factory
+
+        try:
+            # Первая задача сразу занимает воркер, остальные ждут
+            blocker = scheduler.submit(1, False, job('blocker'))
+            await asyncio.sleep(0)
+            jobs = [
+                scheduler.submit(1, False, job('free-1a')),
+                scheduler.submit(1, False, job('free-1b')),
+                scheduler.submit(2, False, job('free-2a')),
+                scheduler.submit(3, True, job('premium-3a')),
+            ]
+            assert [scheduler.position(queued) for queued in jobs] == [2, 4, 3, 1]
+            assert scheduler._positions() == {queued: scheduler.position(queued) for queued in jobs}
+
+            gate.set()
+            await asyncio.gather(blocker.future, *(queued.future for queued in jobs))
+            assert order == ['blocker', 'premium-3a', 'free-1a', 'free-2a', 'free-1b']
+        finally:
+            await scheduler.stop()
+
+    run(scenario())
+
+
+def test_queue_limit(run):
+    async def scenario():
+        scheduler = GenerationScheduler(workers=1, max_queue=1)
+        await scheduler.start()
+        try:
+            scheduler.submit(1, False, asyncio.Event().wait)
+            with pytest.raises(QueueFullError):
+                scheduler.submit(2, False, asyncio.Event().wait)
+        finally:
+            await scheduler.stop()
+
+    run(scenario())
+
+
+def test_cancel_frees_worker(run):
+    async def scenario():
+        scheduler = GenerationScheduler(workers=1, max_queue=10)
+        await scheduler.start()
+        try:
+            running = scheduler.submit(1, False, asyncio.Event().wait)
+            queued = scheduler.submit(2, False, asyncio.Event().wait)
+
+            async def done():
+                return 'done'
+            last = scheduler.submit(3, False, done)
+            await asyncio.sleep(0)
+
+            assert scheduler.cancel(queued)
+            assert queued.future.cancelled()
+            assert scheduler.cancel(running)
+
+            # Воркер не завис на отмененной задаче и взял следующую
+            assert await asyncio.wait_for(last.future, 1) == 'done'
+            assert not scheduler.cancel(last)
+            assert scheduler.metrics()['cancelled'] == 2
+        finally:
+            await scheduler.stop()
+
+    run(scenario())
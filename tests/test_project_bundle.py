@@ -0,0 +1,24 @@
+import io
+import zipfile
+
+from project_bundle import build_project_zip
+
+
+def _names(archive: bytes):
+    return sorted(zipfile.ZipFile(io.BytesIO(archive)).namelist())
+
+
+def test_project_is_packed_into_one_folder():
+    archive = build_project_zip('Bot_1', 'Эхо', "print('main')", {'requirements.txt': 'x\n', 'handlers/echo.py': ''})
+    assert _names(archive) == ['Bot_1/README.md', 'Bot_1/handlers/echo.py', 'Bot_1/main.py', 'Bot_1/requirements.txt']
+
+
+def test_archive_is_deterministic():
+    files = {'requirements.txt': 'x\n'}
+    assert build_project_zip('Bot_1', None, 'pass', files) == build_project_zip('Bot_1', None, 'pass', files)
+
+
+def test_unsafe_names_do_not_escape_the_folder():
+    files = {'../../evil.py': 'x', '/etc/evil.py': 'x', 'a//b.py': 'x', 'ok.py': 'x'}
+    archive = build_project_zip('../Bot_1', None, 'pass', files)
+    assert _names(archive) == ['bot/README.md', 'bot/main.py', 'bot/ok.py']
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from config import Config
+from quota import has_quota, is_premium_active, refund_generation, reserve_generation
+
+
+def profile(**fields):
+    values = dict(
+        is_premium=False, free_generations_used=0, premium_generations_used=0,
+        free_generations_limit=None, premium_generations_limit=None, premium_expires_at=None
+    )
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+
+def test_missing_limit_uses_default():
+    assert has_quota(profile(free_generations_used=Config.FREE_GENERATIONS - 1))
+    assert not has_quota(profile(free_generations_used=Config.FREE_GENERATIONS))
+
+
+def test_zero_limit_blocks_generation():
+    assert not has_quota(profile(free_generations_limit=0))
+    assert not has_quota(profile(is_premium=True, premium_generations_limit=0, free_generations_limit=0))
+
+
+def test_premium_falls_back_to_free_limit():
+    assert has_quota(profile(is_premium=True, premium_generations_limit=0, free_generations_limit=1))
+
+
+def test_expired_premium_uses_free_limit():
+    expired = datetime.utcnow() - timedelta(days=1)
+    assert not is_premium_active(profile(is_premium=True, premium_expires_at=expired))
+    assert is_premium_active(profile(is_premium=True, premium_expires_at=datetime.utcnow() + timedelta(days=1)))
+    assert not has_quota(profile(is_premium=True, premium_expires_at=expired, free_generations_limit=0))
+
+
+def used_generations(user_id: int):
+    from database import SessionLocal, User
+
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        return user.free_generations_used, user.premium_generations_used
+    finally:
+        db.close()
+
+
+def test_concurrent_reservations_stop_at_limit(run, make_user):
+    user_id = make_user(1001, free_generations_limit=3)
+
+    async def scenario():
+        return await asyncio.gather(*(reserve_generation(user_id, False) for _ in range(10)))
+
+    reservations = run(scenario())
+    assert sum(reservation is not None for reservation in reservations) == 3
+    assert used_generations(user_id) == (3, 0)
+
+
+def test_premium_falls_back_to_free_reservation(run, make_user):
+    user_id = make_user(1002, is_premium=True, premium_generations_limit=0, free_generations_limit=1)
+
+    reservation = run(reserve_generation(user_id, True))
+    assert reservation is not None and not reservation.premium
+    assert run(reserve_generation(user_id, True)) is None
+
+
+def test_refund_is_idempotent(run, make_user):
+    user_id = make_user(1003, free_generations_limit=2)
+
+    async def scenario():
+        reservation = await reserve_generation(user_id, False)
+        await refund_generation(reservation)
+        await refund_generation(reservation)
+
+    run(scenario())
+    assert used_generations(user_id) == (0, 0)
+
+
+def test_expired_premium_reserves_from_free_counter(run, make_user):
+    user_id = make_user(
+        1004, is_premium=True, premium_expires_at=datetime.utcnow() - timedelta(days=1), free_generations_limit=1
+    )
+
+    reservation = run(reserve_generation(user_id, True))
+    assert reservation is not None and not reservation.premium
+    assert used_generations(user_id) == (1, 0)
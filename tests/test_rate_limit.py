@@ -0,0 +1,38 @@
+import sys
+
+from rate_limit import MemoryBucketStore, RateLimiter
+
+
+def test_redis_backend_without_package_falls_back_to_memory(monkeypatch):
+    # None в sys.modules - import redis бросает ImportError, как без установленного пакета
+    monkeypatch.setitem(sys.modules, 'redis', None)
+    limiter = RateLimiter(backend='redis', buckets={'ui': (1, 1.0)})
+    assert isinstance(limiter.store, MemoryBucketStore)
+
+
+def test_zero_rate_bucket_is_disabled(run):
+    limiter = RateLimiter(backend='memory', buckets={'ui': (2, 0.0), 'generation': (1, 1 / 60)})
+    assert 'ui' not in limiter.buckets
+
+    async def scenario():
+        assert await limiter.acquire('ui', 1) == 0.0
+        assert await limiter.acquire('generation', 1) == 0.0
+        assert 59 < await limiter.acquire('generation', 1) <= 60
+
+    run(scenario())
+
+
+def test_refund_returns_tokens_without_overflowing(run):
+    limiter = RateLimiter(backend='memory', buckets={'openai_tokens': (10, 1 / 60)})
+
+    async def scenario():
+        assert await limiter.acquire('openai_tokens', cost=8) == 0.0
+        assert await limiter.acquire('openai_tokens', cost=8) > 0
+        await limiter.refund('openai_tokens', cost=8)
+        assert await limiter.acquire('openai_tokens', cost=8) == 0.0
+        # Лишний возврат не поднимает корзину выше емкости
+        await limiter.refund('openai_tokens', cost=100)
+        assert await limiter.acquire('openai_tokens', cost=10) == 0.0
+        assert await limiter.acquire('openai_tokens', cost=1) > 0
+
+    run(scenario())
@@ -0,0 +1,39 @@
+from response_parser import ResponseParser, parse_response, safe_filename
+
+
+def test_files_are_taken_from_headers():
+    response = (
+        "Эхо-бот\n"
+        "```python\n# main.py\nprint('main')\n```\n"
+        "```python\n# handlers/echo.py\nprint('echo')\n```\n"
+    )
+    bundle = parse_response(response)
+    assert bundle['main_code'] == "print('main')"
+    assert bundle['files']['handlers/echo.py'] == "print('echo')"
+    assert bundle['description'] == "Эхо-бот"
+
+
+def test_hostile_headers_are_dropped():
+    response = (
+        "```python\n# main.py\nprint('main')\n```\n"
+        "```python\n# ../../x.py\nprint('up')\n```\n"
+        "```python\n# /etc/x.py\nprint('root')\n```\n"
+        "```python\n# handlers//x.py\nprint('empty')\n```\n"
+        "```python\n# ../x.py\n# config.py\nprint('second header')\n```\n"
+    )
+    bundle = parse_response(response)
+    assert set(bundle['files']) == {'main.py'}
+    assert bundle['config'] is None
+
+
+def test_streamed_hostile_block_is_not_returned():
+    parser = ResponseParser()
+    completed = parser.feed("```python\n# ../x.py\nprint('up')\n```\n```python\n# main.py\npass\n```\n")
+    assert [block['filename'] for block in completed] == ['main.py']
+
+
+def test_safe_filename():
+    assert safe_filename('main.py') == 'main.py'
+    assert safe_filename('handlers/echo.py') == 'handlers/echo.py'
+    for name in ('../x.py', 'a/../../x.py', '/etc/x.py', 'a//x.py', './x.py', 'a\\..\\x.py', ''):
+        assert safe_filename(name) is None
@@ -0,0 +1,113 @@
+import asyncio
+
+from singleflight import RecentIds, SingleFlight
+
+
+def test_concurrent_calls_share_one_execution(run):
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        results = await asyncio.gather(*(flight.do('key', work) for _ in range(5)))
+        assert results == ['result'] * 5
+        assert calls == 1
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "shared": 4}
+
+    run(scenario())
+
+
+def test_work_is_cancelled_only_without_waiters(run):
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def work():
+            started.set()
+            await finish.wait()
+            return 'result'
+
+        first = asyncio.create_task(flight.do('key', work))
+        second = asyncio.create_task(flight.do('key', work))
+        await started.wait()
+
+        # Один из ожидающих ушел - работа продолжается для второго
+        first.cancel()
+        await asyncio.sleep(0)
+        assert flight.in_flight('key')
+        finish.set()
+        assert await second == 'result'
+
+        # Ушли все - работа отменяется
+        finish.clear()
+        started.clear()
+        only = asyncio.create_task(flight.do('key', work))
+        await started.wait()
+        only.cancel()
+        await asyncio.sleep(0.01)
+        assert not flight.in_flight('key')
+
+    run(scenario())
+
+
+def test_stream_delivers_events_to_each_waiter(run):
+    async def scenario():
+        flight = SingleFlight()
+        step = asyncio.Event()
+        received = {'first': [], 'late': [], 'cancelled': []}
+
+        def collect(name):
+            async def on_event(chunk):
+                received[name].append(chunk)
+            return on_event
+
+        async def failing(chunk):
+            raise RuntimeError("telegram is down")
+
+        async def work(publish):
+            await publish('a')
+            await step.wait()
+            step.clear()
+            await publish('b')
+            await step.wait()
+            await publish('c')
+            return 'done'
+
+        first = asyncio.create_task(flight.stream('key', work, collect('first')))
+        broken = asyncio.create_task(flight.stream('key', work, failing))
+        cancelled = asyncio.create_task(flight.stream('key', work, collect('cancelled')))
+        await asyncio.sleep(0.01)
+        assert received['cancelled'] == ['a']
+
+        # Отмененный вызывающий больше ничего не получает, работа продолжается для остальных
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        step.set()
+        await asyncio.sleep(0.01)
+
+        # Пришедший позже получает уже опубликованные события по порядку
+        late = asyncio.create_task(flight.stream('key', work, collect('late')))
+        await asyncio.sleep(0.01)
+        step.set()
+
+        assert await first == await late == await broken == 'done'
+        assert received == {'first': ['a', 'b', 'c'], 'late': ['a', 'b', 'c'], 'cancelled': ['a']}
+
+    run(scenario())
+
+
+def test_recent_ids_detects_duplicates():
+    recent = RecentIds(ttl=60, max_size=2)
+    assert recent.add(1)
+    assert not recent.add(1)
+    assert recent.add(2)
+    # Переполнение вытесняет самый старый id
+    assert recent.add(3)
+    assert recent.add(1)
+    assert recent.duplicates == 1
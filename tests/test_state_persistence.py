@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+import pytest
+
+from state_persistence import MemoryStateBackend, SQLiteStateBackend, StatePersistence
+
+
+class FlakyBackend(MemoryStateBackend):
+    """Первые failures записей падают, как недоступный Redis"""
+
+    def __init__(self, failures: int = 1, before_save=None):
+        super().__init__()
+        self.failures = failures
+        self.before_save = before_save
+
+    def save_many(self, records):
+        if self.before_save:
+            self.before_save()
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("backend unavailable")
+        super().save_many(records)
+
+
+def test_refresh_takes_only_newer_versions(run):
+    backend = MemoryStateBackend()
+    first, second = StatePersistence(backend), StatePersistence(backend)
+
+    async def scenario():
+        await first.update_user_data(1, {'step': 'first'})
+        await second.update_user_data(1, {'step': 'second'})
+
+        # Второй процесс записал позже - первый видит его данные
+        user_data = {'step': 'first'}
+        await first.refresh_user_data(1, user_data)
+        assert user_data == {'step': 'second'}
+
+        # Своя, уже последняя версия не перечитывается и не затирает живой словарь
+        user_data['step'] = 'local'
+        await first.refresh_user_data(1, user_data)
+        assert user_data == {'step': 'local'}
+
+    run(scenario())
+
+
+def test_older_version_does_not_overwrite_newer(run):
+    backend = MemoryStateBackend()
+    persistence = StatePersistence(backend)
+
+    async def scenario():
+        await persistence.update_user_data(1, {'step': 'new'})
+        version, _ = backend.load('user', 1)
+        backend.save_many([('user', 1, version - 1, json.dumps({'step': 'old'}))])
+        assert json.loads(backend.load('user', 1)[1]) == {'step': 'new'}
+
+    run(scenario())
+
+
+def test_failed_save_is_requeued(run):
+    backend = FlakyBackend(failures=1)
+    persistence = StatePersistence(backend)
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await persistence.update_user_data(1, {'step': 'unsaved'})
+        assert backend.load('user', 1) is None
+
+        await persistence.flush()
+        assert json.loads(backend.load('user', 1)[1]) == {'step': 'unsaved'}
+
+    run(scenario())
+
+
+def test_requeue_keeps_newer_pending_version(run):
+    backend = FlakyBackend(failures=1)
+    persistence = StatePersistence(backend)
+
+    def user_changes_data():
+        # Пока пачка пишется, пользователь успевает изменить данные
+        backend.before_save = None
+        persistence._pending[('user', 1)] = (2, json.dumps({'step': 'new'}))
+
+    async def scenario():
+        persistence._pending[('user', 1)] = (1, json.dumps({'step': 'old'}))
+        backend.before_save = user_changes_data
+        with pytest.raises(ConnectionError):
+            await persistence.flush()
+        assert persistence._pending[('user', 1)][0] == 2
+
+        await persistence.flush()
+        assert backend.load('user', 1) == (2, json.dumps({'step': 'new'}))
+
+    run(scenario())
+
+
+@pytest.mark.parametrize('backend_class', [MemoryStateBackend, SQLiteStateBackend])
+def test_mark_seen_is_shared_and_expires(tmp_path, backend_class, monkeypatch):
+    if backend_class is SQLiteStateBackend:
+        path = os.path.join(tmp_path, 'state.db')
+        # Два воркера вебхука открывают один файл
+        first, second = SQLiteStateBackend(path), SQLiteStateBackend(path)
+    else:
+        first = second = MemoryStateBackend()
+
+    assert first.mark_seen('update', 1, ttl=60)
+    assert not second.mark_seen('update', 1, ttl=60)
+    assert second.mark_seen('update', 2, ttl=60)
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert second.mark_seen('update', 1, ttl=60)
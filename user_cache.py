@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+
+from config import Config
+from database import User, async_engine
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfile:
+    """Снимок профиля пользователя, не привязанный к сессии БД"""
+
+    __slots__ = (
+        'id', 'telegram_id', 'username', 'first_name', 'last_name', 'is_premium',
+        'free_generations_used', 'premium_generations_used',
+        'free_generations_limit', 'premium_generations_limit', 'premium_expires_at'
+    )
+
+    def __init__(self, user: User):
+        for field in self.__slots__:
+            setattr(self, field, getattr(user, field))
+
+
+class UserProfileCache:
+    """
+    LRU профилей по telegram_id для обработчиков бота. Запись в профиль
+    сбрасывает его из кэша; TTL ограничивает устаревание после правок
+    из веб-админки. Время активности копится в памяти и записывается
+    пачкой раз в flush_interval секунд
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None, flush_interval: float = None):
+        self.max_size = max_size or Config.USER_CACHE_SIZE
+        self.ttl = ttl or Config.USER_CACHE_TTL
+        self.flush_interval = flush_interval or Config.ACTIVITY_FLUSH_INTERVAL
+        self._profiles = OrderedDict()
+        self._activity: Dict[int, datetime] = {}
+        self._flush_task = None
+        self.hits = 0
+        self.misses = 0
+        self.flushed = 0
+
+    def get(self, telegram_id: int) -> Optional[UserProfile]:
+        entry = self._profiles.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self._profiles.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user: User) -> UserProfile:
+        profile = UserProfile(user)
+        self._profiles[profile.telegram_id] = (time.monotonic() + self.ttl, profile)
+        self._profiles.move_to_end(profile.telegram_id)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate(self, telegram_id: int):
+        self._profiles.pop(telegram_id, None)
+
+    def touch(self, telegram_id: int):
+        """Отмечает активность пользователя; в БД попадет при следующем сбросе"""
+        self._activity[telegram_id] = datetime.utcnow()
+
+    async def start(self):
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает накопленную активность"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Записывает last_activity одним UPDATE на всю пачку пользователей"""
+        if not self._activity:
+            return 0
+        pending, self._activity = self._activity, {}
+
+        statement = (
+            update(User.__table__)
+            .where(User.__table__.c.telegram_id == bindparam('b_telegram_id'))
+            .values(last_activity=bindparam('b_last_activity'))
+        )
+        params = [
+            {"b_telegram_id": telegram_id, "b_last_activity": seen_at}
+            for telegram_id, seen_at in pending.items()
+        ]
+        try:
+            async with async_engine.begin() as connection:
+                await connection.execute(statement, params)
+        except Exception as e:
+            # Пачка вернется в буфер, если за это время не пришла более свежая активность
+            logger.warning(f"Activity flush failed for {len(pending)} users: {e}")
+            for telegram_id, seen_at in pending.items():
+                self._activity.setdefault(telegram_id, seen_at)
+            return 0
+
+        self.flushed += len(pending)
+        return len(pending)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "profiles": len(self._profiles),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_activity": len(self._activity),
+            "flushed": self.flushed
+        }
@@ -2,6 +2,7 @@ from flask import Flask, render_template, request, jsonify, redirect, url_for, f
 from sqlalchemy.orm import Session
 from database import get_db, User, Bot, Generation, create_tables
 from config import Config
+from bot_classifier import BotTypeClassifier
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
@@ -116,6 +117,11 @@ class AdminService:
         recent_bots = db.query(Bot).filter(Bot.created_at >= thirty_days_ago).count()
         recent_generations = db.query(Generation).filter(Generation.created_at >= thirty_days_ago).count()
         
+        # Качество сгенерированного кода: доля прошедших проверку и исправленных
+        validated = db.query(Generation).filter(Generation.validation_status.isnot(None)).count()
+        passed = db.query(Generation).filter(Generation.validation_status == 'passed').count()
+        repaired = db.query(Generation).filter(Generation.validation_status == 'repaired').count()
+        
         # Статистика доходов (имитация)
         monthly_revenue = premium_users * 299  # 299₽ за Premium
         total_revenue = monthly_revenue * 12  # Годовая выручка
@@ -128,6 +134,8 @@ class AdminService:
             "recent_users": recent_users,
             "recent_bots": recent_bots,
             "recent_generations": recent_generations,
+            "validation_pass_rate": round(passed / validated, 3) if validated else None,
+            "repair_rate": round(repaired / validated, 3) if validated else None,
             "monthly_revenue": monthly_revenue,
             "total_revenue": total_revenue
         }
@@ -725,6 +733,50 @@ def api_reset_generations(user_id):
     finally:
         db.close()
 
+@app.route("/api/generations/reclassify", methods=["POST"])
+def api_reclassify_generations():
+    """
+    API для переклассификации всей истории генераций по текущим категориям.
+    Меняется только bot_type в БД: запущенные процессы бота держат индекс похожих
+    описаний (загружается в post_init) и категории из bot_categories.json в памяти,
+    поэтому новые типы они увидят только после перезапуска
+    """
+    try:
+        db = next(get_db())
+        classifier = BotTypeClassifier()
+        counts = {}
+        batch_size = 1000
+        last_id = 0
+        
+        while True:
+            rows = db.query(Generation.id, Generation.prompt).filter(
+                Generation.id > last_id
+            ).order_by(Generation.id).limit(batch_size).all()
+            if not rows:
+                break
+            
+            results = classifier.classify_batch(row.prompt for row in rows)
+            db.bulk_update_mappings(Generation, [
+                {"id": row.id, "bot_type": bot_type}
+                for row, (bot_type, _) in zip(rows, results)
+            ])
+            db.commit()
+            
+            for bot_type, _ in results:
+                counts[bot_type] = counts.get(bot_type, 0) + 1
+            last_id = rows[-1].id
+        
+        return jsonify({
+            "success": True,
+            "total": sum(counts.values()),
+            "bot_types": counts
+        })
+    except Exception as e:
+        logger.error(f"Ошибка в api_reclassify_generations: {e}")
+        return jsonify({"error": "Ошибка переклассификации генераций"}), 500
+    finally:
+        db.close()
+
 if __name__ == "__main__":
     # Создаем таблицы при запуске
     create_tables()
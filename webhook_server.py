@@ -0,0 +1,148 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+from typing import Callable, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    aiohttp-приложение, которое принимает апдейты Telegram и ставит их
+    в очередь Application. Обработка идет параллельно, не больше
+    Config.CONCURRENT_UPDATES апдейтов одновременно
+    """
+
+    def __init__(self, application: Application, path: str = None, secret_token: Optional[str] = None):
+        self.application = application
+        self.path = path or Config.WEBHOOK_PATH
+        self.secret_token = secret_token
+        self.received = 0
+        self.rejected = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None:
+            token = request.headers.get(SECRET_TOKEN_HEADER, '')
+            if not hmac.compare_digest(token, self.secret_token):
+                self.rejected += 1
+                return web.Response(status=403)
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+
+        # Telegram ждет быстрый ответ: апдейт обрабатывается после ответа
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "pid": os.getpid(),
+            "received": self.received,
+            "rejected": self.rejected
+        })
+
+
+async def serve(application: Application, register: bool = True, reuse_port: bool = False):
+    """
+    Запускает Application без Updater и HTTP-сервер для вебхука.
+    register - зарегистрировать вебхук в Telegram (делает один воркер)
+    """
+    secret_token = Config.WEBHOOK_SECRET_TOKEN or None
+    if secret_token is None:
+        logger.warning("WEBHOOK_SECRET_TOKEN is not set: webhook requests are not authenticated")
+
+    server = WebhookServer(application, secret_token=secret_token)
+    runner = web.AppRunner(server.make_app(), access_log=None)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        if register and Config.TELEGRAM_WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=Config.TELEGRAM_WEBHOOK_URL,
+                secret_token=secret_token,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info(f"Webhook registered: {Config.TELEGRAM_WEBHOOK_URL}")
+
+        await application.start()
+        await runner.setup()
+        site = web.TCPSite(runner, Config.WEBHOOK_LISTEN, Config.WEBHOOK_PORT, reuse_port=reuse_port)
+        await site.start()
+        logger.info(f"Webhook server (pid {os.getpid()}) listening on "
+                    f"{Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}{server.path}")
+
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def _run_worker(create_application: Callable[[], Application], register: bool, reuse_port: bool):
+    asyncio.run(serve(create_application(), register=register, reuse_port=reuse_port))
+
+
+def run_webhook(create_application: Callable[[], Application]):
+    """
+    Режим вебхука. При WEBHOOK_WORKERS > 1 запускает несколько процессов
+    на одном порту (SO_REUSEPORT): ядро распределяет между ними соединения
+    от reverse proxy, вебхук регистрирует только первый воркер
+    """
+    if Config.TELEGRAM_WEBHOOK_URL and not Config.WEBHOOK_SECRET_TOKEN:
+        # Общий для всех воркеров секрет; Telegram передает его в каждом запросе
+        Config.WEBHOOK_SECRET_TOKEN = secrets.token_urlsafe(32)
+        os.environ['WEBHOOK_SECRET_TOKEN'] = Config.WEBHOOK_SECRET_TOKEN
+
+    workers = Config.WEBHOOK_WORKERS
+    if workers <= 1:
+        _run_worker(create_application, True, False)
+        return
+
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=_run_worker, args=(create_application, index == 0, True), name=f"webhook-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # SIGINT уже получили все процессы группы, воркеры завершаются сами
+        for process in processes:
+            process.join()